@@ -9,9 +9,21 @@ from urllib.error import URLError
 
 ROOT = Path(__file__).resolve().parents[4]
 REQUIRED_ENV = ["OPENAI_API_KEY", "OPENAI_MODEL", "OPENAI_EMBED_MODEL", "ALLOWED_ORIGINS"]
+
+
+def chroma_index_file() -> Path:
+    # Versioned indexes (ingest_sources.py --versioned) are served via the CURRENT pointer.
+    base = ROOT / "data" / "chroma_index"
+    pointer = base / "CURRENT"
+    if pointer.exists():
+        version = pointer.read_text(encoding="utf-8").strip()
+        return base / "versions" / version / "chroma.sqlite3"
+    return base / "chroma.sqlite3"
+
+
 REQUIRED_FILES = [
     ROOT / "data" / "offline_pack" / "offline_pack.json",
-    ROOT / "data" / "chroma_index" / "chroma.sqlite3",
+    chroma_index_file(),
 ]
 
 
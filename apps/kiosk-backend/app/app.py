@@ -14,7 +14,20 @@ from app.routers.health import router as health_router
 from app.routers.rag_test import router as rag_test_router
 from app.routers.diag import router as diag_router
 from app.routers.chat import router as chat_router
+from app.routers.suggest import router as suggest_router
+from app.routers.offline_pack import router as offline_pack_router
+from app.routers.analytics import router as analytics_router
 from app.db.sqlite import init_db, get_sqlite_path
+from app.services.admission_service import AdmissionMiddleware
+from app.services.offline_pack_service import get_offline_pack
+from app.services.analytics_maintenance_service import start_analytics_maintenance
+from app.services.analytics_rollup_service import start_analytics_rollups
+from app.services.heavy_hitters_service import start_heavy_hitters
+from app.services.logging_service import setup_logging
+from app.services.profiling_service import ProfilingMiddleware
+from app.services.tracing_service import TracingMiddleware
+from app.services.rag_service import start_index_watcher
+from app.services.suggest_service import get_suggest_index
 
 
 def create_app() -> FastAPI:
@@ -26,30 +39,45 @@ def create_app() -> FastAPI:
   if backend_env.exists():
     load_dotenv(backend_env, override=True)
   app = FastAPI()
-  logging.basicConfig(level=logging.INFO)
+  event_mode = os.getenv("EVENT_MODE", "false").lower() in ("1", "true", "yes")
+  setup_logging(event_mode)
   app.state.env_loaded_paths = env_loaded
   app.state.repo_root = repo_root
   app.state.build_timestamp = os.getenv("BUILD_TIMESTAMP") or datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
   allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:5175")
   dev_mode = os.getenv("KIOSK_DEV_MODE", "").lower() in ("1", "true", "yes")
-  event_mode = os.getenv("EVENT_MODE", "false").lower() in ("1", "true", "yes")
   app.state.dev_mode = dev_mode and not event_mode
   app.state.event_mode = event_mode
   origins = [o.strip() for o in allowed_origins.split(",") if o.strip()]
 
+  # Inside CORS, so a kiosk browser can read the 503 it sends when a route is full.
+  app.add_middleware(AdmissionMiddleware)
   app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Trace-Id"]
   )
 
+  # Inert unless dev mode is on; see /api/diag/profiles.
+  app.add_middleware(ProfilingMiddleware)
+  # Outermost, so a trace covers everything the request went through.
+  app.add_middleware(TracingMiddleware)
+
   @app.on_event("startup")
   def on_startup() -> None:
     logging.info("SQLite path: %s", get_sqlite_path())
     init_db()
+    pack = get_offline_pack()
+    logging.info("Offline pack version=%s entries=%d", pack.version, len(pack.entries))
+    get_suggest_index("EN")
+    start_index_watcher()
+    start_analytics_maintenance()
+    start_analytics_rollups()
+    start_heavy_hitters()
 
   app.include_router(ask_router, prefix="/api")
   app.include_router(guide_router, prefix="/api")
@@ -58,6 +86,9 @@ def create_app() -> FastAPI:
   app.include_router(rag_test_router, prefix="/api")
   app.include_router(diag_router, prefix="/api")
   app.include_router(chat_router, prefix="/api")
+  app.include_router(suggest_router, prefix="/api")
+  app.include_router(offline_pack_router, prefix="/api")
+  app.include_router(analytics_router, prefix="/api")
 
   return app
 
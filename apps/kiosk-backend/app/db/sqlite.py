@@ -1,58 +1,320 @@
 import os
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, List, Optional, Sequence, Set, Tuple
 
 def default_sqlite_path() -> str:
   repo_root = Path(__file__).resolve().parents[3]
   return str(repo_root / "data" / "analytics.sqlite")
 
-SCHEMA_SQL = """
-CREATE TABLE IF NOT EXISTS analytics (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  session_id TEXT NOT NULL,
-  lang TEXT,
-  mode TEXT NOT NULL,
-  rating_1_5 INTEGER,
-  time_on_screen_ms INTEGER,
-  route_used TEXT,
-  confidence REAL,
-  sources_count INTEGER,
-  error_code TEXT,
-  latency_ms INTEGER,
-  hashed_query TEXT,
-  ts TEXT NOT NULL
+# Events live in one table per UTC day of receipt, "analytics_YYYYMMDD", so the
+# partition being written stays small and old days can be archived by dropping a
+# table. Ids keep increasing across partitions (each new table's AUTOINCREMENT
+# sequence starts after the previous maximum) and `ts` is epoch milliseconds.
+# The `analytics` view is the UNION ALL of the live partitions, for readers.
+# Columns added later (trace_id) go at the end, so older partitions can be
+# ALTERed to the same shape and the view's SELECT * still lines up.
+PARTITION_PREFIX = "analytics_"
+PARTITION_SQL = (
+  """
+  CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    lang TEXT,
+    mode TEXT NOT NULL,
+    rating_1_5 INTEGER,
+    time_on_screen_ms INTEGER,
+    route_used TEXT,
+    confidence REAL,
+    sources_count INTEGER,
+    error_code TEXT,
+    latency_ms INTEGER,
+    hashed_query TEXT,
+    ts INTEGER NOT NULL,
+    trace_id TEXT
+  )
+  """,
+  "CREATE INDEX IF NOT EXISTS {table}_session ON {table} (session_id, mode)",
+  "CREATE INDEX IF NOT EXISTS {table}_ts ON {table} (ts)",
+  "CREATE INDEX IF NOT EXISTS {table}_query ON {table} (hashed_query) WHERE hashed_query IS NOT NULL",
+)
+
+PARTITIONS_SQL = """
+CREATE TABLE IF NOT EXISTS analytics_partitions (
+  day TEXT PRIMARY KEY,
+  first_id INTEGER NOT NULL,
+  created_ts INTEGER NOT NULL,
+  archived_ts INTEGER,
+  archive_path TEXT,
+  row_count INTEGER,
+  last_id INTEGER
 );
 """
 
+# Key/value state shared by every process using the DB (maintenance lease, last VACUUM...).
+META_SQL = """
+CREATE TABLE IF NOT EXISTS analytics_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Client-generated ids of ingested batch events; makes re-sent batches idempotent.
+CLIENT_EVENTS_SQL = """
+CREATE TABLE IF NOT EXISTS client_events (
+  event_id TEXT PRIMARY KEY,
+  received_ts TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Hourly aggregates of the events, kept up to date by analytics_rollup_service
+# (`rollup_last_id` in analytics_meta is the last event id folded in). Dashboards
+# read these instead of scanning events; they outlive the archived partitions.
+# NULL lang/route_used are stored as "" so they can be part of the key.
+ROLLUP_SQL = """
+CREATE TABLE IF NOT EXISTS analytics_hourly (
+  hour INTEGER NOT NULL,
+  lang TEXT NOT NULL,
+  mode TEXT NOT NULL,
+  route_used TEXT NOT NULL,
+  events INTEGER NOT NULL,
+  errors INTEGER NOT NULL,
+  error_codes TEXT NOT NULL,
+  latency_count INTEGER NOT NULL,
+  latency_sum INTEGER NOT NULL,
+  latency_max INTEGER NOT NULL,
+  latency_hist TEXT NOT NULL,
+  rating_count INTEGER NOT NULL,
+  rating_sum INTEGER NOT NULL,
+  confidence_count INTEGER NOT NULL,
+  confidence_sum REAL NOT NULL,
+  confidence_hist TEXT NOT NULL,
+  PRIMARY KEY (hour, lang, mode, route_used)
+) WITHOUT ROWID;
+"""
+
+# Host-wide heavy-hitter state (heavy_hitters_service): a Count-Min sketch of
+# hashed queries plus the current top-k hashes. Workers merge into it periodically.
+QUERY_SKETCH_SQL = """
+CREATE TABLE IF NOT EXISTS query_sketch (
+  name TEXT PRIMARY KEY,
+  width INTEGER NOT NULL,
+  depth INTEGER NOT NULL,
+  counts BLOB NOT NULL,
+  top TEXT NOT NULL,
+  total INTEGER NOT NULL,
+  decayed_ts INTEGER NOT NULL,
+  updated_ts INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+ANALYTICS_COLUMNS = (
+  "session_id", "lang", "mode", "rating_1_5", "time_on_screen_ms", "route_used",
+  "confidence", "sources_count", "error_code", "latency_ms", "hashed_query", "ts",
+  "trace_id",
+)
+# Added to the partition table after the first release; see _upgrade_partitions.
+LATE_COLUMNS = (("trace_id", "TEXT"),)
+# The chat session limit only looks this far back; sessions end long before.
+SESSION_LOOKBACK_DAYS = 1
+# SQLite caps a compound SELECT (the view) at 500 terms.
+MAX_LIVE_PARTITIONS = 400
+
+_DAY = re.compile(r"^\d{8}$")
+
+# (db path, day) pairs whose partition this process has already seen or created.
+_ready_partitions: Set[Tuple[str, str]] = set()
+_ready_lock = threading.Lock()
+
 
 def get_sqlite_path() -> str:
   return os.getenv("SQLITE_PATH", default_sqlite_path())
 
 
+def now_ms() -> int:
+  return int(time.time() * 1000)
+
+
+def utc_day(epoch_ms: Optional[int] = None) -> str:
+  seconds = (epoch_ms if epoch_ms is not None else now_ms()) / 1000
+  return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def partition_table(day: str) -> str:
+  if not _DAY.match(day):
+    raise ValueError(f"bad partition day {day!r}")
+  return PARTITION_PREFIX + day
+
+
+def live_partitions(conn: sqlite3.Connection) -> List[str]:
+  """Days with a live (not archived) partition, oldest first."""
+  return [row[0] for row in conn.execute(
+    "SELECT day FROM analytics_partitions WHERE archived_ts IS NULL ORDER BY day"
+  )]
+
+
+def rebuild_analytics_view(conn: sqlite3.Connection) -> None:
+  days = live_partitions(conn)[-MAX_LIVE_PARTITIONS:]
+  conn.execute("DROP VIEW IF EXISTS analytics")
+  if days:
+    union = " UNION ALL ".join(f"SELECT * FROM {partition_table(d)}" for d in days)
+    conn.execute(f"CREATE VIEW analytics AS {union}")
+
+
+def _last_id(conn: sqlite3.Connection) -> int:
+  row = conn.execute(
+    """
+    SELECT max(
+      COALESCE((SELECT max(last_id) FROM analytics_partitions), 0),
+      COALESCE((SELECT max(first_id) - 1 FROM analytics_partitions), 0)
+    )
+    """
+  ).fetchone()
+  last = int(row[0] or 0)
+  # sqlite_sequence only exists once an AUTOINCREMENT table has been created.
+  if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+    seq = conn.execute("SELECT max(seq) FROM sqlite_sequence WHERE name GLOB 'analytics_[0-9]*'").fetchone()
+    last = max(last, int(seq[0] or 0))
+  return last
+
+
+def ensure_partition(conn: sqlite3.Connection, day: str) -> str:
+  """Table for `day`, created (and the view rebuilt) if needed.
+
+  Must run inside a write transaction: the id seed is read under the same
+  lock every insert takes, so no other writer can slip a row in between.
+  """
+  table = partition_table(day)
+  key = (get_sqlite_path(), day)
+  if key in _ready_partitions:
+    return table
+  row = conn.execute("SELECT archived_ts FROM analytics_partitions WHERE day = ?", (day,)).fetchone()
+  if row is not None and row[0] is not None:
+    raise RuntimeError(f"analytics partition {day} is archived")
+  if row is None:
+    last_id = _last_id(conn)
+    for statement in PARTITION_SQL:
+      conn.execute(statement.format(table=table))
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, last_id))
+    conn.execute(
+      "INSERT INTO analytics_partitions (day, first_id, created_ts) VALUES (?, ?, ?)",
+      (day, last_id + 1, now_ms()),
+    )
+    rebuild_analytics_view(conn)
+  with _ready_lock:
+    _ready_partitions.add(key)
+  return table
+
+
+def forget_partition(day: str) -> None:
+  with _ready_lock:
+    _ready_partitions.discard((get_sqlite_path(), day))
+
+
+def _migrate_legacy_table(conn: sqlite3.Connection) -> None:
+  """Move a pre-partitioning `analytics` table (ISO text `ts`) into one partition.
+
+  The partition is named after the newest day in it, so retention archives it
+  once all of it is old; ids are kept, so they stay monotonic.
+  """
+  for col_def in ["lang TEXT", "confidence REAL", "sources_count INTEGER", "error_code TEXT"]:
+    try:
+      conn.execute(f"ALTER TABLE analytics ADD COLUMN {col_def}")
+    except sqlite3.OperationalError:
+      pass
+  ts_ms = (
+    "COALESCE(CAST(round((julianday(replace(substr(ts, 1, 23), 'Z', '')) - 2440587.5) * 86400000) AS INTEGER), 0)"
+  )
+  newest = conn.execute(f"SELECT max({ts_ms}) FROM analytics").fetchone()[0]
+  day = utc_day(int(newest)) if newest else utc_day()
+  table = partition_table(day)
+  for statement in PARTITION_SQL:
+    conn.execute(statement.format(table=table))
+  columns = ", ".join(c for c in ANALYTICS_COLUMNS if c not in ("ts", "trace_id"))
+  conn.execute(
+    f"INSERT INTO {table} (id, {columns}, ts) SELECT id, {columns}, {ts_ms} FROM analytics ORDER BY id"
+  )
+  first = conn.execute(f"SELECT min(id) FROM {table}").fetchone()[0]
+  conn.execute("DROP TABLE analytics")
+  conn.execute(
+    "INSERT OR IGNORE INTO analytics_partitions (day, first_id, created_ts) VALUES (?, ?, ?)",
+    (day, first or 1, now_ms()),
+  )
+
+
 def init_db() -> None:
   path = get_sqlite_path()
   Path(path).parent.mkdir(parents=True, exist_ok=True)
-  conn = sqlite3.connect(path)
+  conn = sqlite3.connect(path, timeout=10.0)
   try:
-    conn.execute(SCHEMA_SQL)
-    # best-effort add missing columns
-    for col_def in [
-      "lang TEXT",
-      "confidence REAL",
-      "sources_count INTEGER",
-      "error_code TEXT"
-    ]:
-      try:
-        conn.execute(f"ALTER TABLE analytics ADD COLUMN {col_def}")
-      except Exception:
-        pass
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(PARTITIONS_SQL)
+    conn.execute(META_SQL)
+    conn.execute(CLIENT_EVENTS_SQL)
+    conn.execute(ROLLUP_SQL)
+    conn.execute(QUERY_SKETCH_SQL)
+    legacy = conn.execute("SELECT type FROM sqlite_master WHERE name = 'analytics'").fetchone()
+    if legacy and legacy[0] == "table":
+      _migrate_legacy_table(conn)
+    _upgrade_partitions(conn)
+    ensure_partition(conn, utc_day())
+    rebuild_analytics_view(conn)
     conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
   finally:
     conn.close()
 
 
+def _upgrade_partitions(conn: sqlite3.Connection) -> None:
+  """Add LATE_COLUMNS to live partitions created before them."""
+  for day in live_partitions(conn):
+    table = partition_table(day)
+    have = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, col_type in LATE_COLUMNS:
+      if name not in have:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
+
+def _write_rows(rows: Sequence[Tuple], before_insert: Optional[Callable[[sqlite3.Connection], Sequence[Tuple]]] = None) -> Sequence[Tuple]:
+  """Insert ANALYTICS_COLUMNS rows into today's partition in one write transaction.
+
+  `before_insert` runs inside the transaction and may replace the rows.
+  """
+  for attempt in range(2):
+    conn = sqlite3.connect(get_sqlite_path(), timeout=5.0)
+    try:
+      # IMMEDIATE takes the write lock up front: the partition for "today" is
+      # decided under the lock, so ids stay monotonic across a day change.
+      conn.execute("BEGIN IMMEDIATE")
+      table = ensure_partition(conn, utc_day())
+      todo = before_insert(conn) if before_insert else rows
+      conn.executemany(
+        f"INSERT INTO {table} ({', '.join(ANALYTICS_COLUMNS)}) VALUES ({', '.join('?' * len(ANALYTICS_COLUMNS))})",
+        todo,
+      )
+      conn.commit()
+      return todo
+    except sqlite3.OperationalError as e:
+      conn.rollback()
+      if attempt or "no such table" not in str(e):
+        raise
+      # The DB was replaced or the partition dropped under us; re-check it.
+      with _ready_lock:
+        _ready_partitions.clear()
+    except Exception:
+      conn.rollback()
+      raise
+    finally:
+      conn.close()
+  return []
+
+
 def insert_analytics(
   session_id: str,
   mode: str,
@@ -64,43 +326,148 @@ def insert_analytics(
   sources_count: int | None,
   error_code: str | None,
   latency_ms: int | None,
-  hashed_query: str | None
+  hashed_query: str | None,
+  trace_id: str | None = None
 ) -> None:
+  _write_rows([(
+    session_id,
+    lang,
+    mode,
+    rating_1_5,
+    time_on_screen_ms,
+    route_used,
+    confidence,
+    sources_count,
+    error_code,
+    latency_ms,
+    hashed_query,
+    now_ms(),
+    trace_id
+  )])
+
+
+def get_session_message_count(session_id: str, mode: str = "chat") -> int:
+  """Events of a session in the recent partitions only (index lookups, no scan)."""
+  now = now_ms()
+  days = sorted({utc_day(now - d * 86400000) for d in range(SESSION_LOOKBACK_DAYS + 1)})
   conn = sqlite3.connect(get_sqlite_path())
   try:
-    conn.execute(
-      """
-      INSERT INTO analytics
-        (session_id, lang, mode, rating_1_5, time_on_screen_ms, route_used, confidence, sources_count, error_code, latency_ms, hashed_query, ts)
-      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-      """,
-      (
-        session_id,
-        lang,
-        mode,
-        rating_1_5,
-        time_on_screen_ms,
-        route_used,
-        confidence,
-        sources_count,
-        error_code,
-        latency_ms,
-        hashed_query,
-        datetime.utcnow().isoformat() + "Z"
-      )
-    )
-    conn.commit()
+    placeholders = ",".join("?" * len(days))
+    live = [row[0] for row in conn.execute(
+      f"SELECT day FROM analytics_partitions WHERE archived_ts IS NULL AND day IN ({placeholders})", days
+    )]
+    total = 0
+    for day in live:
+      row = conn.execute(
+        f"SELECT COUNT(1) FROM {partition_table(day)} WHERE session_id = ? AND mode = ?",
+        (session_id, mode),
+      ).fetchone()
+      total += int(row[0]) if row and row[0] is not None else 0
+    return total
   finally:
     conn.close()
 
 
-def get_session_message_count(session_id: str, mode: str = "chat") -> int:
+EXPORT_COLUMNS = ("id",) + ANALYTICS_COLUMNS
+
+
+def analytics_id_range() -> Tuple[int, int]:
+  """(oldest id still in a live partition, newest id); (0, 0) when empty."""
   conn = sqlite3.connect(get_sqlite_path())
   try:
-    row = conn.execute(
-      "SELECT COUNT(1) FROM analytics WHERE session_id = ? AND mode = ?",
-      (session_id, mode),
-    ).fetchone()
-    return int(row[0]) if row and row[0] is not None else 0
+    oldest, newest = 0, 0
+    for day in live_partitions(conn):
+      low, high = conn.execute(f"SELECT min(id), max(id) FROM {partition_table(day)}").fetchone()
+      if low is not None and not oldest:
+        oldest = int(low)
+      if high is not None:
+        newest = max(newest, int(high))
+    return oldest, newest
   finally:
     conn.close()
+
+
+def analytics_rows_after(conn: sqlite3.Connection, after_id: int, limit: int) -> List[Tuple]:
+  """Up to `limit` EXPORT_COLUMNS rows with id > after_id, in id order, across live partitions."""
+  columns = ", ".join(EXPORT_COLUMNS)
+  rows: List[Tuple] = []
+  for day in live_partitions(conn):
+    if len(rows) >= limit:
+      break
+    rows.extend(conn.execute(
+      f"SELECT {columns} FROM {partition_table(day)} WHERE id > ? ORDER BY id LIMIT ?",
+      (after_id, limit - len(rows)),
+    ))
+  return rows
+
+
+def iter_analytics_pages(since_id: int, until_id: int, page_size: int = 1000) -> Iterator[List[Tuple]]:
+  """Rows with since_id < id <= until_id, in id order, one page per short read.
+
+  Keyset pagination on the primary key of each live partition: no read
+  transaction stays open between pages, so writers are never held up.
+  Pages may be pulled from different threads (streaming responses), one at a time.
+  """
+  conn = sqlite3.connect(get_sqlite_path(), check_same_thread=False)
+  try:
+    days = live_partitions(conn)
+    columns = ", ".join(EXPORT_COLUMNS)
+    for day in days:
+      table = partition_table(day)
+      cursor_id = since_id
+      while cursor_id < until_id:
+        try:
+          rows = conn.execute(
+            f"SELECT {columns} FROM {table} WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+            (cursor_id, until_id, page_size),
+          ).fetchall()
+        except sqlite3.OperationalError:
+          # Archived while we were reading; its rows are in the archive file.
+          break
+        if not rows:
+          break
+        yield rows
+        cursor_id = rows[-1][0]
+  finally:
+    conn.close()
+
+
+def insert_client_events(events: Sequence[Tuple[str, Tuple]]) -> Tuple[int, List[str]]:
+  """Insert (event_id, analytics row) pairs in one transaction, skipping known ids.
+
+  Rows follow ANALYTICS_COLUMNS. Returns (inserted count, duplicate event ids).
+  """
+  if not events:
+    return 0, []
+  duplicates: List[str] = []
+
+  def fresh_rows(conn: sqlite3.Connection) -> List[Tuple]:
+    # Runs under the write lock, so the duplicate check and the inserts cannot
+    # interleave with another batch carrying the same ids.
+    duplicates.clear()
+    ids = [event_id for event_id, _ in events]
+    known = set()
+    for i in range(0, len(ids), 500):
+      chunk = ids[i:i + 500]
+      known.update(
+        row[0] for row in conn.execute(
+          f"SELECT event_id FROM client_events WHERE event_id IN ({','.join('?' * len(chunk))})",
+          chunk,
+        )
+      )
+    fresh = []
+    for event_id, row in events:
+      if event_id in known:
+        duplicates.append(event_id)
+        continue
+      known.add(event_id)
+      fresh.append((event_id, row))
+    received = datetime.utcnow().isoformat() + "Z"
+    conn.executemany(
+      "INSERT INTO client_events (event_id, received_ts) VALUES (?, ?)",
+      [(event_id, received) for event_id, _ in fresh],
+    )
+    return [row for _, row in fresh]
+
+  inserted = _write_rows([], before_insert=fresh_rows)
+  return len(inserted), list(duplicates)
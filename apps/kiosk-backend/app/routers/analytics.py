@@ -0,0 +1,62 @@
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.db.sqlite import analytics_id_range
+from app.schemas.analytics import AnalyticsSummaryResponse
+from app.services.analytics_export_service import MEDIA_TYPES, export_allowed, open_export
+from app.services.analytics_rollup_service import GROUP_KEYS, summarize
+
+router = APIRouter()
+
+
+@router.get("/analytics/export")
+def analytics_export(
+  request: Request,
+  format: str = "ndjson",
+  since: int = 0,
+  until: int | None = None,
+  authorization: str | None = Header(default=None),
+) -> StreamingResponse:
+  if not export_allowed(getattr(request.app.state, "dev_mode", False), authorization):
+    raise HTTPException(status_code=404, detail="Not found")
+  fmt = format.lower()
+  if fmt not in MEDIA_TYPES:
+    raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+  oldest, newest = analytics_id_range()
+  # Rows written after this point belong to the next pull (since = X-Export-Until).
+  until_id = newest if until is None else max(0, min(until, newest))
+  since_id = max(0, since)
+  compress = "gzip" in request.headers.get("accept-encoding", "").lower()
+  stream = open_export(fmt, since_id, until_id, compress)
+  if stream is None:
+    raise HTTPException(status_code=429, detail="Too many exports running", headers={"Retry-After": "30"})
+  headers = {
+    "X-Export-Since": str(since_id),
+    "X-Export-Until": str(until_id),
+    "X-Export-Oldest-Id": str(oldest),
+    "Content-Disposition": f'attachment; filename="analytics-{since_id}-{until_id}.{fmt}"',
+    "Cache-Control": "no-store",
+    "Vary": "Accept-Encoding",
+  }
+  if compress:
+    headers["Content-Encoding"] = "gzip"
+  return StreamingResponse(stream, media_type=MEDIA_TYPES[fmt], headers=headers)
+
+
+@router.get("/analytics/summary", response_model=AnalyticsSummaryResponse)
+def analytics_summary(
+  request: Request,
+  hours: int = 24,
+  group_by: str = "lang,mode,route_used",
+  lang: str | None = None,
+  mode: str | None = None,
+  route: str | None = None,
+  authorization: str | None = Header(default=None),
+) -> AnalyticsSummaryResponse:
+  if not export_allowed(getattr(request.app.state, "dev_mode", False), authorization):
+    raise HTTPException(status_code=404, detail="Not found")
+  keys = [k.strip() for k in group_by.split(",") if k.strip()]
+  if any(k not in GROUP_KEYS for k in keys) or len(set(keys)) != len(keys):
+    raise HTTPException(status_code=400, detail=f"group_by must be a subset of {', '.join(GROUP_KEYS)}")
+  if not 1 <= hours <= 24 * 400:
+    raise HTTPException(status_code=400, detail="hours must be between 1 and 9600")
+  return summarize(hours, keys, lang=lang, mode=mode, route_used=route)
@@ -1,12 +1,22 @@
-from fastapi import APIRouter
-from app.schemas.ask import AskRequest, AskResponse
+from fastapi import APIRouter, HTTPException, Request
+from app.schemas.ask import AskBatchRequest, AskBatchResponse, AskRequest, AskResponse
+from app.services.ask_batch_service import answer_batch
 from app.services.ask_service import answer_query, safe_response
+from app.services.deadline_service import new_deadline
 
 router = APIRouter()
 
 @router.post("/ask", response_model=AskResponse)
 def ask(payload: AskRequest) -> AskResponse:
+  deadline = new_deadline()
   try:
-    return answer_query(payload)
+    return answer_query(payload, deadline=deadline)
   except Exception:
     return safe_response()
+
+@router.post("/ask/batch", response_model=AskBatchResponse)
+def ask_batch(payload: AskBatchRequest, request: Request) -> AskBatchResponse:
+  # Hundreds of LLM calls per request: evaluation tooling only, never on a kiosk.
+  if not getattr(request.app.state, "dev_mode", False):
+    raise HTTPException(status_code=404, detail="Not found")
+  return answer_batch(payload.items, concurrency=payload.concurrency, record_analytics=payload.record_analytics)
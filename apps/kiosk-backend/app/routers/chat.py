@@ -3,14 +3,15 @@ from fastapi.responses import StreamingResponse
 
 from app.schemas.chat import ChatRequest
 from app.services.chat_service import stream_chat_response
+from app.services.deadline_service import new_deadline
 
 router = APIRouter()
 
 @router.post("/chat")
 async def chat(payload: ChatRequest):
-  print("new request")
+  deadline = new_deadline()
   return StreamingResponse(
-    stream_chat_response(payload),
+    stream_chat_response(payload, deadline=deadline),
     media_type="text/event-stream",
     headers={
       "Cache-Control": "no-cache",
@@ -1,8 +1,16 @@
 import os
 from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import PlainTextResponse
 from app.db.sqlite import get_sqlite_path
-from app.services.rag_service import get_chroma_path
+from app.services.rag_service import get_chroma_path, get_embed_model, get_index_version, get_vector_store_info, reload_index
 from app.services.ask_service import get_last_openai_error
+from app.services.cache_service import cache_stats
+from app.services.admission_service import admission_stats
+from app.services.heavy_hitters_service import heavy_hitters_stats
+from app.services.logging_service import logging_stats
+from app.services.ratelimit_service import ratelimit_stats
+from app.services.profiling_service import get_profile, get_sample_rate, list_profiles, merged_collapsed, set_sample_rate
+from app.services.tracing_service import get_trace, recent_traces
 
 router = APIRouter()
 
@@ -17,9 +25,81 @@ def diag(request: Request):
   return {
     "openai_key_present": bool(os.getenv("OPENAI_API_KEY")),
     "openai_model": os.getenv("OPENAI_MODEL", ""),
-    "embed_model": os.getenv("OPENAI_EMBED_MODEL", ""),
+    "embed_model": get_embed_model(),
     "chroma_path": get_chroma_path(),
+    "index_version": get_index_version(),
+    "vector_store": get_vector_store_info(),
+    "cache": cache_stats(),
+    "heavy_hitters": heavy_hitters_stats(),
+    "logging": logging_stats(),
+    "admission": admission_stats(),
+    "rate_limits": ratelimit_stats(),
     "sqlite_path": get_sqlite_path(),
     "env_loaded_paths": env_paths,
     "last_openai_error": get_last_openai_error()
   }
+
+
+@router.post("/diag/reload_index")
+def diag_reload_index(request: Request, force: bool = False):
+  dev_mode = getattr(request.app.state, "dev_mode", False)
+  if not dev_mode:
+    raise HTTPException(status_code=404, detail="Not found")
+  try:
+    return reload_index(force=force)
+  except Exception as e:
+    raise HTTPException(status_code=503, detail=f"Index reload failed: {type(e).__name__}")
+
+
+@router.get("/diag/profiles")
+def diag_profiles(request: Request, format: str = "json", path: str | None = None):
+  """Stored request profiles; format=collapsed merges their stacks for a flamegraph."""
+  dev_mode = getattr(request.app.state, "dev_mode", False)
+  if not dev_mode:
+    raise HTTPException(status_code=404, detail="Not found")
+  if format == "collapsed":
+    return PlainTextResponse(merged_collapsed(path))
+  profiles = list_profiles()
+  if path is not None:
+    profiles = [p for p in profiles if p["path"] == path]
+  return {"sample_rate": get_sample_rate(), "profiles": profiles}
+
+
+@router.get("/diag/profiles/{profile_id}")
+def diag_profile(request: Request, profile_id: int, format: str = "collapsed"):
+  dev_mode = getattr(request.app.state, "dev_mode", False)
+  if not dev_mode:
+    raise HTTPException(status_code=404, detail="Not found")
+  profile = get_profile(profile_id)
+  if profile is None:
+    raise HTTPException(status_code=404, detail="Profile not found")
+  if format == "collapsed":
+    return PlainTextResponse(profile.collapsed())
+  return {**profile.summary(), "stacks": dict(profile.stacks.most_common()), "memory": profile.memory}
+
+
+@router.post("/diag/profiles/sample_rate")
+def diag_profile_sample_rate(request: Request, rate: float):
+  dev_mode = getattr(request.app.state, "dev_mode", False)
+  if not dev_mode:
+    raise HTTPException(status_code=404, detail="Not found")
+  return {"sample_rate": set_sample_rate(rate)}
+
+
+@router.get("/diag/traces")
+def diag_traces(request: Request, slow: bool = False, limit: int = 50):
+  dev_mode = getattr(request.app.state, "dev_mode", False)
+  if not dev_mode:
+    raise HTTPException(status_code=404, detail="Not found")
+  return {"traces": recent_traces(slow_only=slow, limit=max(1, min(limit, 500)))}
+
+
+@router.get("/diag/traces/{trace_id}")
+def diag_trace(request: Request, trace_id: str):
+  dev_mode = getattr(request.app.state, "dev_mode", False)
+  if not dev_mode:
+    raise HTTPException(status_code=404, detail="Not found")
+  trace = get_trace(trace_id)
+  if trace is None:
+    raise HTTPException(status_code=404, detail="Trace not found (only recent traces are kept)")
+  return trace
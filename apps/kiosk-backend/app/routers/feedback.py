@@ -1,9 +1,13 @@
 from fastapi import APIRouter
-from app.schemas.feedback import FeedbackRequest, FeedbackResponse
-from app.services.feedback_service import record_feedback
+from app.schemas.feedback import FeedbackBatchRequest, FeedbackBatchResponse, FeedbackRequest, FeedbackResponse
+from app.services.feedback_service import record_feedback, record_feedback_batch
 
 router = APIRouter()
 
 @router.post("/feedback", response_model=FeedbackResponse)
 def feedback(payload: FeedbackRequest) -> FeedbackResponse:
   return record_feedback(payload)
+
+@router.post("/feedback/batch", response_model=FeedbackBatchResponse)
+def feedback_batch(payload: FeedbackBatchRequest) -> FeedbackBatchResponse:
+  return record_feedback_batch(payload)
@@ -1,9 +1,14 @@
-from fastapi import APIRouter
+import time
+from fastapi import APIRouter, BackgroundTasks
 from app.schemas.guide import GuideRequest, GuideResponse
-from app.services.guide_service import build_checklist
+from app.services.guide_service import build_checklist, record_guide_event
 
 router = APIRouter()
 
 @router.post("/guide", response_model=GuideResponse)
-def guide(payload: GuideRequest) -> GuideResponse:
-  return build_checklist(payload)
+def guide(payload: GuideRequest, background_tasks: BackgroundTasks) -> GuideResponse:
+  start = time.time()
+  response = build_checklist(payload)
+  # The analytics write runs after the response is sent.
+  background_tasks.add_task(record_guide_event, payload.lang, int((time.time() - start) * 1000))
+  return response
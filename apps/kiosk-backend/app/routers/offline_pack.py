@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from app.services.offline_sync_service import get_sync_payload
+
+router = APIRouter()
+
+SUPPORTED_LANGS = ("EN", "AR", "FR")
+
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+  if not header:
+    return False
+  if header.strip() == "*":
+    return True
+  for candidate in header.split(","):
+    value = candidate.strip()
+    if value.startswith("W/"):
+      value = value[2:]
+    if value.strip('"').removesuffix("-gz") == etag:
+      return True
+  return False
+
+
+@router.get("/offline_pack")
+def offline_pack(request: Request, lang: str | None = None, since: str | None = None) -> Response:
+  lang = lang.upper() if lang else None
+  if lang is not None and lang not in SUPPORTED_LANGS:
+    raise HTTPException(status_code=400, detail="Unsupported lang")
+  payload = get_sync_payload(lang, since)
+  use_gzip = "gzip" in request.headers.get("accept-encoding", "").lower()
+  headers = {
+    "ETag": f'"{payload.etag}-gz"' if use_gzip else f'"{payload.etag}"',
+    "Cache-Control": "no-cache",
+    "Vary": "Accept-Encoding",
+  }
+  if _etag_matches(request.headers.get("if-none-match"), payload.etag):
+    return Response(status_code=304, headers=headers)
+  if use_gzip:
+    headers["Content-Encoding"] = "gzip"
+    return Response(content=payload.gzip_body, media_type="application/json", headers=headers)
+  return Response(content=payload.body, media_type="application/json", headers=headers)
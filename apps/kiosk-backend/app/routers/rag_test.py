@@ -1,5 +1,6 @@
-from fastapi import APIRouter
-from app.schemas.rag_test import RagTestRequest, RagTestResponse, RagTestResult
+from fastapi import APIRouter, HTTPException, Request
+from app.schemas.rag_test import RagEvalRequest, RagEvalResponse, RagTestRequest, RagTestResponse, RagTestResult
+from app.services.rag_eval_service import evaluate_retrieval
 from app.services.rag_service import retrieve
 
 router = APIRouter()
@@ -22,3 +23,11 @@ def rag_test(payload: RagTestRequest) -> RagTestResponse:
     for s in sources
   ]
   return RagTestResponse(results=results, confidence=confidence)
+
+
+@router.post("/rag_test/eval", response_model=RagEvalResponse)
+def rag_test_eval(payload: RagEvalRequest, request: Request) -> RagEvalResponse:
+  # Runs every pack variant through retrieval several times: tooling only.
+  if not getattr(request.app.state, "dev_mode", False):
+    raise HTTPException(status_code=404, detail="Not found")
+  return evaluate_retrieval(payload.langs, payload.top_ks, repeats=payload.repeats)
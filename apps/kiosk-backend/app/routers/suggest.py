@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Query
+from app.schemas.suggest import SuggestResponse
+from app.services.offline_pack_service import get_offline_pack
+from app.services.suggest_service import MAX_LIMIT, suggest
+
+router = APIRouter()
+
+@router.get("/suggest", response_model=SuggestResponse)
+def suggest_questions(
+  lang: str = "EN",
+  q: str = Query("", max_length=200),
+  limit: int = Query(5, ge=1, le=MAX_LIMIT),
+) -> SuggestResponse:
+  return SuggestResponse(
+    suggestions=suggest(q, lang.upper(), limit),
+    pack_version=get_offline_pack().version,
+  )
@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+from typing import Dict, List
+
+
+class AnalyticsSummaryGroup(BaseModel):
+  hour: int | None = None
+  lang: str | None = None
+  mode: str | None = None
+  route_used: str | None = None
+  events: int
+  errors: int
+  error_rate: float
+  error_codes: Dict[str, int]
+  latency_avg_ms: float | None = None
+  latency_p50_ms: float | None = None
+  latency_p95_ms: float | None = None
+  latency_max_ms: int | None = None
+  latency_histogram: List[int]
+  rating_count: int
+  rating_avg: float | None = None
+  confidence_avg: float | None = None
+  confidence_histogram: List[int]
+
+
+class AnalyticsSummaryResponse(BaseModel):
+  since_hour: int
+  until_hour: int
+  group_by: List[str]
+  latency_buckets_ms: List[int]
+  rolled_up_to: int
+  pending_events: int
+  total: AnalyticsSummaryGroup
+  groups: List[AnalyticsSummaryGroup]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Literal, Optional
+from typing import Dict, List, Literal, Optional
 
 class AskRequest(BaseModel):
   lang: str = Field(..., description="EN/AR/FR")
@@ -35,3 +35,13 @@ class AskResponse(BaseModel):
   error_message: Optional[str] = None
   debug_notes: Optional[str] = None
   general_mode: Optional[bool] = None
+
+class AskBatchRequest(BaseModel):
+  items: List[AskRequest] = Field(..., max_length=1000)
+  concurrency: int = Field(4, ge=1, le=32)
+  record_analytics: bool = False
+
+class AskBatchResponse(BaseModel):
+  results: List[AskResponse]
+  timings_ms: Dict[str, int]
+  routes: Dict[str, int]
@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Any, List, Literal
 
 class FeedbackRequest(BaseModel):
   session_id: str
@@ -9,3 +10,30 @@ class FeedbackRequest(BaseModel):
 
 class FeedbackResponse(BaseModel):
   ok: bool
+
+class ClientEvent(BaseModel):
+  event_id: str = Field(..., min_length=8, max_length=64)
+  type: Literal["feedback", "timing"]
+  session_id: str = Field(..., min_length=1, max_length=128)
+  lang: str | None = None
+  rating_1_5: int | None = Field(None, ge=1, le=5)
+  time_on_screen_ms: int | None = Field(None, ge=0)
+  route_used: str | None = None
+  confidence: float | None = Field(None, ge=0.0, le=1.0)
+  latency_ms: int | None = Field(None, ge=0)
+  client_ts: str | None = None
+
+class FeedbackBatchRequest(BaseModel):
+  # Raw dicts so one malformed event is rejected on its own, not the whole batch.
+  events: List[Any] = Field(..., max_length=500)
+
+class RejectedEvent(BaseModel):
+  index: int
+  event_id: str | None = None
+  reason: str
+
+class FeedbackBatchResponse(BaseModel):
+  ok: bool
+  accepted: int
+  duplicates: int
+  rejected: List[RejectedEvent]
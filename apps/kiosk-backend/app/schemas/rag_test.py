@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List
 
 
@@ -22,3 +22,41 @@ class RagTestResult(BaseModel):
 class RagTestResponse(BaseModel):
   results: List[RagTestResult]
   confidence: float
+
+
+class RagEvalRequest(BaseModel):
+  langs: List[str] | None = None
+  top_ks: List[int] = Field(default_factory=lambda: [1, 3, 5, 10], min_length=1, max_length=8)
+  repeats: int = Field(default=1, ge=1, le=10)
+
+
+class RagEvalAtK(BaseModel):
+  top_k: int
+  recall: float
+  hit_rate: float
+  latency_p50_ms: float
+  latency_p95_ms: float
+
+
+class RagEvalConfidence(BaseModel):
+  mean: float
+  p50: float
+  above_threshold: float
+  confident_misses: int
+  histogram: List[int]
+
+
+class RagEvalLang(BaseModel):
+  lang: str
+  queries: int
+  skipped: int
+  mrr: float
+  at_k: List[RagEvalAtK]
+  confidence: RagEvalConfidence
+
+
+class RagEvalResponse(BaseModel):
+  index_version: str
+  embed_model: str
+  threshold: float
+  langs: List[RagEvalLang]
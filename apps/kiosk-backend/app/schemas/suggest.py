@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+from typing import List
+
+class SuggestResponse(BaseModel):
+  suggestions: List[str]
+  pack_version: str
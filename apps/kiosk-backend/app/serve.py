@@ -0,0 +1,149 @@
+"""Pre-fork multi-worker launcher (Linux/macOS).
+
+Loads the read-only data every worker needs once in the master, freezes it
+out of the garbage collector and forks the workers, so the offline pack,
+keyword tables, n-gram and embedding matrices and imported libraries are
+shared copy-on-write instead of being rebuilt per worker.
+
+  python -m app.serve --workers 4 --port 8005
+
+DB connections, the HTTP session and the Chroma client are opened lazily in
+each worker after the fork.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+# Workers that die faster than this after starting are restarted with a delay.
+MIN_WORKER_UPTIME_SEC = 5.0
+RESTART_DELAY_SEC = 2.0
+
+
+def preload() -> None:
+  from app.services.offline_pack_service import get_offline_pack
+  from app.services.suggest_service import get_suggest_index
+
+  pack = get_offline_pack()
+  for lang in pack.langs:
+    get_suggest_index(lang)
+  from app.services.rag_service import VECTOR_STORE, _use_cloud, get_collection, resolve_index_dir
+  from app.services.vector_store_service import open_compact_index
+
+  if VECTOR_STORE == "compact" and not _use_cloud() and open_compact_index(resolve_index_dir()[0]) is not None:
+    # Read-only memory maps: opened once here, their pages are shared by every worker.
+    get_collection()
+  else:
+    try:
+      # Importing is enough to share its code pages; the client is opened per worker.
+      import chromadb  # noqa: F401
+    except Exception:
+      pass
+  logging.info("preloaded offline pack version=%s entries=%d", pack.version, len(pack.entries))
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+  sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  sock.bind((host, port))
+  sock.listen(2048)
+  sock.set_inheritable(True)
+  return sock
+
+
+def run_worker(app, sock: socket.socket, log_level: str) -> None:
+  import uvicorn
+
+  gc.enable()
+  # log_config=None: keep the app's queue-based logging instead of uvicorn's handlers.
+  config = uvicorn.Config(app, log_level=log_level, log_config=None, timeout_keep_alive=5)
+  uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(app, sock: socket.socket, log_level: str) -> int:
+  pid = os.fork()
+  if pid == 0:
+    code = 0
+    try:
+      for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_DFL)
+      run_worker(app, sock, log_level)
+    except BaseException:
+      logging.exception("worker %d crashed", os.getpid())
+      code = 1
+    finally:
+      os._exit(code)
+  return pid
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Run the kiosk backend with pre-forked workers.")
+  parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+  parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8005")))
+  parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+  parser.add_argument("--log-level", default="info")
+  args = parser.parse_args()
+
+  if not hasattr(os, "fork"):
+    print("Pre-fork mode needs os.fork; on Windows run uvicorn app.app:app directly.", file=sys.stderr)
+    return 2
+
+  # Read at import by services that split a host-wide budget between workers.
+  os.environ["WEB_CONCURRENCY"] = str(args.workers)
+  # Nothing allocated during preload needs collecting; freezing it keeps GC
+  # passes in the workers from touching (and so copying) the shared pages.
+  gc.disable()
+  from app.app import app
+
+  preload()
+  gc.collect()
+  gc.freeze()
+
+  sock = bind_socket(args.host, args.port)
+  workers: Dict[int, float] = {}
+  stopping = False
+
+  def forward(signum, frame) -> None:
+    nonlocal stopping
+    if signum in (signal.SIGTERM, signal.SIGINT):
+      stopping = True
+    for pid in list(workers):
+      try:
+        os.kill(pid, signal.SIGTERM if signum == signal.SIGINT else signum)
+      except ProcessLookupError:
+        pass
+
+  for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+    signal.signal(sig, forward)
+
+  for _ in range(max(1, args.workers)):
+    workers[spawn(app, sock, args.log_level)] = time.monotonic()
+  logging.info("master %d serving http://%s:%d with %d workers", os.getpid(), args.host, args.port, len(workers))
+
+  while workers:
+    try:
+      pid, status = os.wait()
+    except ChildProcessError:
+      break
+    except InterruptedError:
+      continue
+    started = workers.pop(pid, None)
+    if started is None or stopping:
+      continue
+    logging.warning("worker %d exited (status %d); restarting", pid, status)
+    if time.monotonic() - started < MIN_WORKER_UPTIME_SEC:
+      time.sleep(RESTART_DELAY_SEC)
+    if not stopping:
+      workers[spawn(app, sock, args.log_level)] = time.monotonic()
+  sock.close()
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.services.tracing_service import annotate, span
+
+# Off switch for the whole thing (e.g. when a proxy in front already sheds load).
+ENABLED = os.getenv("ADMISSION_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Slots shared by every limited route. Sync endpoints and streamed chat answers
+# hold a worker thread while they wait on OpenAI; keeping this under the thread
+# pool size (40 by default) leaves threads free for health, feedback, suggest...
+MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "28"))
+ASK_CONCURRENCY = int(os.getenv("ADMISSION_ASK_CONCURRENCY", "12"))
+CHAT_CONCURRENCY = int(os.getenv("ADMISSION_CHAT_CONCURRENCY", "12"))
+BATCH_CONCURRENCY = int(os.getenv("ADMISSION_BATCH_CONCURRENCY", "2"))
+# Requests allowed to wait per route once its slots are taken; beyond that, 503 at once.
+QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "32"))
+BATCH_QUEUE_MAX = int(os.getenv("ADMISSION_BATCH_QUEUE_MAX", "4"))
+# A queued request gives up after this long rather than eat the whole answer budget.
+QUEUE_TIMEOUT_SEC = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SEC", "5"))
+RETRY_AFTER_SEC = 5
+# Only this much of a rejected request's body is read, to find its language.
+LANG_PEEK_BYTES = 4096
+_LANG_FIELD = re.compile(rb'"lang"\s*:\s*"([A-Za-z]{2})"')
+
+# Interactive lanes (priority 0) are served before batch work when a slot frees up.
+INTERACTIVE = 0
+BATCH = 1
+
+# Most specific prefix first; routes not listed here are never held back.
+ROUTES: Tuple[Tuple[str, str], ...] = (
+  ("/api/ask/batch", "batch"),
+  ("/api/rag_test", "batch"),
+  ("/api/analytics/export", "batch"),
+  ("/api/ask", "ask"),
+  ("/api/chat", "chat"),
+)
+
+BUSY_MESSAGES = {
+  "EN": "The kiosk is very busy right now. Please try again in a moment.",
+  "AR": "الكشك مشغول جدا الآن. يرجى المحاولة مرة اخرى بعد لحظات.",
+  "FR": "Le kiosque est tres sollicite en ce moment. Veuillez reessayer dans un instant.",
+}
+
+
+class Lane:
+  """Concurrency limit and bounded FIFO wait queue for one group of routes."""
+
+  def __init__(self, name: str, priority: int, limit: int, queue_max: int) -> None:
+    self.name = name
+    self.priority = priority
+    self.limit = limit
+    self.queue_max = queue_max
+    self.active = 0
+    self.waiters: Deque["asyncio.Future[None]"] = deque()
+    self.admitted = 0
+    self.queued = 0
+    self.rejected_full = 0
+    self.rejected_timeout = 0
+    self.max_wait_ms = 0.0
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "priority": self.priority,
+      "limit": self.limit,
+      "active": self.active,
+      "waiting": len(self.waiters),
+      "queue_max": self.queue_max,
+      "admitted": self.admitted,
+      "queued": self.queued,
+      "rejected_full": self.rejected_full,
+      "rejected_timeout": self.rejected_timeout,
+      "max_wait_ms": round(self.max_wait_ms, 1),
+    }
+
+
+class AdmissionController:
+  """Per-lane slots drawn from one shared pool.
+
+  Everything runs on the event loop, so no locks: a request either takes a
+  slot, waits in its lane's queue, or is turned away. A freed slot goes to the
+  oldest waiter of the highest-priority lane that is under its own limit.
+  """
+
+  def __init__(self, lanes: List[Lane], max_inflight: int) -> None:
+    self.lanes = {lane.name: lane for lane in lanes}
+    self._by_priority = sorted(lanes, key=lambda lane: lane.priority)
+    self.max_inflight = max_inflight
+    self.active = 0
+
+  def _has_room(self, lane: Lane) -> bool:
+    return lane.active < lane.limit and self.active < self.max_inflight
+
+  def _can_enter(self, lane: Lane) -> bool:
+    if not self._has_room(lane) or lane.waiters:
+      return False
+    # Batch work does not jump ahead of interactive requests already waiting.
+    return not any(other.waiters for other in self._by_priority if other.priority < lane.priority)
+
+  def _take(self, lane: Lane) -> None:
+    lane.active += 1
+    self.active += 1
+    lane.admitted += 1
+
+  def _dispatch(self) -> None:
+    for lane in self._by_priority:
+      while lane.waiters and self._has_room(lane):
+        waiter = lane.waiters.popleft()
+        if not waiter.done():
+          self._take(lane)
+          waiter.set_result(None)
+
+  def release(self, lane: Lane) -> None:
+    lane.active -= 1
+    self.active -= 1
+    self._dispatch()
+
+  async def acquire(self, lane: Lane) -> Optional[str]:
+    """Take a slot in `lane`; returns None once admitted, else why it was refused."""
+    if self._can_enter(lane):
+      self._take(lane)
+      return None
+    if len(lane.waiters) >= lane.queue_max:
+      lane.rejected_full += 1
+      return "queue_full"
+    waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+    lane.waiters.append(waiter)
+    lane.queued += 1
+    started = time.perf_counter()
+    try:
+      with span("admission_wait", lane=lane.name) as attrs:
+        try:
+          await asyncio.wait_for(asyncio.shield(waiter), QUEUE_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+          if not waiter.done():
+            waiter.cancel()
+            lane.waiters.remove(waiter)
+            lane.rejected_timeout += 1
+            attrs["rejected"] = True
+            return "queue_timeout"
+    except asyncio.CancelledError:
+      # Client went away while queued; hand the slot on if it was already granted.
+      if waiter.done() and not waiter.cancelled():
+        self.release(lane)
+      else:
+        waiter.cancel()
+        if waiter in lane.waiters:
+          lane.waiters.remove(waiter)
+      raise
+    finally:
+      lane.max_wait_ms = max(lane.max_wait_ms, (time.perf_counter() - started) * 1000)
+    return None
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "enabled": ENABLED,
+      "max_inflight": self.max_inflight,
+      "active": self.active,
+      "queue_timeout_sec": QUEUE_TIMEOUT_SEC,
+      "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+    }
+
+
+_controller = AdmissionController(
+  [
+    Lane("ask", INTERACTIVE, ASK_CONCURRENCY, QUEUE_MAX),
+    Lane("chat", INTERACTIVE, CHAT_CONCURRENCY, QUEUE_MAX),
+    Lane("batch", BATCH, BATCH_CONCURRENCY, BATCH_QUEUE_MAX),
+  ],
+  MAX_INFLIGHT,
+)
+
+
+def lane_for(path: str) -> Optional[str]:
+  for prefix, lane in ROUTES:
+    if path == prefix or path.startswith(prefix + "/"):
+      return lane
+  return None
+
+
+async def _request_lang(scope, receive) -> str:
+  """Language of a request being turned away: its JSON "lang", else ?lang=, else Accept-Language."""
+  if scope["method"] == "POST":
+    body = b""
+    more = True
+    while more and len(body) < LANG_PEEK_BYTES:
+      message = await receive()
+      if message["type"] != "http.request":
+        break
+      body += message.get("body", b"")
+      more = message.get("more_body", False)
+    match = _LANG_FIELD.search(body[:LANG_PEEK_BYTES])
+    if match:
+      return match.group(1).decode().upper()
+  query = re.search(r"(?:^|&)lang=([A-Za-z]{2})", scope.get("query_string", b"").decode("latin-1"))
+  if query:
+    return query.group(1).upper()
+  accept = dict(scope.get("headers") or []).get(b"accept-language", b"").decode("latin-1")
+  return accept[:2].upper()
+
+
+async def _reject(scope, receive, send, reason: str) -> None:
+  lang = await _request_lang(scope, receive)
+  body = json.dumps(
+    {"detail": BUSY_MESSAGES.get(lang, BUSY_MESSAGES["EN"]), "error_code": reason, "retry_after": RETRY_AFTER_SEC},
+    ensure_ascii=False,
+  ).encode("utf-8")
+  await send({
+    "type": "http.response.start",
+    "status": 503,
+    "headers": [
+      (b"content-type", b"application/json; charset=utf-8"),
+      (b"content-length", str(len(body)).encode()),
+      (b"retry-after", str(RETRY_AFTER_SEC).encode()),
+    ],
+  })
+  await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+  """ASGI middleware: per-route concurrency limits with bounded queues, fast 503 when full.
+
+  Only the routes in ROUTES are limited; a request holds its slot until its
+  response (streamed chat answers included) has been sent.
+  """
+
+  def __init__(self, app) -> None:
+    self.app = app
+
+  async def __call__(self, scope, receive, send) -> None:
+    lane_name = lane_for(scope["path"]) if scope["type"] == "http" and ENABLED else None
+    if lane_name is None:
+      await self.app(scope, receive, send)
+      return
+    lane = _controller.lanes[lane_name]
+    refused = await _controller.acquire(lane)
+    if refused is not None:
+      annotate(admission=refused, lane=lane_name)
+      await _reject(scope, receive, send, refused)
+      return
+    try:
+      await self.app(scope, receive, send)
+    finally:
+      _controller.release(lane)
+
+
+def admission_stats() -> Dict[str, Any]:
+  return _controller.stats()
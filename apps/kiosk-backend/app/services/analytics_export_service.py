@@ -0,0 +1,99 @@
+import csv
+import hmac
+import io
+import json
+import os
+import threading
+import zlib
+from typing import Iterator, Optional
+
+from app.db.sqlite import EXPORT_COLUMNS, iter_analytics_pages
+
+# Lets an off-kiosk collector pull analytics without dev mode (sent as "Authorization: Bearer ...").
+EXPORT_TOKEN = os.getenv("ANALYTICS_EXPORT_TOKEN", "")
+MAX_CONCURRENT_EXPORTS = int(os.getenv("ANALYTICS_EXPORT_CONCURRENCY", "2"))
+PAGE_ROWS = 1000
+MEDIA_TYPES = {
+  "csv": "text/csv; charset=utf-8",
+  "ndjson": "application/x-ndjson",
+}
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_EXPORTS)
+
+
+def export_allowed(dev_mode: bool, authorization: Optional[str]) -> bool:
+  if dev_mode:
+    return True
+  if not EXPORT_TOKEN or not authorization:
+    return False
+  scheme, _, token = authorization.partition(" ")
+  return scheme.lower() == "bearer" and hmac.compare_digest(token.strip(), EXPORT_TOKEN)
+
+
+def _encode(fmt: str, since_id: int, until_id: int) -> Iterator[str]:
+  if fmt == "csv":
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buf.getvalue()
+  for page in iter_analytics_pages(since_id, until_id, PAGE_ROWS):
+    if fmt == "csv":
+      buf = io.StringIO()
+      csv.writer(buf).writerows(page)
+      yield buf.getvalue()
+    else:
+      yield "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False, separators=(",", ":")) + "\n"
+        for row in page
+      )
+
+
+def _stream(fmt: str, since_id: int, until_id: int, compress: bool) -> Iterator[bytes]:
+  encoder = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+  for text in _encode(fmt, since_id, until_id):
+    data = text.encode("utf-8")
+    if encoder is not None:
+      data = encoder.compress(data)
+    if data:
+      yield data
+  if encoder is not None:
+    yield encoder.flush()
+
+
+class ExportStream:
+  """Page-at-a-time export body holding one of the export slots until it ends.
+
+  Starlette pulls each chunk on a worker thread and lets it go between
+  chunks, so a long export never pins a thread the kiosk requests need. The
+  slot is released when the stream finishes, fails, or is dropped unread.
+  """
+
+  def __init__(self, fmt: str, since_id: int, until_id: int, compress: bool) -> None:
+    self._inner = _stream(fmt, since_id, until_id, compress)
+    self._released = False
+
+  def __iter__(self) -> "ExportStream":
+    return self
+
+  def __next__(self) -> bytes:
+    try:
+      return next(self._inner)
+    except BaseException:
+      self.close()
+      raise
+
+  def close(self) -> None:
+    if not self._released:
+      self._released = True
+      self._inner.close()
+      _slots.release()
+
+  def __del__(self) -> None:
+    self.close()
+
+
+def open_export(fmt: str, since_id: int, until_id: int, compress: bool) -> Optional[ExportStream]:
+  """An export stream, or None when MAX_CONCURRENT_EXPORTS are already running."""
+  if not _slots.acquire(blocking=False):
+    return None
+  return ExportStream(fmt, since_id, until_id, compress)
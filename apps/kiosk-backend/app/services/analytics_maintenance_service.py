@@ -0,0 +1,191 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.db.sqlite import (
+  ensure_partition,
+  forget_partition,
+  get_sqlite_path,
+  live_partitions,
+  now_ms,
+  partition_table,
+  rebuild_analytics_view,
+  utc_day,
+)
+from app.services.analytics_rollup_service import roll_up
+
+RETENTION_DAYS = max(1, int(os.getenv("ANALYTICS_RETENTION_DAYS", "90")))
+# How often each backend process runs maintenance (0 disables; the lease keeps it to one at a time).
+MAINTENANCE_SEC = float(os.getenv("ANALYTICS_MAINTENANCE_SEC", "3600"))
+VACUUM_EVERY_MS = 24 * 3600 * 1000
+ANALYZE_EVERY_MS = 24 * 3600 * 1000
+LEASE_MS = 10 * 60 * 1000
+DAY_MS = 24 * 3600 * 1000
+
+_owner = uuid.uuid4().hex[:12]
+_thread_started = False
+
+
+def get_archive_dir() -> Path:
+  value = os.getenv("ANALYTICS_ARCHIVE_DIR")
+  return Path(value) if value else Path(get_sqlite_path()).parent / "analytics_archive"
+
+
+def _meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+  row = conn.execute("SELECT value FROM analytics_meta WHERE key = ?", (key,)).fetchone()
+  return row[0] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+  conn.execute("INSERT OR REPLACE INTO analytics_meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def _acquire_lease(conn: sqlite3.Connection) -> bool:
+  """One maintenance run at a time across every worker sharing the DB."""
+  now = now_ms()
+  conn.execute("BEGIN IMMEDIATE")
+  try:
+    lease = _meta(conn, "maintenance_lease")
+    if lease and int(lease.split(":", 1)[0]) > now and not lease.endswith(":" + _owner):
+      conn.execute("ROLLBACK")
+      return False
+    _set_meta(conn, "maintenance_lease", f"{now + LEASE_MS}:{_owner}")
+    conn.execute("COMMIT")
+    return True
+  except Exception:
+    conn.execute("ROLLBACK")
+    raise
+
+
+def _release_lease(conn: sqlite3.Connection) -> None:
+  conn.execute("DELETE FROM analytics_meta WHERE key = 'maintenance_lease' AND value LIKE ?", (f"%:{_owner}",))
+
+
+def archive_partition(conn: sqlite3.Connection, day: str, archive_dir: Path) -> Dict[str, Any]:
+  """Stream a day's rows to `<archive_dir>/analytics_<day>.ndjson.gz`, then drop the table.
+
+  The file is complete (written to a temp name, then renamed) before the
+  table is dropped. Only past days are archived, and nothing writes to them.
+  """
+  table = partition_table(day)
+  archive_dir.mkdir(parents=True, exist_ok=True)
+  dest = archive_dir / f"{table}.ndjson.gz"
+  tmp = dest.with_name(dest.name + ".tmp")
+  rows = 0
+  last_id = None
+  cursor = conn.execute(f"SELECT * FROM {table} ORDER BY id")
+  columns = [d[0] for d in cursor.description]
+  with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=9) as fh:
+    for row in cursor:
+      fh.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, separators=(",", ":")) + "\n")
+      rows += 1
+      last_id = row[0]
+  os.replace(tmp, dest)
+
+  conn.execute("BEGIN IMMEDIATE")
+  try:
+    if last_id is None:
+      first = conn.execute("SELECT first_id FROM analytics_partitions WHERE day = ?", (day,)).fetchone()
+      last_id = (first[0] - 1) if first else 0
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(
+      "UPDATE analytics_partitions SET archived_ts = ?, archive_path = ?, row_count = ?, last_id = ? WHERE day = ?",
+      (now_ms(), str(dest), rows, last_id, day),
+    )
+    rebuild_analytics_view(conn)
+    conn.execute("COMMIT")
+  except Exception:
+    conn.execute("ROLLBACK")
+    raise
+  forget_partition(day)
+  return {"day": day, "rows": rows, "archive": str(dest)}
+
+
+def run_maintenance(retention_days: int = RETENTION_DAYS, vacuum: Optional[bool] = None) -> Dict[str, Any]:
+  """Roll over to today's partition, archive expired days, then VACUUM/ANALYZE when due.
+
+  `vacuum=None` vacuums after archiving or once a day; True/False force it.
+  """
+  started = time.perf_counter()
+  # Autocommit connection: transactions are explicit and VACUUM cannot run inside one.
+  conn = sqlite3.connect(get_sqlite_path(), timeout=30.0, isolation_level=None)
+  report: Dict[str, Any] = {"archived": [], "vacuumed": False, "analyzed": False}
+  try:
+    if not _acquire_lease(conn):
+      report["skipped"] = "maintenance is running in another process"
+      return report
+    try:
+      now = now_ms()
+      conn.execute("BEGIN IMMEDIATE")
+      try:
+        ensure_partition(conn, utc_day(now))
+        conn.execute("COMMIT")
+      except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+      # Fold everything in first: archived days are gone from the rollup's reach.
+      report["rolled_up"] = roll_up()["events"]
+      cutoff = utc_day(now - max(1, retention_days) * DAY_MS)
+      for day in live_partitions(conn):
+        if day < cutoff:
+          report["archived"].append(archive_partition(conn, day, get_archive_dir()))
+
+      # Re-sent batches older than the retention window have nowhere to land anyway.
+      cutoff_iso = datetime.fromtimestamp((now - max(1, retention_days) * DAY_MS) / 1000, tz=timezone.utc)
+      conn.execute(
+        "DELETE FROM client_events WHERE received_ts < ?",
+        (cutoff_iso.replace(tzinfo=None).isoformat() + "Z",),
+      )
+
+      last_vacuum = int(_meta(conn, "last_vacuum_ts") or 0)
+      if vacuum or (vacuum is None and (report["archived"] or now - last_vacuum > VACUUM_EVERY_MS)):
+        conn.execute("VACUUM")
+        _set_meta(conn, "last_vacuum_ts", str(now))
+        report["vacuumed"] = True
+      last_analyze = int(_meta(conn, "last_analyze_ts") or 0)
+      if now - last_analyze > ANALYZE_EVERY_MS or report["archived"]:
+        conn.execute("ANALYZE")
+        _set_meta(conn, "last_analyze_ts", str(now))
+        report["analyzed"] = True
+      else:
+        conn.execute("PRAGMA optimize")
+      report["live_partitions"] = len(live_partitions(conn))
+    finally:
+      _release_lease(conn)
+  finally:
+    conn.close()
+  report["took_ms"] = int((time.perf_counter() - started) * 1000)
+  logging.info(
+    "analytics maintenance archived=%d vacuumed=%s analyzed=%s took=%dms",
+    len(report["archived"]), report["vacuumed"], report["analyzed"], report["took_ms"],
+  )
+  return report
+
+
+def _maintenance_loop() -> None:
+  # First run shortly after startup, then on the interval.
+  delay = min(60.0, MAINTENANCE_SEC)
+  while True:
+    time.sleep(delay)
+    delay = MAINTENANCE_SEC
+    try:
+      run_maintenance()
+    except Exception:
+      logging.exception("analytics maintenance failed")
+
+
+def start_analytics_maintenance() -> None:
+  global _thread_started
+  if _thread_started or MAINTENANCE_SEC <= 0:
+    return
+  _thread_started = True
+  threading.Thread(target=_maintenance_loop, name="analytics-maintenance", daemon=True).start()
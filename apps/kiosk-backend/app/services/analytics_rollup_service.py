@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.db.sqlite import EXPORT_COLUMNS, analytics_id_range, analytics_rows_after, get_sqlite_path, now_ms
+from app.schemas.analytics import AnalyticsSummaryGroup, AnalyticsSummaryResponse
+
+# How often each backend process folds new events into the hourly rollups (0 disables).
+ROLLUP_SEC = float(os.getenv("ANALYTICS_ROLLUP_SEC", "60"))
+# Events folded per write transaction, so inserts are never held up for long.
+BATCH_ROWS = 5000
+HOUR_MS = 3600 * 1000
+# Upper bounds of the latency histogram buckets; one more bucket holds everything slower.
+LATENCY_BUCKETS_MS = (100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000, 20000, 30000)
+# Confidence histogram: 0.0-1.0 in steps of 0.1, like the retrieval eval report.
+CONFIDENCE_BUCKETS = 10
+GROUP_KEYS = ("hour", "lang", "mode", "route_used")
+
+_COL = {name: i for i, name in enumerate(EXPORT_COLUMNS)}
+_thread_started = False
+
+
+def _empty() -> Dict[str, Any]:
+  return {
+    "events": 0,
+    "errors": 0,
+    "error_codes": {},
+    "latency_count": 0,
+    "latency_sum": 0,
+    "latency_max": 0,
+    "latency_hist": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    "rating_count": 0,
+    "rating_sum": 0,
+    "confidence_count": 0,
+    "confidence_sum": 0.0,
+    "confidence_hist": [0] * CONFIDENCE_BUCKETS,
+  }
+
+
+def _merge(into: Dict[str, Any], other: Dict[str, Any]) -> None:
+  for key, value in other.items():
+    if key == "latency_max":
+      into[key] = max(into[key], value)
+    elif key == "error_codes":
+      for code, n in value.items():
+        into[key][code] = into[key].get(code, 0) + n
+    elif key.endswith("_hist"):
+      into[key] = [a + b for a, b in zip(into[key], value)]
+    else:
+      into[key] += value
+
+
+def _latency_bucket(latency_ms: int) -> int:
+  for i, bound in enumerate(LATENCY_BUCKETS_MS):
+    if latency_ms <= bound:
+      return i
+  return len(LATENCY_BUCKETS_MS)
+
+
+def _add_event(agg: Dict[str, Any], row: Sequence[Any]) -> None:
+  agg["events"] += 1
+  error_code = row[_COL["error_code"]]
+  if error_code:
+    agg["errors"] += 1
+    agg["error_codes"][error_code] = agg["error_codes"].get(error_code, 0) + 1
+  latency = row[_COL["latency_ms"]]
+  if latency is not None and latency >= 0:
+    agg["latency_count"] += 1
+    agg["latency_sum"] += int(latency)
+    agg["latency_max"] = max(agg["latency_max"], int(latency))
+    agg["latency_hist"][_latency_bucket(int(latency))] += 1
+  rating = row[_COL["rating_1_5"]]
+  if rating is not None:
+    agg["rating_count"] += 1
+    agg["rating_sum"] += int(rating)
+  confidence = row[_COL["confidence"]]
+  if confidence is not None:
+    confidence = min(1.0, max(0.0, float(confidence)))
+    agg["confidence_count"] += 1
+    agg["confidence_sum"] += confidence
+    agg["confidence_hist"][min(int(confidence * CONFIDENCE_BUCKETS), CONFIDENCE_BUCKETS - 1)] += 1
+
+
+def _row_key(row: Sequence[Any]) -> Tuple[int, str, str, str]:
+  hour = int(row[_COL["ts"]]) // HOUR_MS * HOUR_MS
+  return hour, row[_COL["lang"]] or "", row[_COL["mode"]], row[_COL["route_used"]] or ""
+
+
+_STORED = tuple(_empty().keys())
+
+
+def _load(row: Sequence[Any]) -> Dict[str, Any]:
+  agg = dict(zip(_STORED, row))
+  for key in ("error_codes", "latency_hist", "confidence_hist"):
+    agg[key] = json.loads(agg[key])
+  return agg
+
+
+def _roll_batch(conn: sqlite3.Connection) -> Tuple[int, int]:
+  """Fold the next batch of events in; returns (events folded, new watermark)."""
+  # Read, fold and advance the watermark under one write lock: two workers can
+  # never fold the same events, and a crash leaves nothing half counted.
+  conn.execute("BEGIN IMMEDIATE")
+  try:
+    row = conn.execute("SELECT value FROM analytics_meta WHERE key = 'rollup_last_id'").fetchone()
+    watermark = int(row[0]) if row else 0
+    rows = analytics_rows_after(conn, watermark, BATCH_ROWS)
+    if not rows:
+      conn.execute("ROLLBACK")
+      return 0, watermark
+    batch: Dict[Tuple[int, str, str, str], Dict[str, Any]] = {}
+    for event in rows:
+      _add_event(batch.setdefault(_row_key(event), _empty()), event)
+    for key, agg in batch.items():
+      existing = conn.execute(
+        f"SELECT {', '.join(_STORED)} FROM analytics_hourly WHERE hour = ? AND lang = ? AND mode = ? AND route_used = ?",
+        key,
+      ).fetchone()
+      if existing:
+        stored = _load(existing)
+        _merge(stored, agg)
+        agg = stored
+      values = [json.dumps(agg[k], separators=(",", ":")) if isinstance(agg[k], (dict, list)) else agg[k] for k in _STORED]
+      conn.execute(
+        f"INSERT OR REPLACE INTO analytics_hourly (hour, lang, mode, route_used, {', '.join(_STORED)}) "
+        f"VALUES ({', '.join('?' * (4 + len(_STORED)))})",
+        (*key, *values),
+      )
+    watermark = int(rows[-1][_COL["id"]])
+    conn.execute("INSERT OR REPLACE INTO analytics_meta (key, value) VALUES ('rollup_last_id', ?)", (str(watermark),))
+    conn.execute("COMMIT")
+    return len(rows), watermark
+  except Exception:
+    conn.execute("ROLLBACK")
+    raise
+
+
+def roll_up(max_batches: Optional[int] = None) -> Dict[str, Any]:
+  """Fold every event newer than the watermark into analytics_hourly."""
+  started = time.perf_counter()
+  conn = sqlite3.connect(get_sqlite_path(), timeout=30.0, isolation_level=None)
+  report: Dict[str, Any] = {"events": 0, "batches": 0}
+  try:
+    while max_batches is None or report["batches"] < max_batches:
+      folded, watermark = _roll_batch(conn)
+      report["rolled_up_to"] = watermark
+      if not folded:
+        break
+      report["events"] += folded
+      report["batches"] += 1
+  finally:
+    conn.close()
+  report["took_ms"] = int((time.perf_counter() - started) * 1000)
+  if report["events"]:
+    logging.info("analytics rollup events=%d up_to=%d took=%dms", report["events"], report["rolled_up_to"], report["took_ms"])
+  return report
+
+
+def _quantile(hist: List[int], count: int, latency_max: int, q: float) -> Optional[float]:
+  """Latency quantile estimated from the histogram, interpolating inside the bucket."""
+  if not count:
+    return None
+  target = q * count
+  seen = 0
+  lower = 0.0
+  for i, n in enumerate(hist):
+    upper = float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else float(max(latency_max, lower))
+    if n and seen + n >= target:
+      estimate = lower + (upper - lower) * (target - seen) / n
+      return round(min(estimate, float(latency_max)), 1)
+    seen += n
+    lower = upper
+  return float(latency_max)
+
+
+def _group(key: Dict[str, Any], agg: Dict[str, Any]) -> AnalyticsSummaryGroup:
+  return AnalyticsSummaryGroup(
+    **key,
+    events=agg["events"],
+    errors=agg["errors"],
+    error_rate=round(agg["errors"] / agg["events"], 4) if agg["events"] else 0.0,
+    error_codes=agg["error_codes"],
+    latency_avg_ms=round(agg["latency_sum"] / agg["latency_count"], 1) if agg["latency_count"] else None,
+    latency_p50_ms=_quantile(agg["latency_hist"], agg["latency_count"], agg["latency_max"], 0.50),
+    latency_p95_ms=_quantile(agg["latency_hist"], agg["latency_count"], agg["latency_max"], 0.95),
+    latency_max_ms=agg["latency_max"] if agg["latency_count"] else None,
+    latency_histogram=agg["latency_hist"],
+    rating_count=agg["rating_count"],
+    rating_avg=round(agg["rating_sum"] / agg["rating_count"], 3) if agg["rating_count"] else None,
+    confidence_avg=round(agg["confidence_sum"] / agg["confidence_count"], 3) if agg["confidence_count"] else None,
+    confidence_histogram=agg["confidence_hist"],
+  )
+
+
+def summarize(
+  hours: int,
+  group_by: Sequence[str],
+  lang: Optional[str] = None,
+  mode: Optional[str] = None,
+  route_used: Optional[str] = None,
+) -> AnalyticsSummaryResponse:
+  """Aggregate the rollups of the last `hours` hours (the current one included).
+
+  Reads analytics_hourly only, so the cost grows with hours x groups, never with events.
+  """
+  until_hour = now_ms() // HOUR_MS * HOUR_MS
+  since_hour = until_hour - (hours - 1) * HOUR_MS
+  where = ["hour >= ?"]
+  params: List[Any] = [since_hour]
+  for column, value in (("lang", lang), ("mode", mode), ("route_used", route_used)):
+    if value is not None:
+      where.append(f"{column} = ?")
+      params.append(value)
+
+  groups: Dict[Tuple, Dict[str, Any]] = {}
+  total = _empty()
+  conn = sqlite3.connect(get_sqlite_path())
+  try:
+    cursor = conn.execute(
+      f"SELECT hour, lang, mode, route_used, {', '.join(_STORED)} FROM analytics_hourly WHERE {' AND '.join(where)}",
+      params,
+    )
+    for row in cursor:
+      dims = dict(zip(GROUP_KEYS, row[:4]))
+      agg = _load(row[4:])
+      key = tuple(dims[k] for k in group_by)
+      _merge(groups.setdefault(key, _empty()), agg)
+      _merge(total, agg)
+    row = conn.execute("SELECT value FROM analytics_meta WHERE key = 'rollup_last_id'").fetchone()
+    watermark = int(row[0]) if row else 0
+  finally:
+    conn.close()
+
+  _, newest = analytics_id_range()
+  return AnalyticsSummaryResponse(
+    since_hour=since_hour,
+    until_hour=until_hour + HOUR_MS,
+    group_by=list(group_by),
+    latency_buckets_ms=list(LATENCY_BUCKETS_MS),
+    rolled_up_to=watermark,
+    pending_events=max(0, newest - watermark),
+    total=_group({}, total),
+    groups=[
+      _group({k: (v if v != "" else None) for k, v in zip(group_by, key)}, agg)
+      for key, agg in sorted(groups.items(), key=lambda item: item[0])
+    ],
+  )
+
+
+def _rollup_loop() -> None:
+  while True:
+    time.sleep(ROLLUP_SEC)
+    try:
+      roll_up()
+    except Exception:
+      logging.exception("analytics rollup failed")
+
+
+def start_analytics_rollups() -> None:
+  global _thread_started
+  if _thread_started or ROLLUP_SEC <= 0:
+    return
+  _thread_started = True
+  threading.Thread(target=_rollup_loop, name="analytics-rollup", daemon=True).start()
@@ -0,0 +1,77 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from app.schemas.ask import AskBatchResponse, AskRequest
+from app.services.ask_service import answer_query, effective_query, is_out_of_scope
+from app.services.deadline_service import new_deadline
+from app.services.rag_service import Prefetched, get_query_embeddings, prime_retrieval
+
+MAX_CONCURRENCY = int(os.getenv("ASK_BATCH_MAX_CONCURRENCY", "8"))
+# Batch items are not waiting on a kiosk screen, so each gets a roomier budget.
+ITEM_SLO_SEC = float(os.getenv("ASK_BATCH_ITEM_SLO_SEC", "30"))
+
+
+def answer_batch(
+  items: List[AskRequest],
+  concurrency: int = 4,
+  record_analytics: bool = False,
+) -> AskBatchResponse:
+  """Run many questions through the /api/ask pipeline.
+
+  Embeddings and retrieval are done up front in bulk (one embeddings request
+  per batch, one Chroma query per language) and handed to each item
+  directly, not through the TTL caches, which a long generate phase would
+  outlive; only the LLM step then runs per item, on a bounded thread pool.
+  """
+  started = time.perf_counter()
+  queries = [effective_query(p) for p in items]
+  # Out-of-scope questions never reach embedding or retrieval.
+  todo = [i for i, p in enumerate(items) if p.clarified or not is_out_of_scope(p.query or "")]
+
+  t0 = time.perf_counter()
+  embeddings = get_query_embeddings([queries[i] for i in todo])
+  embed_ms = int((time.perf_counter() - t0) * 1000)
+
+  t0 = time.perf_counter()
+  by_lang: Dict[str, List[int]] = {}
+  for pos, i in enumerate(todo):
+    by_lang.setdefault(items[i].lang, []).append(pos)
+  prefetched: List[Optional[Prefetched]] = [None] * len(items)
+  for lang, positions in by_lang.items():
+    retrieved = prime_retrieval([queries[todo[p]] for p in positions], lang, [embeddings[p] for p in positions])
+    for p, results in zip(positions, retrieved):
+      prefetched[todo[p]] = Prefetched(embeddings[p], results)
+  retrieve_ms = int((time.perf_counter() - t0) * 1000)
+
+  t0 = time.perf_counter()
+  workers = max(1, min(concurrency, MAX_CONCURRENCY, len(items) or 1))
+  with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ask-batch") as pool:
+    results = list(pool.map(
+      lambda p, pre: answer_query(p, deadline=new_deadline(ITEM_SLO_SEC), record_analytics=record_analytics, prefetched=pre),
+      items,
+      prefetched,
+    ))
+  generate_ms = int((time.perf_counter() - t0) * 1000)
+
+  routes: Dict[str, int] = {}
+  for r in results:
+    routes[r.route_used] = routes.get(r.route_used, 0) + 1
+  total_ms = int((time.perf_counter() - started) * 1000)
+  logging.info(
+    "ask batch n=%d embed=%dms retrieve=%dms generate=%dms total=%dms workers=%d",
+    len(items), embed_ms, retrieve_ms, generate_ms, total_ms, workers,
+  )
+  return AskBatchResponse(
+    results=results,
+    timings_ms={
+      "embed": embed_ms,
+      "retrieve": retrieve_ms,
+      "generate": generate_ms,
+      "total": total_ms,
+      "per_item_avg": int(total_ms / len(items)) if items else 0,
+    },
+    routes=routes,
+  )
@@ -4,13 +4,17 @@ import os
 import time
 from typing import Any, Dict, List
 
-import requests
-
 from app.db.sqlite import insert_analytics
 from app.schemas.ask import AnswerBlock, AskRequest, AskResponse, SourceItem
+from app.services.deadline_service import Deadline, DeadlineExceeded, new_deadline
 from app.services.hash_service import hash_query
-from app.services.offline_pack_service import get_suggestions, match_offline
-from app.services.rag_service import retrieve
+from app.services.heavy_hitters_service import record_query
+from app.services.http_service import get_http_session
+from app.services.offline_pack_service import get_keyword_router, get_suggestions, match_offline
+from app.services.profiling_service import profiled
+from app.services.rag_service import Prefetched, get_query_embedding, retrieve
+from app.services.ratelimit_service import RateLimited, acquire_llm, estimate_tokens
+from app.services.tracing_service import annotate, current_trace_id, event, span, traced
 
 OFFLINE_THRESHOLD = 0.25
 RAG_THRESHOLD = 0.35
@@ -18,6 +22,8 @@ MIN_SOURCES = 1
 MIN_SOURCE_SCORE = 0.2
 
 _last_openai_error = {"code": "", "message": ""}
+# Branch/decision lines; in EVENT_MODE they are sampled (LOG_SAMPLE) instead of dropped.
+_log = logging.getLogger("app.ask")
 
 
 def _event_mode() -> bool:
@@ -25,8 +31,7 @@ def _event_mode() -> bool:
 
 
 def _log_info(message: str, *args: Any) -> None:
-  if not _event_mode():
-    logging.info(message, *args)
+  _log.info(message, *args)
 
 
 def _set_openai_error(code: str, message: str) -> None:
@@ -54,74 +59,48 @@ def safe_response() -> AskResponse:
 
 
 def clarifier(query: str, lang: str) -> str:
-  q = (query or "").lower()
+  topics = get_keyword_router().classify(query or "").topics
   if lang == "AR":
-    if "الإحرام" in query or "ihram" in q:
+    if "ihram" in topics:
       return "هل تقصد احكام الإحرام، ام عبور الميقات، ام ماذا تفعل اذا تجاوزت الميقات؟"
-    if "الروضة" in query or "rawdah" in q:
+    if "rawdah" in topics:
       return "هل تقصد حجز الروضة الشريفة ام قواعد الزيارة؟"
     return "هل تقصد خطوة من خطوات العمرة، ام تصريح نسك، ام زيارة الروضة الشريفة؟"
   if lang == "FR":
-    if "ihram" in q:
+    if "ihram" in topics:
       return "Parlez-vous des regles de l'ihram, du passage du miqat, ou de quoi faire apres l'avoir depasse ?"
-    if "rawdah" in q:
+    if "rawdah" in topics:
       return "Parlez-vous de la reservation Rawdah ou des regles de visite ?"
     return "Parlez-vous d'une etape de la Omra, d'un permis Nusuk, ou de la Rawdah ?"
-  if "ihram" in q:
+  if "ihram" in topics:
     return "Do you mean ihram rules, crossing the miqat, or what to do if you already passed miqat?"
-  if "rawdah" in q:
+  if "rawdah" in topics:
     return "Do you mean Rawdah booking or visit rules?"
   return "Do you mean an Umrah step, a Nusuk permit, or Rawdah visit details?"
 
 def clarifier_options(query: str, lang: str) -> List[str]:
-  q = (query or "").lower()
+  topics = get_keyword_router().classify(query or "").topics
   if lang == "AR":
-    if "الإحرام" in query or "ihram" in q:
+    if "ihram" in topics:
       return ["احكام الإحرام", "عبور الميقات", "تجاوز الميقات"]
-    if "الروضة" in query or "rawdah" in q:
+    if "rawdah" in topics:
       return ["حجز الروضة الشريفة", "قواعد الزيارة", "وقت التصريح"]
     return ["خطوات العمرة", "تصريح نسك", "زيارة الروضة الشريفة"]
   if lang == "FR":
-    if "ihram" in q:
+    if "ihram" in topics:
       return ["Regles de l'ihram", "Passage du miqat", "Depassement du miqat"]
-    if "rawdah" in q:
+    if "rawdah" in topics:
       return ["Reservation Rawdah", "Regles de visite", "Heure du permis"]
     return ["Etapes de la Omra", "Permis Nusuk", "Visite Rawdah"]
-  if "ihram" in q:
+  if "ihram" in topics:
     return ["Ihram rules", "Miqat crossing", "Passed miqat"]
-  if "rawdah" in q:
+  if "rawdah" in topics:
     return ["Rawdah booking", "Visit rules", "Permit timing"]
   return ["Umrah steps", "Nusuk permit", "Rawdah visit"]
 
+@traced("out_of_scope")
 def is_out_of_scope(query: str) -> bool:
-  q = (query or "").lower()
-  keywords = [
-    "visa",
-    "immigration",
-    "passport",
-    "medical",
-    "vaccine",
-    "health",
-    "legal",
-    "law",
-    "lawsuit",
-    "court",
-    "hajj only",
-    "hajj",
-    "umrah visa",
-    "employment",
-    "فيزا",
-    "تاشيرة",
-    "جواز",
-    "طبي",
-    "صحي",
-    "قانوني",
-    "الحج",
-    "visa omra",
-    "juridique",
-    "travail",
-  ]
-  return any(k in q for k in keywords)
+  return get_keyword_router().classify(query or "").out_of_scope
 
 def out_of_scope_message(lang: str) -> str:
   if lang == "AR":
@@ -135,6 +114,27 @@ def suggestion_chips(query: str, lang: str) -> List[str]:
   return chips if chips else clarifier_options(query, lang)
 
 
+def throttled_response(payload: AskRequest, reason: str, rag_conf: float) -> AskResponse:
+  """Answer without the LLM when its rate limit is hit.
+
+  Always a clarifier: a pack answer that passed source verification was
+  already returned before any LLM call, so any match left here is unverified.
+  """
+  event("rate_limited", reason=reason)
+  _log_info("branch=throttled %s", reason)
+  return AskResponse(
+    answer=AnswerBlock(direct="", steps=[], mistakes=[]),
+    sources=[],
+    confidence=rag_conf,
+    refinement_chips=suggestion_chips(payload.query, payload.lang),
+    route_used="fallback",
+    latency_ms=0,
+    clarifying_question=clarifier(payload.query, payload.lang),
+    error_code="rate_limited",
+    debug_notes=f"fallback: {reason}",
+  )
+
+
 def build_prompt(query: str, lang: str, sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
   snippets = "\n\n".join(
     f"Title: {s.get('title', '')}\nURL: {s.get('url_or_path', '')}\nSnippet: {s.get('snippet', '')}"
@@ -201,10 +201,13 @@ CLARIFY_SCHEMA = {
 }
 
 
+@traced("llm")
 def call_responses_api(
   messages: List[Dict[str, Any]],
   schema: Dict[str, Any] | None = None,
   schema_name: str = "kiosk_answer",
+  deadline: Deadline | None = None,
+  limit_key: str | None = None,
 ) -> Dict[str, Any]:
   api_key = os.getenv("OPENAI_API_KEY")
   if not api_key:
@@ -250,22 +253,42 @@ def call_responses_api(
     },
   }
 
+  body = json.dumps(payload)
+  estimated = estimate_tokens(body)
   last_err: Exception | None = None
   for attempt in range(2):
+    if attempt == 0:
+      # Raises RateLimited before anything is sent when the session or the upstream quota is spent.
+      grant = acquire_llm(limit_key, estimated)
+    else:
+      try:
+        # A retry is another upstream request, so it takes its own global tokens.
+        grant = acquire_llm(None, estimated)
+      except RateLimited:
+        break
     try:
+      timeout = deadline.timeout(5, 12, "llm") if deadline else (5, 12)
       _log_info("openai_start")
-      resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=(5, 12))
+      resp = get_http_session().post(url, headers=headers, data=body, timeout=timeout)
       if resp.status_code == 429 or resp.status_code >= 500:
         raise RuntimeError(f"openai_http_{resp.status_code}")
       resp.raise_for_status()
       _log_info("openai_success")
-      return resp.json()
+      data = resp.json()
+      grant.settle(int((data.get("usage") or {}).get("total_tokens") or 0))
+      return data
     except Exception as e:
       last_err = e
       _set_openai_error(type(e).__name__, str(e))
       if not _event_mode():
         logging.warning("openai_error %s", type(e).__name__)
+      # Retrying a 429 only adds to the pressure on the quota.
+      if isinstance(e, DeadlineExceeded) or str(e) == "openai_http_429":
+        break
       if attempt == 0:
+        # A retry is optional work; skip it when the request budget is nearly spent.
+        if deadline and not deadline.allows_optional_work():
+          break
         time.sleep(0.6)
         continue
   raise last_err or RuntimeError("OpenAI call failed")
@@ -311,19 +334,30 @@ def _parse_answer(output_text: str) -> tuple[str, List[str], List[str], List[str
   return direct, steps_val, mistakes_val, chips if isinstance(chips, list) else []
 
 
-def answer_query(payload: AskRequest) -> AskResponse:
+def effective_query(payload: AskRequest) -> str:
+  original_query = payload.query or ""
+  clarify_choice = payload.clarifier_choice or ""
+  if payload.clarified and clarify_choice:
+    return f"{original_query}\nClarifier choice: {clarify_choice}"
+  return original_query
+
+
+@profiled
+def answer_query(
+  payload: AskRequest,
+  deadline: Deadline | None = None,
+  record_analytics: bool = True,
+  prefetched: Prefetched | None = None,
+) -> AskResponse:
   start = time.time()
+  deadline = deadline or new_deadline()
   response = safe_response()
   original_query = payload.query or ""
   rag_conf = 0.0
+  first_retrieval = None
 
   try:
-    clarify_choice = payload.clarifier_choice or ""
-    effective_query = (
-      f"{original_query}\nClarifier choice: {clarify_choice}"
-      if payload.clarified and clarify_choice
-      else original_query
-    )
+    effective = effective_query(payload)
 
     if is_out_of_scope(original_query) and not payload.clarified:
       response = AskResponse(
@@ -338,11 +372,24 @@ def answer_query(payload: AskRequest) -> AskResponse:
       )
       _log_info("branch=fallback out_of_scope=true")
     else:
-      match, confidence = match_offline(effective_query, payload.lang)
+      # One embedding serves both the offline intent match and Chroma retrieval;
+      # if it fails, retrieve() must not try again within the same budget.
+      # Batch items arrive with both already computed in bulk.
+      if prefetched is not None:
+        query_embedding, retrieved = prefetched
+      else:
+        query_embedding, retrieved = get_query_embedding(effective, deadline=deadline), None
+      match, confidence = match_offline(effective, payload.lang, embedding=query_embedding)
       if match and confidence >= OFFLINE_THRESHOLD:
         source_ids = match.get("source_ids", [])
-        sources, _ = retrieve(effective_query, payload.lang, top_k=3)
+        sources, first_conf = retrieve(
+          effective, payload.lang, top_k=3, deadline=deadline, embedding=query_embedding,
+          embed_if_missing=False, prefetched=retrieved,
+        )
+        first_retrieval = (sources, first_conf)
         filtered = [s for s in sources if s.get("source_id") in source_ids and s.get("score", 0) >= MIN_SOURCE_SCORE]
+        if len(filtered) < MIN_SOURCES:
+          event("offline_sources_rejected", matched=len(filtered), confidence=round(confidence, 3))
         if len(filtered) >= MIN_SOURCES:
           answer = match.get("answer", {})
           response = AskResponse(
@@ -360,14 +407,24 @@ def answer_query(payload: AskRequest) -> AskResponse:
           _log_info("branch=offline sources=%d", len(filtered))
 
       if response.route_used != "offline":
-        sources, rag_conf = retrieve(effective_query, payload.lang, top_k=5)
+        if first_retrieval is not None and not deadline.allows_optional_work():
+          # Not enough budget for a second retrieval; reuse the offline check's results.
+          sources, rag_conf = first_retrieval
+          _log_info("deadline: reusing offline retrieval remaining=%.2f", deadline.remaining())
+        else:
+          sources, rag_conf = retrieve(
+            effective, payload.lang, top_k=5, deadline=deadline, embedding=query_embedding,
+            embed_if_missing=False, prefetched=retrieved,
+          )
         sources = [s for s in sources if s.get("score", 0) >= MIN_SOURCE_SCORE]
         weak_rag = len(sources) < MIN_SOURCES or rag_conf < RAG_THRESHOLD
 
         if weak_rag:
           if payload.clarified:
             try:
-              data = call_responses_api(build_prompt_ungrounded(effective_query, payload.lang))
+              data = call_responses_api(
+                build_prompt_ungrounded(effective, payload.lang), deadline=deadline, limit_key=payload.session_id
+              )
               direct, steps_val, mistakes_val, refinement = _parse_answer(extract_output_text(data))
               if not direct:
                 response = AskResponse(
@@ -394,10 +451,14 @@ def answer_query(payload: AskRequest) -> AskResponse:
                   general_mode=True,
                 )
               _log_info("branch=general clarified=true sources=0")
+            except RateLimited as e:
+              response = throttled_response(payload, str(e), rag_conf)
             except Exception as e:
               msg = str(e).lower()
               if "openai_api_key" in msg or "missing" in msg:
                 debug = "fallback: openai_missing_key"
+              elif "deadline" in msg:
+                debug = "fallback: deadline_exceeded"
               elif "timeout" in msg:
                 debug = "fallback: openai_timeout"
               else:
@@ -421,6 +482,8 @@ def answer_query(payload: AskRequest) -> AskResponse:
                 build_prompt_clarify(original_query, payload.lang),
                 schema=CLARIFY_SCHEMA,
                 schema_name="kiosk_clarify",
+                deadline=deadline,
+                limit_key=payload.session_id,
               )
               parsed = json.loads(extract_output_text(data))
               llm_question = parsed.get("clarifying_question", "")
@@ -440,6 +503,8 @@ def answer_query(payload: AskRequest) -> AskResponse:
                 debug_notes="fallback: rag_low_clarify_llm",
               )
               _log_info("branch=fallback clarify_llm sources=0")
+            except RateLimited as e:
+              response = throttled_response(payload, str(e), rag_conf)
             except Exception:
               response = AskResponse(
                 answer=AnswerBlock(direct="", steps=[], mistakes=[]),
@@ -454,7 +519,9 @@ def answer_query(payload: AskRequest) -> AskResponse:
               _log_info("branch=fallback rag_empty sources=0")
         else:
           try:
-            data = call_responses_api(build_prompt(effective_query, payload.lang, sources))
+            data = call_responses_api(
+              build_prompt(effective, payload.lang, sources), deadline=deadline, limit_key=payload.session_id
+            )
             direct, steps_val, mistakes_val, refinement = _parse_answer(extract_output_text(data))
             response = AskResponse(
               answer=AnswerBlock(direct=direct, steps=steps_val, mistakes=mistakes_val),
@@ -487,10 +554,14 @@ def answer_query(payload: AskRequest) -> AskResponse:
                 debug_notes="fallback: sources_empty",
               )
             _log_info("branch=rag sources=%d", len(sources))
+          except RateLimited as e:
+            response = throttled_response(payload, str(e), rag_conf)
           except Exception as e:
             msg = str(e).lower()
             if "openai_api_key" in msg or "missing" in msg:
               debug = "fallback: openai_missing_key"
+            elif "deadline" in msg:
+              debug = "fallback: deadline_exceeded"
             elif "timeout" in msg:
               debug = "fallback: openai_timeout"
             else:
@@ -513,21 +584,27 @@ def answer_query(payload: AskRequest) -> AskResponse:
   finally:
     latency_ms = int((time.time() - start) * 1000)
     response.latency_ms = latency_ms
-    try:
-      insert_analytics(
-        session_id=payload.session_id,
-        mode="ask",
-        lang=payload.lang,
-        rating_1_5=None,
-        time_on_screen_ms=None,
-        route_used=response.route_used,
-        confidence=response.confidence,
-        sources_count=len(response.sources) if response.sources else 0,
-        error_code=response.error_code,
-        latency_ms=latency_ms,
-        hashed_query=hash_query(original_query),
-      )
-    except Exception:
-      pass
+    annotate(route_used=response.route_used, error_code=response.error_code, debug=response.debug_notes)
+    if record_analytics:
+      hashed = hash_query(original_query)
+      record_query(hashed)
+      try:
+        with span("analytics_write"):
+          insert_analytics(
+            session_id=payload.session_id,
+            mode="ask",
+            lang=payload.lang,
+            rating_1_5=None,
+            time_on_screen_ms=None,
+            route_used=response.route_used,
+            confidence=response.confidence,
+            sources_count=len(response.sources) if response.sources else 0,
+            error_code=response.error_code,
+            latency_ms=latency_ms,
+            hashed_query=hashed,
+            trace_id=current_trace_id(),
+          )
+      except Exception:
+        pass
 
   return response
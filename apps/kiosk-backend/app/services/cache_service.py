@@ -0,0 +1,274 @@
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.db.sqlite import get_sqlite_path
+
+# "memory" keeps caches per process; "sqlite" shares them between all workers on the host.
+DEFAULT_BACKEND = "memory"
+LOCAL_MAX_ITEMS = int(os.getenv("CACHE_LOCAL_MAX_ITEMS", "2048"))
+# Shared entries are also kept in-process this long, so hot keys skip the SQLite read.
+LOCAL_TTL_SEC = 5.0
+PRUNE_EVERY_SETS = 500
+# Entries pinned for the hottest queries (see heavy_hitters_service), per cache.
+PINNED_MAX_ITEMS = 512
+
+_MISS = object()
+
+
+def get_cache_backend() -> str:
+  value = os.getenv("CACHE_BACKEND", DEFAULT_BACKEND).strip().lower()
+  return value if value in ("memory", "sqlite") else DEFAULT_BACKEND
+
+
+def get_cache_sqlite_path() -> str:
+  env_val = os.getenv("CACHE_SQLITE_PATH")
+  if env_val:
+    return env_val
+  return str(Path(get_sqlite_path()).parent / "cache.sqlite")
+
+
+def make_key(*parts: Any) -> str:
+  """Stable key for any backend; hashed so raw queries never land on disk."""
+  raw = "\x1f".join(str(p) for p in parts)
+  return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+  """Process-local LRU with per-entry expiry.
+
+  Pinned entries sit outside the LRU and never expire; each carries a tag
+  (the hashed query) so it can be unpinned once its query cools down.
+  """
+
+  def __init__(self, max_items: int = LOCAL_MAX_ITEMS) -> None:
+    self.max_items = max_items
+    self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+    self._pinned: Dict[str, Tuple[str, Any]] = {}
+    self._lock = threading.Lock()
+
+  def get(self, key: str) -> Any:
+    with self._lock:
+      pinned = self._pinned.get(key)
+      if pinned is not None:
+        return pinned[1]
+      item = self._data.get(key)
+      if item is None:
+        return _MISS
+      if item[0] <= time.time():
+        del self._data[key]
+        return _MISS
+      self._data.move_to_end(key)
+      return item[1]
+
+  def set(self, key: str, value: Any, ttl: float) -> None:
+    with self._lock:
+      self._data[key] = (time.time() + ttl, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.max_items:
+        self._data.popitem(last=False)
+
+  def pin(self, key: str, value: Any, tag: str) -> bool:
+    with self._lock:
+      if key not in self._pinned and len(self._pinned) >= PINNED_MAX_ITEMS:
+        return False
+      self._pinned[key] = (tag, value)
+      self._data.pop(key, None)
+      return True
+
+  def unpin(self, keep: Callable[[str], bool], ttl: float) -> int:
+    """Move pinned entries whose tag fails `keep` back into the LRU."""
+    with self._lock:
+      cold = [key for key, (tag, _) in self._pinned.items() if not keep(tag)]
+      for key in cold:
+        _, value = self._pinned.pop(key)
+        self._data[key] = (time.time() + ttl, value)
+      while len(self._data) > self.max_items:
+        self._data.popitem(last=False)
+      return len(cold)
+
+  def pinned_count(self) -> int:
+    return len(self._pinned)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._data.clear()
+      self._pinned.clear()
+
+
+class SqliteCache:
+  """Host-wide cache in one SQLite file (WAL), shared by every worker process.
+
+  Readers never block the writer in WAL mode, and each thread keeps its own
+  connection. Any SQLite error is treated as a miss so the cache can never
+  fail a request.
+  """
+
+  SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cache ("
+    " ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL,"
+    " PRIMARY KEY (ns, key)) WITHOUT ROWID"
+  )
+
+  def __init__(self, path: str) -> None:
+    self.path = path
+    self._local = threading.local()
+    self._sets = 0
+    if hasattr(os, "register_at_fork"):
+      # SQLite connections must not be shared with a forked worker.
+      os.register_at_fork(after_in_child=self._reset_connections)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = self._conn()
+    conn.execute(self.SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires_at)")
+
+  def _conn(self) -> sqlite3.Connection:
+    conn = getattr(self._local, "conn", None)
+    if conn is None:
+      conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None, check_same_thread=False)
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
+      self._local.conn = conn
+    return conn
+
+  def _reset_connections(self) -> None:
+    self._local = threading.local()
+
+  def get(self, ns: str, key: str) -> Tuple[Any, float]:
+    """(value, expires_at), or (_MISS, 0) when absent or expired."""
+    try:
+      row = self._conn().execute(
+        "SELECT value, expires_at FROM cache WHERE ns = ? AND key = ? AND expires_at > ?",
+        (ns, key, time.time()),
+      ).fetchone()
+    except sqlite3.Error:
+      return _MISS, 0.0
+    if row is None:
+      return _MISS, 0.0
+    try:
+      return pickle.loads(row[0]), float(row[1])
+    except Exception:
+      return _MISS, 0.0
+
+  def set(self, ns: str, key: str, value: Any, ttl: float) -> None:
+    try:
+      blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+      conn = self._conn()
+      conn.execute(
+        "INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+        (ns, key, blob, time.time() + ttl),
+      )
+      self._sets += 1
+      if self._sets % PRUNE_EVERY_SETS == 0:
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+    except sqlite3.Error:
+      logging.warning("shared cache write failed (%s)", ns)
+
+  def clear(self, ns: str) -> None:
+    try:
+      self._conn().execute("DELETE FROM cache WHERE ns = ?", (ns,))
+    except sqlite3.Error:
+      logging.warning("shared cache clear failed (%s)", ns)
+
+
+class Cache:
+  """One named cache with a fixed TTL, backed by the configured tier."""
+
+  def __init__(self, namespace: str, ttl: float, shared: Optional[SqliteCache]) -> None:
+    self.namespace = namespace
+    self.ttl = ttl
+    self.shared = shared
+    self.local = MemoryCache()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key: str, pin: Optional[str] = None) -> Any:
+    """Cached value or None; a hit with `pin` set is pinned in-process from now on."""
+    value = self.local.get(key)
+    if value is _MISS and self.shared is not None:
+      value, expires_at = self.shared.get(self.namespace, key)
+      if value is not _MISS:
+        self.local.set(key, value, min(LOCAL_TTL_SEC, expires_at - time.time()))
+    if value is _MISS:
+      self.misses += 1
+      return None
+    if pin is not None:
+      self.local.pin(key, value, pin)
+    self.hits += 1
+    return value
+
+  def set(self, key: str, value: Any, pin: Optional[str] = None) -> None:
+    """Store value; `pin` (a hashed query) also keeps it in-process until unpinned."""
+    if pin is not None and self.local.pin(key, value, pin):
+      if self.shared is not None:
+        self.shared.set(self.namespace, key, value, self.ttl)
+      return
+    if self.shared is not None:
+      self.shared.set(self.namespace, key, value, self.ttl)
+      self.local.set(key, value, min(LOCAL_TTL_SEC, self.ttl))
+    else:
+      self.local.set(key, value, self.ttl)
+
+  def clear(self) -> None:
+    self.local.clear()
+    if self.shared is not None:
+      self.shared.clear(self.namespace)
+
+  def stats(self) -> Dict[str, Any]:
+    total = self.hits + self.misses
+    return {
+      "ttl_sec": self.ttl,
+      "pinned": self.local.pinned_count(),
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": round(self.hits / total, 3) if total else None,
+    }
+
+
+_shared: Optional[SqliteCache] = None
+_caches: Dict[str, Cache] = {}
+_caches_lock = threading.Lock()
+
+
+def _shared_backend() -> Optional[SqliteCache]:
+  global _shared
+  if get_cache_backend() != "sqlite":
+    return None
+  if _shared is None:
+    try:
+      _shared = SqliteCache(get_cache_sqlite_path())
+    except sqlite3.Error:
+      logging.exception("shared cache unavailable; falling back to per-process memory")
+      return None
+  return _shared
+
+
+def get_cache(namespace: str, ttl: float) -> Cache:
+  with _caches_lock:
+    cache = _caches.get(namespace)
+    if cache is None:
+      cache = Cache(namespace, ttl, _shared_backend())
+      _caches[namespace] = cache
+    return cache
+
+
+def unpin_cold(is_hot: Callable[[str], bool]) -> int:
+  """Release pinned entries, in every cache, whose query is no longer hot."""
+  with _caches_lock:
+    caches = list(_caches.values())
+  return sum(cache.local.unpin(is_hot, cache.ttl) for cache in caches)
+
+
+def cache_stats() -> Dict[str, Any]:
+  return {
+    "backend": "sqlite" if _shared is not None else "memory",
+    "path": _shared.path if _shared is not None else None,
+    "caches": {name: cache.stats() for name, cache in _caches.items()},
+  }
@@ -4,8 +4,6 @@ import os
 import time
 from typing import Any, Dict, Generator, List
 
-import requests
-
 from app.db.sqlite import get_session_message_count, insert_analytics
 from app.schemas.chat import ChatRequest, ChatResponseMeta, ChatSourceItem
 from app.services.ask_service import (
@@ -14,9 +12,15 @@ from app.services.ask_service import (
   out_of_scope_message,
   suggestion_chips,
 )
+from app.services.deadline_service import MIN_STAGE_SEC, Deadline, new_deadline
 from app.services.hash_service import hash_query
-from app.services.offline_pack_service import get_suggestions, match_offline
-from app.services.rag_service import retrieve
+from app.services.heavy_hitters_service import record_query
+from app.services.http_service import get_http_session
+from app.services.offline_pack_service import get_suggestions, match_offline, offline_prose
+from app.services.profiling_service import profiled
+from app.services.rag_service import get_query_embedding, retrieve
+from app.services.ratelimit_service import CHARS_PER_TOKEN, RateLimited, acquire_llm, estimate_tokens
+from app.services.tracing_service import annotate, current_trace_id, event, span, traced
 
 OFFLINE_THRESHOLD = 0.25
 RAG_THRESHOLD = 0.35
@@ -199,48 +203,17 @@ def _empty_query_message(lang: str) -> str:
   return "Please ask me a question about Umrah!"
 
 
-def _offline_to_prose(match: Dict[str, Any], lang: str) -> str:
-  answer = match.get("answer", {})
-  parts: List[str] = []
-
-  if answer.get("direct"):
-    if lang == "AR":
-      parts.append("## \u0627\u0644\u0627\u062c\u0627\u0628\u0629 \u0627\u0644\u0645\u0628\u0627\u0634\u0631\u0629")
-    elif lang == "FR":
-      parts.append("## Reponse directe")
-    else:
-      parts.append("## Direct Answer")
-    parts.append(answer["direct"])
-
-  steps = answer.get("steps", [])
-  if steps:
-    if lang == "AR":
-      parts.append("## \u0627\u0644\u062e\u0637\u0648\u0627\u062a")
-    elif lang == "FR":
-      parts.append("## Etapes")
-    else:
-      parts.append("## Steps")
-    parts.append("\n".join(f"- {s}" for s in steps))
-
-  mistakes = answer.get("mistakes", [])
-  if mistakes:
-    if lang == "AR":
-      parts.append("## \u0627\u062e\u0637\u0627\u0621 \u0634\u0627\u0626\u0639\u0629")
-    elif lang == "FR":
-      parts.append("## Erreurs courantes a eviter")
-    else:
-      parts.append("## Common Mistakes")
-    parts.append("\n".join(f"- {m}" for m in mistakes))
-
-  return "\n\n".join(parts)
-
-
 def _yield_text_as_tokens(text: str, chunk_size: int = 8) -> Generator[str, None, None]:
   for i in range(0, len(text), chunk_size):
     yield _sse_token(text[i:i + chunk_size])
 
 
-def _stream_openai(messages: List[Dict[str, Any]]) -> Generator[str, None, str]:
+@traced("llm_stream")
+def _stream_openai(
+  messages: List[Dict[str, Any]],
+  deadline: Deadline | None = None,
+  limit_key: str | None = None,
+) -> Generator[str, None, str]:
   api_key = os.getenv("OPENAI_API_KEY")
   if not api_key:
     raise RuntimeError("OPENAI_API_KEY missing")
@@ -257,54 +230,76 @@ def _stream_openai(messages: List[Dict[str, Any]]) -> Generator[str, None, str]:
     "stream": True,
   }
 
+  body = json.dumps(payload)
+  estimated = estimate_tokens(body)
+  used_tokens = 0
   full_text = ""
   last_err = None
-  deadline = time.time() + 15.0
+  deadline = deadline or new_deadline(15.0)
   for attempt in range(2):
-    remaining = max(1.0, deadline - time.time())
-    if remaining <= 1.0:
+    if not deadline.has(MIN_STAGE_SEC):
       break
+    if attempt == 0:
+      # Raises RateLimited before anything is sent (or streamed) when the session or upstream quota is spent.
+      grant = acquire_llm(limit_key, estimated)
+    else:
+      try:
+        # A retry is another upstream request, so it takes its own global tokens.
+        grant = acquire_llm(None, estimated)
+      except RateLimited:
+        break
     try:
-      resp = requests.post(
+      # The budget bounds the wait for the stream to start; once tokens flow
+      # the read timeout applies per chunk, so answers are not cut mid-sentence.
+      with get_http_session().post(
         url,
         headers=headers,
-        data=json.dumps(payload),
-        timeout=(5, min(12, remaining)),
+        data=body,
+        timeout=deadline.timeout(5, 12, "llm_stream"),
         stream=True,
-      )
-      if resp.status_code == 429 or resp.status_code >= 500:
-        raise RuntimeError(f"openai_http_{resp.status_code}")
-      resp.raise_for_status()
-
-      for line in resp.iter_lines(decode_unicode=True):
-        if not line or not line.startswith("data:"):
-          continue
-        data_str = line[len("data:"):].strip()
-        if data_str == "[DONE]":
-          break
-        try:
-          event = json.loads(data_str)
-        except json.JSONDecodeError:
-          continue
-
-        if event.get("type") == "response.output_text.delta":
-          delta = event.get("delta", "")
-          if delta:
-            full_text += delta
-            yield _sse_token(delta)
-
+      ) as resp:
+        if resp.status_code == 429 or resp.status_code >= 500:
+          raise RuntimeError(f"openai_http_{resp.status_code}")
+        resp.raise_for_status()
+
+        for line in resp.iter_lines(decode_unicode=True):
+          if not line or not line.startswith("data:"):
+            continue
+          data_str = line[len("data:"):].strip()
+          if data_str == "[DONE]":
+            break
+          try:
+            event = json.loads(data_str)
+          except json.JSONDecodeError:
+            continue
+
+          if event.get("type") == "response.output_text.delta":
+            delta = event.get("delta", "")
+            if delta:
+              full_text += delta
+              yield _sse_token(delta)
+          elif event.get("type") == "response.completed":
+            used_tokens = int(((event.get("response") or {}).get("usage") or {}).get("total_tokens") or 0)
+
+      grant.settle(used_tokens or (len(body) + len(full_text)) // CHARS_PER_TOKEN)
       return full_text
     except Exception as e:
       last_err = e
       logging.warning("openai_stream_error attempt=%d %s", attempt, type(e).__name__)
-      if attempt == 0 and (deadline - time.time()) > 2.0:
+      # Retrying a 429 only adds to the pressure on the quota.
+      if attempt == 0 and not full_text and str(e) != "openai_http_429" and deadline.allows_optional_work():
         time.sleep(0.6)
+        continue
+      break
 
   raise last_err or RuntimeError("OpenAI streaming failed")
 
 
-def stream_chat_response(payload: ChatRequest) -> Generator[str, None, None]:
+@profiled
+def stream_chat_response(payload: ChatRequest, deadline: Deadline | None = None) -> Generator[str, None, None]:
   start = time.time()
+  deadline = deadline or new_deadline()
+  first_retrieval = None
   route_used = "fallback"
   confidence = 0.0
   sources_list: List[Dict[str, Any]] = []
@@ -389,16 +384,24 @@ def stream_chat_response(payload: ChatRequest) -> Generator[str, None, None]:
       _log_analytics(payload, "fallback", 0.0, 0, None, latency_ms, latest_query)
       return
 
-    match, offline_conf = match_offline(rag_query, payload.lang)
+    # One embedding serves both the offline intent match and Chroma retrieval;
+    # if it fails, retrieve() must not try again within the same budget.
+    query_embedding = get_query_embedding(rag_query, deadline=deadline)
+    match, offline_conf = match_offline(rag_query, payload.lang, embedding=query_embedding)
     if match and offline_conf >= OFFLINE_THRESHOLD:
       source_ids = match.get("source_ids", [])
-      sources_raw, _ = retrieve(rag_query, payload.lang, top_k=3)
+      sources_raw, first_conf = retrieve(
+        rag_query, payload.lang, top_k=3, deadline=deadline, embedding=query_embedding, embed_if_missing=False
+      )
+      first_retrieval = (sources_raw, first_conf)
       filtered = [
         s for s in sources_raw
         if s.get("source_id") in source_ids and s.get("score", 0) >= MIN_SOURCE_SCORE
       ]
+      if len(filtered) < MIN_SOURCES:
+        event("offline_sources_rejected", matched=len(filtered), confidence=round(offline_conf, 3))
       if len(filtered) >= MIN_SOURCES:
-        prose = _offline_to_prose(match, payload.lang)
+        prose = offline_prose(match, payload.lang)
         yield from _yield_text_as_tokens(prose)
         latency_ms = int((time.time() - start) * 1000)
         yield _sse_meta(
@@ -414,27 +417,40 @@ def stream_chat_response(payload: ChatRequest) -> Generator[str, None, None]:
         return
 
     try:
-      print("Retreiving relevant results")
-      sources_raw, rag_conf = retrieve(rag_query, payload.lang, top_k=5)
-      print("Results retreived successfully from ChromDB!")
-    except Exception as e:
-      print("Some error occured while retreiving results")
+      if first_retrieval is not None and not deadline.allows_optional_work():
+        # Not enough budget for a second retrieval; reuse the offline check's results.
+        sources_raw, rag_conf = first_retrieval
+      else:
+        sources_raw, rag_conf = retrieve(
+          rag_query, payload.lang, top_k=5, deadline=deadline, embedding=query_embedding, embed_if_missing=False
+        )
+    except Exception:
+      logging.exception("chat retrieval failed")
+      sources_raw, rag_conf = [], 0.0
     sources_raw = [s for s in sources_raw if s.get("score", 0) >= MIN_SOURCE_SCORE]
     confidence = rag_conf
 
     history = [{"role": m.role, "content": m.content} for m in payload.messages[-MAX_HISTORY_MESSAGES:]]
 
-    if len(sources_raw) >= MIN_SOURCES and rag_conf >= RAG_THRESHOLD:
+    llm_budget_ok = deadline.has(MIN_STAGE_SEC)
+    if not llm_budget_ok:
+      error_code = "deadline_exceeded"
+
+    throttled = None
+    if llm_budget_ok and len(sources_raw) >= MIN_SOURCES and rag_conf >= RAG_THRESHOLD:
       system_prompt = _build_system_prompt(payload.lang, sources_raw)
       openai_input = _build_openai_input(system_prompt, history)
-      _ = yield from _stream_openai(openai_input)
-      sources_list = sources_raw
-      route_used = "rag"
-      chips = get_suggestions(latest_query, payload.lang, limit=3)
-      refinement_chips = chips if chips else []
+      try:
+        _ = yield from _stream_openai(openai_input, deadline=deadline, limit_key=payload.session_id)
+        sources_list = sources_raw
+        route_used = "rag"
+        chips = get_suggestions(latest_query, payload.lang, limit=3)
+        refinement_chips = chips if chips else []
+      except RateLimited as e:
+        throttled = str(e)
     else:
       is_first_message = len(payload.messages) <= 1
-      if is_first_message and _is_vague_query(latest_query):
+      if not llm_budget_ok or (is_first_message and _is_vague_query(latest_query)):
         clarify_text = clarifier(latest_query, payload.lang)
         yield from _yield_text_as_tokens(clarify_text)
         refinement_chips = suggestion_chips(latest_query, payload.lang)
@@ -443,11 +459,26 @@ def stream_chat_response(payload: ChatRequest) -> Generator[str, None, None]:
       else:
         system_prompt = _build_system_prompt_ungrounded(payload.lang)
         openai_input = _build_openai_input(system_prompt, history)
-        _ = yield from _stream_openai(openai_input)
-        route_used = "general"
-        general_mode = True
-        chips = get_suggestions(latest_query, payload.lang, limit=3)
-        refinement_chips = chips if chips else []
+        try:
+          _ = yield from _stream_openai(openai_input, deadline=deadline, limit_key=payload.session_id)
+          route_used = "general"
+          general_mode = True
+          chips = get_suggestions(latest_query, payload.lang, limit=3)
+          refinement_chips = chips if chips else []
+        except RateLimited as e:
+          throttled = str(e)
+
+    if throttled:
+      # Nothing was streamed yet: the limit is checked before the upstream call.
+      # A verified pack answer would have been sent already, so only a clarifier is left.
+      event("rate_limited", reason=throttled)
+      clarifying_question = clarifier(latest_query, payload.lang)
+      yield from _yield_text_as_tokens(clarifying_question)
+      route_used = "fallback"
+      sources_list = []
+      confidence = rag_conf
+      refinement_chips = suggestion_chips(latest_query, payload.lang)
+      error_code = "rate_limited"
 
     latency_ms = int((time.time() - start) * 1000)
     yield _sse_meta(
@@ -494,19 +525,24 @@ def _log_analytics(
   latency_ms: int,
   query: str,
 ) -> None:
+  hashed = hash_query(query)
+  record_query(hashed)
+  annotate(route_used=route_used, error_code=error_code)
   try:
-    insert_analytics(
-      session_id=payload.session_id,
-      mode="chat",
-      lang=payload.lang,
-      rating_1_5=None,
-      time_on_screen_ms=None,
-      route_used=route_used,
-      confidence=confidence,
-      sources_count=sources_count,
-      error_code=error_code,
-      latency_ms=latency_ms,
-      hashed_query=hash_query(query),
-    )
+    with span("analytics_write"):
+      insert_analytics(
+        session_id=payload.session_id,
+        mode="chat",
+        lang=payload.lang,
+        rating_1_5=None,
+        time_on_screen_ms=None,
+        route_used=route_used,
+        confidence=confidence,
+        sources_count=sources_count,
+        error_code=error_code,
+        latency_ms=latency_ms,
+        hashed_query=hashed,
+        trace_id=current_trace_id(),
+      )
   except Exception:
     pass
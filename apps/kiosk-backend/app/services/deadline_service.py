@@ -0,0 +1,59 @@
+import os
+import time
+from typing import Tuple
+
+DEFAULT_REQUEST_SLO_SEC = 8.0
+# Below this much remaining budget an upstream call is not worth starting.
+MIN_STAGE_SEC = 0.75
+# Optional work (retries, second retrieval) needs at least this much headroom.
+OPTIONAL_WORK_SEC = 3.0
+
+
+class DeadlineExceeded(RuntimeError):
+  pass
+
+
+class Deadline:
+  """Wall-clock budget for one request, shared by every stage it passes through."""
+
+  def __init__(self, budget_sec: float) -> None:
+    self.budget_sec = budget_sec
+    self.started_at = time.monotonic()
+    self.expires_at = self.started_at + budget_sec
+
+  def remaining(self) -> float:
+    return max(0.0, self.expires_at - time.monotonic())
+
+  def elapsed(self) -> float:
+    return time.monotonic() - self.started_at
+
+  def expired(self) -> bool:
+    return self.remaining() <= 0.0
+
+  def has(self, seconds: float) -> bool:
+    return self.remaining() >= seconds
+
+  def allows_optional_work(self) -> bool:
+    return self.has(OPTIONAL_WORK_SEC)
+
+  def check(self, stage: str) -> None:
+    if not self.has(MIN_STAGE_SEC):
+      raise DeadlineExceeded(f"deadline_exceeded before {stage}")
+
+  def timeout(self, connect: float, read: float, stage: str = "upstream") -> Tuple[float, float]:
+    """Clamp a (connect, read) requests timeout to the remaining budget."""
+    self.check(stage)
+    remaining = self.remaining()
+    return (min(connect, remaining), min(read, remaining))
+
+
+def get_request_slo_sec() -> float:
+  try:
+    value = float(os.getenv("REQUEST_SLO_SEC", str(DEFAULT_REQUEST_SLO_SEC)))
+  except ValueError:
+    value = DEFAULT_REQUEST_SLO_SEC
+  return value if value > 0 else DEFAULT_REQUEST_SLO_SEC
+
+
+def new_deadline(budget_sec: float | None = None) -> Deadline:
+  return Deadline(budget_sec if budget_sec is not None else get_request_slo_sec())
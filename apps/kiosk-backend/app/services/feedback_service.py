@@ -1,5 +1,23 @@
-from app.schemas.feedback import FeedbackRequest, FeedbackResponse
-from app.db.sqlite import insert_analytics
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from app.schemas.feedback import (
+  ClientEvent,
+  FeedbackBatchRequest,
+  FeedbackBatchResponse,
+  FeedbackRequest,
+  FeedbackResponse,
+  RejectedEvent,
+)
+from app.db.sqlite import insert_analytics, insert_client_events
+from app.services.tracing_service import current_trace_id
+
+EVENT_MODES = {"feedback": "feedback", "timing": "client_timing"}
+# Buffered events may be old, but client clocks that run ahead are not trusted.
+MAX_CLIENT_CLOCK_SKEW = timedelta(minutes=5)
+MAX_EVENT_AGE = timedelta(days=7)
 
 
 def record_feedback(payload: FeedbackRequest) -> FeedbackResponse:
@@ -14,6 +32,77 @@ def record_feedback(payload: FeedbackRequest) -> FeedbackResponse:
     sources_count=None,
     error_code=None,
     latency_ms=None,
-    hashed_query=None
+    hashed_query=None,
+    trace_id=current_trace_id()
   )
   return FeedbackResponse(ok=True)
+
+
+def _event_ts(client_ts: str | None, now: datetime) -> int:
+  """When the event happened on the kiosk (epoch ms), falling back to receipt time."""
+  if client_ts:
+    try:
+      parsed = datetime.fromisoformat(client_ts.replace("Z", "+00:00"))
+      if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+      if now - MAX_EVENT_AGE <= parsed <= now + MAX_CLIENT_CLOCK_SKEW:
+        now = parsed.astimezone(timezone.utc)
+    except ValueError:
+      pass
+  return int(now.timestamp() * 1000)
+
+
+def _analytics_row(event: ClientEvent, now: datetime) -> Tuple:
+  # Column order matches db.sqlite.ANALYTICS_COLUMNS.
+  return (
+    event.session_id,
+    event.lang,
+    EVENT_MODES[event.type],
+    event.rating_1_5,
+    event.time_on_screen_ms,
+    event.route_used,
+    event.confidence,
+    None,
+    None,
+    event.latency_ms,
+    None,
+    _event_ts(event.client_ts, now),
+    current_trace_id(),
+  )
+
+
+def record_feedback_batch(payload: FeedbackBatchRequest) -> FeedbackBatchResponse:
+  now = datetime.now(timezone.utc)
+  rejected: List[RejectedEvent] = []
+  rows: Dict[str, Tuple] = {}
+  repeated = 0
+  for index, raw in enumerate(payload.events):
+    if not isinstance(raw, dict):
+      rejected.append(RejectedEvent(index=index, reason="event: must be an object"))
+      continue
+    try:
+      event = ClientEvent.model_validate(raw)
+    except ValidationError as e:
+      error = e.errors()[0]
+      field = ".".join(str(p) for p in error.get("loc", ())) or "event"
+      rejected.append(RejectedEvent(
+        index=index,
+        event_id=raw.get("event_id") if isinstance(raw.get("event_id"), str) else None,
+        reason=f"{field}: {error.get('msg', 'invalid')}",
+      ))
+      continue
+    if event.type == "feedback" and event.rating_1_5 is None:
+      rejected.append(RejectedEvent(index=index, event_id=event.event_id, reason="rating_1_5: required for feedback"))
+      continue
+    if event.event_id in rows:
+      repeated += 1
+      continue
+    rows[event.event_id] = _analytics_row(event, now)
+
+  accepted, duplicates = insert_client_events(list(rows.items()))
+  return FeedbackBatchResponse(
+    ok=not rejected,
+    accepted=accepted,
+    duplicates=len(duplicates) + repeated,
+    rejected=rejected,
+  )
@@ -1,27 +1,176 @@
+import base64
+import json
 import os
-import time
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple
+
 from app.schemas.guide import GuideRequest, GuideResponse, ChecklistSection
 from app.db.sqlite import insert_analytics
+from app.services.tracing_service import current_trace_id
+from app.services.offline_pack_service import OfflinePack, get_offline_pack
 
+SHARE_FORMAT_VERSION = 1
+# Keeps the QR at a size phones scan reliably from a kiosk screen.
+SHARE_MAX_CHARS = int(os.getenv("SHARE_MAX_CHARS", "1200"))
+MAX_MISTAKES = 6
 
-def build_checklist(payload: GuideRequest) -> GuideResponse:
-  start = time.time()
-  base = os.getenv("PUBLIC_QR_BASE_URL", "http://localhost:5175")
-  qr_url = f"{base}/share#d=placeholder"
-
-  response = GuideResponse(
-    checklist_sections=[
-      ChecklistSection(title="Preparation", items=["Item A", "Item B"]),
-      ChecklistSection(title="Umrah steps", items=["Item C", "Item D"])
-    ],
-    qr_url=qr_url
+
+class SectionSpec(NamedTuple):
+  key: str
+  topics: Tuple[str, ...]
+  optional: bool
+
+
+# Topics are pack entry ids without the language prefix and counter,
+# e.g. "en-umrah-steps-1" -> "umrah-steps", so one template serves every language.
+SECTIONS = (
+  SectionSpec("preparation", ("miqat", "ihram"), False),
+  SectionSpec("permits", ("nusuk",), True),
+  SectionSpec("umrah", ("umrah-steps", "tawaf", "sai"), False),
+  SectionSpec("rawdah", ("rawdah",), True),
+  SectionSpec("mistakes", ("mistakes",), False),
+)
+
+SECTION_TITLES = {
+  "EN": {
+    "preparation": "Preparation",
+    "permits": "Permits (Nusuk)",
+    "umrah": "Umrah steps",
+    "rawdah": "Visiting the Rawdah",
+    "mistakes": "Common mistakes to avoid",
+  },
+  "AR": {
+    "preparation": "التحضير",
+    "permits": "التصاريح (نسك)",
+    "umrah": "خطوات العمرة",
+    "rawdah": "زيارة الروضة",
+    "mistakes": "اخطاء شائعة",
+  },
+  "FR": {
+    "preparation": "Preparation",
+    "permits": "Permis (Nusuk)",
+    "umrah": "Etapes de la Omra",
+    "rawdah": "Visite de la Rawdah",
+    "mistakes": "Erreurs courantes a eviter",
+  },
+}
+
+# Wizard answers that switch on an optional section.
+WIZARD_OPTIONS = {
+  "permits": "permits",
+  "nusuk": "permits",
+  "rawdah": "rawdah",
+  "madinah": "rawdah",
+}
+
+_ID_TOPIC = re.compile(r"^[a-z]{2}-(.+?)(?:-\d+)?$")
+
+
+def entry_topic(entry_id: str) -> str:
+  match = _ID_TOPIC.match(entry_id or "")
+  return match.group(1) if match else ""
+
+
+def compile_templates(pack: OfflinePack) -> Dict[str, Dict[str, List[str]]]:
+  """{lang: {section key: items}} with every section filled from the pack."""
+  by_topic: Dict[Tuple[str, str], List[Dict]] = {}
+  for entry in pack.entries:
+    by_topic.setdefault((entry.get("lang", ""), entry_topic(entry.get("id", ""))), []).append(entry)
+  templates: Dict[str, Dict[str, List[str]]] = {}
+  for lang in pack.langs:
+    sections: Dict[str, List[str]] = {}
+    mistakes: List[str] = []
+    for spec in SECTIONS:
+      items: List[str] = []
+      for topic in spec.topics:
+        for entry in by_topic.get((lang, topic), []):
+          answer = entry.get("answer", {}) or {}
+          field = "mistakes" if spec.key == "mistakes" else "steps"
+          items.extend(s for s in answer.get(field, []) if isinstance(s, str))
+          if spec.key != "mistakes":
+            mistakes.extend(m for m in answer.get("mistakes", []) if isinstance(m, str))
+      if spec.key == "mistakes":
+        # The dedicated entries first, then the mistakes attached to the steps above.
+        sections[spec.key] = list(dict.fromkeys(items + mistakes))[:MAX_MISTAKES]
+      else:
+        sections[spec.key] = list(dict.fromkeys(items))
+    templates[lang] = sections
+  return templates
+
+
+@lru_cache(maxsize=4)
+def _templates_for(version: str) -> Dict[str, Dict[str, List[str]]]:
+  return compile_templates(get_offline_pack())
+
+
+def canonical_answers(wizard: List[str]) -> Tuple[str, ...]:
+  """Recognised wizard options, deduplicated and sorted (the cache key)."""
+  return tuple(sorted({
+    WIZARD_OPTIONS[a.strip().lower()]
+    for a in wizard
+    if isinstance(a, str) and a.strip().lower() in WIZARD_OPTIONS
+  }))
+
+
+def encode_share_payload(lang: str, sections: List[Tuple[str, List[str]]]) -> str:
+  """Raw-deflate + base64url (no padding) of a compact JSON checklist.
+
+  Section titles are sent as keys; the share page localizes them. Items are
+  dropped from the end (mistakes first) until the payload fits SHARE_MAX_CHARS.
+  """
+  kept = [(key, list(items)) for key, items in sections]
+  truncated = False
+  while True:
+    doc: Dict = {"v": SHARE_FORMAT_VERSION, "l": lang, "s": [[k, items] for k, items in kept if items]}
+    if truncated:
+      doc["t"] = 1
+    raw = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    packed = compressor.compress(raw) + compressor.flush()
+    encoded = base64.urlsafe_b64encode(packed).decode("ascii").rstrip("=")
+    if len(encoded) <= SHARE_MAX_CHARS or not any(items for _, items in kept):
+      return encoded
+    for _, items in reversed(kept):
+      if items:
+        items.pop()
+        truncated = True
+        break
+
+
+def decode_share_payload(encoded: str) -> Dict:
+  packed = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+  return json.loads(zlib.decompress(packed, -15).decode("utf-8"))
+
+
+@lru_cache(maxsize=256)
+def _checklist(version: str, lang: str, answers: Tuple[str, ...], base: str) -> GuideResponse:
+  templates = _templates_for(version)
+  sections = templates.get(lang) or templates.get("EN") or {}
+  titles = SECTION_TITLES.get(lang, SECTION_TITLES["EN"])
+  chosen = [
+    (spec.key, sections.get(spec.key, []))
+    for spec in SECTIONS
+    if (not spec.optional or spec.key in answers) and sections.get(spec.key)
+  ]
+  return GuideResponse(
+    checklist_sections=[ChecklistSection(title=titles[key], items=items) for key, items in chosen],
+    qr_url=f"{base}/share#d={encode_share_payload(lang, chosen)}",
   )
 
-  latency_ms = int((time.time() - start) * 1000)
+
+def build_checklist(payload: GuideRequest) -> GuideResponse:
+  base = os.getenv("PUBLIC_QR_BASE_URL", "http://localhost:5175").rstrip("/")
+  lang = (payload.lang or "EN").upper()
+  return _checklist(get_offline_pack().version, lang, canonical_answers(payload.wizard), base)
+
+
+def record_guide_event(lang: str, latency_ms: int) -> None:
   insert_analytics(
     session_id="unknown",
     mode="guide",
-    lang=payload.lang,
+    lang=lang,
     rating_1_5=None,
     time_on_screen_ms=None,
     route_used=None,
@@ -29,7 +178,6 @@ def build_checklist(payload: GuideRequest) -> GuideResponse:
     sources_count=None,
     error_code=None,
     latency_ms=latency_ms,
-    hashed_query=None
+    hashed_query=None,
+    trace_id=current_trace_id()
   )
-
-  return response
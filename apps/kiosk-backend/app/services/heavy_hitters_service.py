@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from operator import add
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db.sqlite import get_sqlite_path, now_ms
+from app.services.cache_service import unpin_cold
+from app.services.hash_service import hash_query
+
+SKETCH_NAME = "queries"
+SKETCH_WIDTH = 2048
+# Each row indexes on its own 8 hex digits of the sha256 digest, so at most 8 rows.
+SKETCH_DEPTH = 4
+TOP_K = int(os.getenv("HEAVY_HITTERS_K", "64"))
+# How often each process merges its counts into the shared sketch in SQLite.
+PERSIST_SEC = float(os.getenv("HEAVY_HITTERS_PERSIST_SEC", "60"))
+# Counts are halved this often so the ranking follows the season (0 keeps them forever).
+HALF_LIFE_SEC = float(os.getenv("HEAVY_HITTERS_HALF_LIFE_SEC", str(7 * 24 * 3600)))
+# Prime the caches for the hottest offline-pack questions at startup.
+WARMUP_ENABLED = os.getenv("HEAVY_HITTERS_WARMUP", "1").strip().lower() not in ("0", "false", "no")
+# A top-k query must have been asked this often before its cache entries are pinned.
+MIN_PIN_COUNT = 3
+DIAG_TOP = 20
+
+_thread_started = False
+
+
+class HeavyHitters:
+  """Count-Min sketch over hashed queries, plus the current top-k of them.
+
+  Keys are hash_query digests, so no query text is kept. Estimates never
+  undercount; with width w they overcount by at most about e/w of the
+  total. `counts` is the host-wide view last read from SQLite plus this
+  process's own events since; `delta` holds those events until they are merged.
+  """
+
+  def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH, k: int = TOP_K) -> None:
+    self.width = width
+    self.depth = depth
+    self.k = k
+    self.counts = array("Q", bytes(8 * width * depth))
+    self.delta = array("Q", bytes(8 * width * depth))
+    self.total = 0
+    self.delta_total = 0
+    self.top: Dict[str, int] = {}
+    self._floor = 0
+    self.persisted_ms: Optional[int] = None
+    self._lock = threading.Lock()
+
+  def _cells(self, hashed: str) -> List[int]:
+    return [row * self.width + int(hashed[row * 8:row * 8 + 8], 16) % self.width for row in range(self.depth)]
+
+  def _estimate(self, counts: "array", hashed: str) -> int:
+    return min(counts[cell] for cell in self._cells(hashed))
+
+  def add(self, hashed: str) -> None:
+    cells = self._cells(hashed)
+    with self._lock:
+      for cell in cells:
+        self.counts[cell] += 1
+        self.delta[cell] += 1
+      self.total += 1
+      self.delta_total += 1
+      estimate = min(self.counts[cell] for cell in cells)
+      if hashed in self.top or len(self.top) < self.k:
+        self.top[hashed] = estimate
+        self._floor = min(self.top.values())
+      elif estimate > self._floor:
+        del self.top[min(self.top, key=self.top.__getitem__)]
+        self.top[hashed] = estimate
+        self._floor = min(self.top.values())
+
+  def is_hot(self, hashed: str) -> bool:
+    return self.top.get(hashed, 0) >= MIN_PIN_COUNT
+
+  def ranked(self) -> List[Tuple[str, int]]:
+    with self._lock:
+      return sorted(self.top.items(), key=lambda item: (-item[1], item[0]))
+
+  def _rank(self, counts: "array", candidates: List[str]) -> Dict[str, int]:
+    scored = sorted(((self._estimate(counts, h), h) for h in set(candidates)), reverse=True)
+    return {h: n for n, h in scored[:self.k] if n > 0}
+
+  def persist(self, conn: sqlite3.Connection) -> None:
+    """Merge this process's new counts into the shared sketch and adopt the result."""
+    with self._lock:
+      pending, pending_total = self.delta, self.delta_total
+      self.delta = array("Q", bytes(8 * self.width * self.depth))
+      self.delta_total = 0
+      local_top = list(self.top)
+    try:
+      now = now_ms()
+      conn.execute("BEGIN IMMEDIATE")
+      try:
+        row = conn.execute(
+          "SELECT width, depth, counts, top, total, decayed_ts FROM query_sketch WHERE name = ?", (SKETCH_NAME,)
+        ).fetchone()
+        if row and (row[0], row[1]) == (self.width, self.depth):
+          shared = array("Q")
+          shared.frombytes(row[2])
+          shared_top, total, decayed_ts = [h for h, _ in json.loads(row[3])], int(row[4]), int(row[5])
+        else:
+          shared, shared_top, total, decayed_ts = array("Q", bytes(8 * self.width * self.depth)), [], 0, now
+        shared = array("Q", map(add, shared, pending))
+        total += pending_total
+        if HALF_LIFE_SEC > 0 and now - decayed_ts >= HALF_LIFE_SEC * 1000:
+          shared = array("Q", (n >> 1 for n in shared))
+          total >>= 1
+          decayed_ts = now
+        top = self._rank(shared, shared_top + local_top)
+        conn.execute(
+          "INSERT OR REPLACE INTO query_sketch (name, width, depth, counts, top, total, decayed_ts, updated_ts) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+          (SKETCH_NAME, self.width, self.depth, shared.tobytes(), json.dumps(sorted(top.items(), key=lambda i: -i[1])), total, decayed_ts, now),
+        )
+        conn.execute("COMMIT")
+      except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    except Exception:
+      with self._lock:
+        self.delta = array("Q", map(add, self.delta, pending))
+        self.delta_total += pending_total
+      raise
+    with self._lock:
+      # Events counted while the merge ran are still in delta; keep them in view.
+      self.counts = array("Q", map(add, shared, self.delta))
+      self.total = total + self.delta_total
+      self.top = self._rank(self.counts, list(top) + list(self.top))
+      self._floor = min(self.top.values()) if self.top else 0
+      self.persisted_ms = now
+
+
+_sketch = HeavyHitters()
+
+
+def record_query(hashed: str) -> None:
+  try:
+    _sketch.add(hashed)
+  except Exception:
+    logging.exception("heavy hitters update failed")
+
+
+def is_hot(hashed: str) -> bool:
+  return _sketch.is_hot(hashed)
+
+
+def hot_tag(query: str) -> Optional[str]:
+  """The query's hash when it is a current heavy hitter (used to pin cache entries)."""
+  if not _sketch.top:
+    return None
+  hashed = hash_query(query)
+  return hashed if _sketch.is_hot(hashed) else None
+
+
+def persist_sketch() -> None:
+  conn = sqlite3.connect(get_sqlite_path(), timeout=10.0, isolation_level=None)
+  try:
+    _sketch.persist(conn)
+  finally:
+    conn.close()
+  released = unpin_cold(_sketch.is_hot)
+  if released:
+    logging.info("heavy hitters: unpinned %d cache entries", released)
+
+
+def _pack_questions() -> Dict[str, Tuple[str, str]]:
+  from app.services.offline_pack_service import get_offline_pack
+
+  pack = get_offline_pack()
+  return {hash_query(variant): (lang, variant) for lang, variants in pack.langs.items() for _, variant, _, _ in variants}
+
+
+def warm_hot_queries() -> int:
+  """Embed and retrieve the hottest offline-pack questions, pinning the results.
+
+  Only hashes that match a pack question variant can be replayed; the rest
+  are counted but stay anonymous. Returns the number of questions primed.
+  """
+  from app.services.rag_service import get_collection, get_query_embeddings, prime_retrieval
+
+  known = _pack_questions()
+  by_lang: Dict[str, List[str]] = {}
+  for hashed, count in _sketch.ranked():
+    if hashed in known and count >= MIN_PIN_COUNT:
+      lang, question = known[hashed]
+      by_lang.setdefault(lang, []).append(question)
+  if not by_lang or get_collection() is None:
+    return 0
+  primed = 0
+  for lang, questions in by_lang.items():
+    embeddings = get_query_embeddings(questions)
+    prime_retrieval(questions, lang, embeddings)
+    primed += sum(1 for vec in embeddings if vec is not None)
+  logging.info("heavy hitters: warmed %d hot questions", primed)
+  return primed
+
+
+def heavy_hitters_stats() -> Dict[str, Any]:
+  known = _pack_questions()
+  total = max(1, _sketch.total)
+  return {
+    "width": _sketch.width,
+    "depth": _sketch.depth,
+    "k": _sketch.k,
+    "total": _sketch.total,
+    "persisted_ms": _sketch.persisted_ms,
+    "top": [
+      {
+        "hash": hashed[:16],
+        "estimate": count,
+        "share": round(count / total, 4),
+        "pinned": count >= MIN_PIN_COUNT,
+        # Pack questions are curated text; anything else is only ever shown as a hash.
+        "question": known[hashed][1] if hashed in known else None,
+      }
+      for hashed, count in _sketch.ranked()[:DIAG_TOP]
+    ],
+  }
+
+
+def _heavy_hitters_loop() -> None:
+  try:
+    persist_sketch()
+    if WARMUP_ENABLED:
+      warm_hot_queries()
+  except Exception:
+    logging.exception("heavy hitters startup failed")
+  while PERSIST_SEC > 0:
+    time.sleep(PERSIST_SEC)
+    try:
+      persist_sketch()
+    except Exception:
+      logging.exception("heavy hitters persist failed")
+
+
+def start_heavy_hitters() -> None:
+  """Load the shared sketch, warm the hottest questions, then merge periodically."""
+  global _thread_started
+  if _thread_started:
+    return
+  _thread_started = True
+  threading.Thread(target=_heavy_hitters_loop, name="heavy-hitters", daemon=True).start()
@@ -0,0 +1,31 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+
+_session: requests.Session | None = None
+_session_pid = 0
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+  """Keep-alive session for upstream API calls, opened lazily in each process.
+
+  Pooled connections must not cross a fork, so a worker forked from a master
+  that already made calls gets its own session on first use.
+  """
+  global _session, _session_pid
+  session = _session
+  if session is not None and _session_pid == os.getpid():
+    return session
+  with _session_lock:
+    if _session is None or _session_pid != os.getpid():
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+      session.mount("https://", adapter)
+      session.mount("http://", adapter)
+      _session, _session_pid = session, os.getpid()
+    return _session
@@ -0,0 +1,174 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Set, Tuple
+
+OUT_OF_SCOPE_KEYWORDS = [
+  "visa",
+  "immigration",
+  "passport",
+  "medical",
+  "vaccine",
+  "vaccination",
+  "vaccinated",
+  "health",
+  "legal",
+  "law",
+  "lawsuit",
+  "court",
+  "hajj only",
+  "hajj",
+  "umrah visa",
+  "employment",
+  "فيزا",
+  "تاشيرة",
+  "جواز",
+  "طبي",
+  "صحي",
+  "قانوني",
+  "الحج",
+  "visa omra",
+  "juridique",
+  "travail",
+]
+
+TOPIC_KEYWORDS = {
+  "ihram": ["ihram", "الإحرام"],
+  "rawdah": ["rawdah", "الروضة"],
+}
+
+_ARABIC_FOLD = str.maketrans({
+  "\u0623": "\u0627",  # alef with hamza above -> alef
+  "\u0625": "\u0627",  # alef with hamza below -> alef
+  "\u0622": "\u0627",  # alef with madda -> alef
+  "\u0671": "\u0627",  # alef wasla -> alef
+  "\u0629": "\u0647",  # ta marbuta -> ha
+  "\u0649": "\u064a",  # alef maqsura -> ya
+  "\u0640": None,  # tatweel
+})
+_ARABIC_CHARS = re.compile(r"[\u0600-\u06FF]")
+# Attached prefixes peeled before lookup: wa/fa, then bi-al/ka-al/lil/al/bi/li/ka.
+_CONJUNCTIONS = ("\u0648", "\u0641")
+_DEFINITE_ARTICLE = "\u0627\u0644"
+_ARTICLES = (
+  "\u0628\u0627\u0644",
+  "\u0643\u0627\u0644",
+  "\u0644\u0644",
+  _DEFINITE_ARTICLE,
+  "\u0628",
+  "\u0644",
+  "\u0643",
+)
+_MIN_STEM = 2
+# Plural endings peeled from Latin-script tokens ("visas", "passports", "vaccines").
+_LATIN_SUFFIXES = ("es", "s")
+_MIN_LATIN_STEM = 3
+
+
+class KeywordHits(NamedTuple):
+  out_of_scope: bool
+  topics: FrozenSet[str]
+  tags: FrozenSet[str]
+
+
+def fold(text: str) -> str:
+  """Matching form: lowercase, no diacritics, Arabic letter variants unified."""
+  text = (text or "").strip().lower()
+  text = "".join(
+    c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)
+  )
+  text = text.translate(_ARABIC_FOLD)
+  text = re.sub(r"[^\w\s]", " ", text, flags=re.UNICODE)
+  return re.sub(r"\s+", " ", text).strip()
+
+
+def arabic_stems(token: str) -> Set[str]:
+  """Token plus the forms left after peeling attached conjunctions and articles."""
+  stems = {token}
+  if not _ARABIC_CHARS.match(token):
+    return stems
+  for conj in _CONJUNCTIONS:
+    if token.startswith(conj) and len(token) - len(conj) > _MIN_STEM:
+      stems.add(token[len(conj):])
+  for form in list(stems):
+    for article in _ARTICLES:
+      if form.startswith(article) and len(form) - len(article) >= _MIN_STEM:
+        stems.add(form[len(article):])
+        break
+  return stems
+
+
+def latin_stems(token: str) -> Set[str]:
+  """Token plus its singular guesses, so plural keywords hit without listing each form."""
+  stems = {token}
+  if _ARABIC_CHARS.match(token):
+    return stems
+  for suffix in _LATIN_SUFFIXES:
+    if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_LATIN_STEM:
+      stems.add(token[:-len(suffix)])
+  return stems
+
+
+class KeywordRouter:
+  """Whole-word phrase matcher over every keyword list the ask/chat path consults.
+
+  Phrases are folded and stored in one dict keyed by token tuple, so a query
+  is classified with a single scan of its tokens regardless of how many
+  keywords and tags are registered.
+  """
+
+  def __init__(
+    self,
+    out_of_scope: Iterable[str],
+    topics: Dict[str, Iterable[str]],
+    tags: Iterable[str] = (),
+  ) -> None:
+    self._phrases: Dict[Tuple[str, ...], Set[Tuple[str, str]]] = {}
+    self._max_len = 1
+    for keyword in out_of_scope:
+      self._add(keyword, ("oos", keyword))
+    for topic, keywords in topics.items():
+      for keyword in keywords:
+        self._add(keyword, ("topic", topic))
+    for tag in tags:
+      folded = fold(tag)
+      if folded:
+        self._add(folded, ("tag", folded))
+    self.classify = lru_cache(maxsize=512)(self._classify)
+
+  def _add(self, phrase: str, label: Tuple[str, str]) -> None:
+    tokens = fold(phrase).split()
+    if not tokens:
+      return
+    keys = [tuple(tokens)]
+    head = tokens[0]
+    if len(tokens) == 1 and head.startswith(_DEFINITE_ARTICLE) and len(head) - 2 >= _MIN_STEM:
+      # Register Arabic keywords without "al" too, so prefixed forms like "lil-hajj" hit.
+      keys.append((head[2:],))
+    for key in keys:
+      self._phrases.setdefault(key, set()).add(label)
+    self._max_len = max(self._max_len, len(tokens))
+
+  def _classify(self, query: str) -> KeywordHits:
+    tokens = fold(query).split()
+    labels: Set[Tuple[str, str]] = set()
+    for i, token in enumerate(tokens):
+      for stem in arabic_stems(token) | latin_stems(token):
+        labels.update(self._phrases.get((stem,), ()))
+      for n in range(2, self._max_len + 1):
+        if i + n > len(tokens):
+          break
+        labels.update(self._phrases.get(tuple(tokens[i:i + n]), ()))
+    return KeywordHits(
+      out_of_scope=any(kind == "oos" for kind, _ in labels),
+      topics=frozenset(value for kind, value in labels if kind == "topic"),
+      tags=frozenset(value for kind, value in labels if kind == "tag"),
+    )
+
+
+def build_keyword_router(tags: Iterable[str] = ()) -> KeywordRouter:
+  return KeywordRouter(OUT_OF_SCOPE_KEYWORDS, TOPIC_KEYWORDS, tags)
+
+
+def fold_tags(tags: List[str]) -> FrozenSet[str]:
+  return frozenset(f for f in (fold(t) for t in tags if isinstance(t, str)) if f)
@@ -0,0 +1,198 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.services.tracing_service import current_trace_id
+
+# Records waiting for the writer thread; when full, new records are dropped, never waited on.
+QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+# Size-based rotation for LOG_FILE (stderr is always written too).
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+# In EVENT_MODE, INFO and below are kept at this rate unless LOG_SAMPLE says otherwise.
+EVENT_SAMPLE_RATE = float(os.getenv("LOG_EVENT_SAMPLE_RATE", "0.05"))
+# Loggers taken over from uvicorn, so their lines go through the queue too.
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+_state: Dict[str, Any] = {"listener": None, "handler": None, "dropped": 0, "sampled_out": 0}
+_state_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+  """One JSON object per line: ts, level, logger, msg, trace_id, plus exc when present."""
+
+  def format(self, record: logging.LogRecord) -> str:
+    entry: Dict[str, Any] = {
+      "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+      "level": record.levelname,
+      "logger": record.name,
+      "msg": record.getMessage(),
+    }
+    trace_id = getattr(record, "trace_id", None)
+    if trace_id:
+      entry["trace_id"] = trace_id
+    if record.exc_info:
+      entry["exc"] = self.formatException(record.exc_info)
+    elif record.exc_text:
+      entry["exc"] = record.exc_text
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+
+class SamplingFilter(logging.Filter):
+  """Keeps WARNING and above; keeps lower records at a per-logger rate.
+
+  Rates match the longest logger-name prefix in `rates` ("" is the default),
+  so "uvicorn.access=0.01,app.ask=0.1" thins the busiest loggers only.
+  """
+
+  def __init__(self, rates: Dict[str, float]) -> None:
+    super().__init__()
+    self.rates = rates
+    self._cache: Dict[str, float] = {}
+
+  def _rate(self, name: str) -> float:
+    rate = self._cache.get(name)
+    if rate is None:
+      match = max((p for p in self.rates if p == "" or name == p or name.startswith(p + ".")), key=len, default=None)
+      rate = self.rates[match] if match is not None else 1.0
+      self._cache[name] = rate
+    return rate
+
+  def filter(self, record: logging.LogRecord) -> bool:
+    if record.levelno >= logging.WARNING:
+      return True
+    rate = self._rate(record.name)
+    if rate >= 1.0 or (rate > 0 and random.random() < rate):
+      return True
+    _state["sampled_out"] += 1
+    return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+  """Formats nothing on the caller's thread: it stamps the trace id and enqueues."""
+
+  def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+    # The message is rendered here so args holding live objects are not shared
+    # with the writer thread; formatting to JSON happens over there.
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info and not record.exc_text:
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+    record.exc_info = None
+    record.trace_id = current_trace_id()
+    return record
+
+  def enqueue(self, record: logging.LogRecord) -> None:
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      _state["dropped"] += 1
+
+
+def parse_sample_rates(value: str, event_mode: bool) -> Dict[str, float]:
+  """LOG_SAMPLE ("logger=rate,...") on top of EVENT_SAMPLE_RATE; outside EVENT_MODE nothing is sampled."""
+  if not event_mode:
+    return {}
+  rates: Dict[str, float] = {"": EVENT_SAMPLE_RATE}
+  for part in value.split(","):
+    name, _, rate = part.partition("=")
+    if rate.strip():
+      try:
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+      except ValueError:
+        pass
+  return rates
+
+
+def _file_path(pid_suffix: bool) -> Optional[Path]:
+  value = os.getenv("LOG_FILE", "").strip()
+  if not value:
+    return None
+  path = Path(value)
+  # Forked workers each rotate their own file; RotatingFileHandler is not multi-process safe.
+  return path.with_name(f"{path.stem}.{os.getpid()}{path.suffix}") if pid_suffix else path
+
+
+def _build_handlers(pid_suffix: bool) -> List[logging.Handler]:
+  formatter: logging.Formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(
+    "%(asctime)s %(levelname)s %(name)s %(message)s"
+  )
+  handlers: List[logging.Handler] = [logging.StreamHandler(sys.stderr)]
+  path = _file_path(pid_suffix)
+  if path is not None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"))
+  for handler in handlers:
+    handler.setFormatter(formatter)
+  return handlers
+
+
+def _start_listener(pid_suffix: bool) -> None:
+  log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(QUEUE_MAX)
+  handler = _state["handler"]
+  handler.queue = log_queue
+  listener = logging.handlers.QueueListener(log_queue, *_build_handlers(pid_suffix), respect_handler_level=False)
+  listener.start()
+  _state["listener"] = listener
+
+
+def _after_fork_in_child() -> None:
+  # The writer thread does not survive fork(); give the worker its own queue and writer.
+  if _state["handler"] is not None:
+    _start_listener(pid_suffix=True)
+
+
+def stop_logging() -> None:
+  """Flush what is queued (called at shutdown)."""
+  listener = _state["listener"]
+  if listener is not None:
+    _state["listener"] = None
+    listener.stop()
+
+
+def setup_logging(event_mode: bool) -> None:
+  """Send every log record (app and uvicorn) through one queue to a writer thread.
+
+  Request threads only enqueue, so a slow disk or console never stalls a
+  streamed answer. Safe to call more than once.
+  """
+  with _state_lock:
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    if _state["handler"] is None:
+      handler = NonBlockingQueueHandler(queue.Queue(QUEUE_MAX))
+      _state["handler"] = handler
+      _start_listener(pid_suffix=False)
+      if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+      atexit.register(stop_logging)
+    handler = _state["handler"]
+    handler.filters = [SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE", ""), event_mode))]
+    root.handlers = [handler]
+    for name in UVICORN_LOGGERS:
+      logger = logging.getLogger(name)
+      logger.handlers = []
+      logger.propagate = True
+
+
+def logging_stats() -> Dict[str, Any]:
+  handler = _state["handler"]
+  return {
+    "queued": handler.queue.qsize() if handler is not None else 0,
+    "queue_max": QUEUE_MAX,
+    "dropped": _state["dropped"],
+    "sampled_out": _state["sampled_out"],
+    "format": LOG_FORMAT,
+    "file": str(_file_path(False)) if _file_path(False) else None,
+  }
@@ -0,0 +1,126 @@
+import math
+from typing import Any, Dict, List, Tuple
+
+try:
+  import numpy as np
+except Exception:
+  np = None
+
+NGRAM_SIZE = 3
+
+
+def numpy_available() -> bool:
+  return np is not None
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> List[str]:
+  padded = f" {text} "
+  if len(padded) < n:
+    return [padded]
+  return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+
+class NgramIndex:
+  """TF-IDF weighted character n-gram vectors for a fixed list of texts.
+
+  Rows are L2-normalized and stored column-major (one column per n-gram), so
+  scoring a query is a sparse matrix-vector product: gather the columns of the
+  query's n-grams and accumulate them per row with one `bincount`.
+  """
+
+  def __init__(self, texts: List[str]) -> None:
+    if np is None:
+      raise RuntimeError("numpy is required for the n-gram matcher")
+    self.size = len(texts)
+    vocab: Dict[str, int] = {}
+    rows: List[Dict[int, int]] = []
+    df: Dict[int, int] = {}
+    for text in texts:
+      counts: Dict[int, int] = {}
+      for gram in char_ngrams(text):
+        col = vocab.setdefault(gram, len(vocab))
+        counts[col] = counts.get(col, 0) + 1
+      for col in counts:
+        df[col] = df.get(col, 0) + 1
+      rows.append(counts)
+
+    idf = np.ones(len(vocab), dtype=np.float32)
+    for col, freq in df.items():
+      idf[col] = math.log((1 + self.size) / (1 + freq)) + 1.0
+    self.vocab = vocab
+    self.idf = idf
+    # Unseen query n-grams still count toward the query norm.
+    self.unseen_idf = float(math.log(1 + self.size) + 1.0)
+
+    cols_by_gram: List[List[Tuple[int, float]]] = [[] for _ in range(len(vocab))]
+    for row, counts in enumerate(rows):
+      weights = {col: (1.0 + math.log(tf)) * float(idf[col]) for col, tf in counts.items()}
+      norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+      for col, w in weights.items():
+        cols_by_gram[col].append((row, w / norm))
+
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    for col, entries in enumerate(cols_by_gram):
+      indptr[col + 1] = indptr[col] + len(entries)
+    self.indptr = indptr
+    self.indices = np.fromiter((r for entries in cols_by_gram for r, _ in entries), dtype=np.int32, count=int(indptr[-1]))
+    self.data = np.fromiter((w for entries in cols_by_gram for _, w in entries), dtype=np.float32, count=int(indptr[-1]))
+
+  def export(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """JSON-safe fields and numpy arrays that `restore` rebuilds this index from."""
+    grams = [""] * len(self.vocab)
+    for gram, col in self.vocab.items():
+      grams[col] = gram
+    fields = {"size": self.size, "unseen_idf": self.unseen_idf, "grams": grams}
+    arrays = {"idf": self.idf, "indptr": self.indptr, "indices": self.indices, "data": self.data}
+    return fields, arrays
+
+  @classmethod
+  def restore(cls, fields: Dict[str, Any], arrays: Dict[str, Any]) -> "NgramIndex":
+    index = cls.__new__(cls)
+    index.size = int(fields["size"])
+    index.unseen_idf = float(fields["unseen_idf"])
+    index.vocab = {gram: col for col, gram in enumerate(fields["grams"])}
+    index.idf = arrays["idf"]
+    index.indptr = arrays["indptr"]
+    index.indices = arrays["indices"]
+    index.data = arrays["data"]
+    return index
+
+  def scores(self, text: str):
+    counts: Dict[str, int] = {}
+    for gram in char_ngrams(text):
+      counts[gram] = counts.get(gram, 0) + 1
+    cols: List[int] = []
+    weights: List[float] = []
+    norm_sq = 0.0
+    for gram, tf in counts.items():
+      col = self.vocab.get(gram)
+      w = (1.0 + math.log(tf)) * (float(self.idf[col]) if col is not None else self.unseen_idf)
+      norm_sq += w * w
+      if col is not None:
+        cols.append(col)
+        weights.append(w)
+    if not cols or not self.size:
+      return np.zeros(self.size, dtype=np.float32)
+    norm = math.sqrt(norm_sq)
+    starts = self.indptr[cols]
+    lengths = self.indptr[np.asarray(cols) + 1] - starts
+    # Flat positions of every stored entry in the selected columns.
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    positions = np.arange(int(lengths.sum())) + offsets
+    col_weights = np.repeat(np.asarray(weights, dtype=np.float32) / norm, lengths)
+    return np.bincount(
+      self.indices[positions],
+      weights=self.data[positions] * col_weights,
+      minlength=self.size,
+    ).astype(np.float32)
+
+  def top_k(self, text: str, k: int = 5) -> List[Tuple[int, float]]:
+    if not self.size or k <= 0:
+      return []
+    scores = self.scores(text)
+    k = min(k, self.size)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
@@ -1,12 +1,31 @@
-﻿import json
+﻿import hashlib
+import json
+import logging
 import os
 import re
+import threading
+import time
 import unicodedata
-from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from app.services.hash_service import hash_query
+from app.services.keyword_service import KeywordRouter, build_keyword_router, fold, fold_tags
+from app.services.ngram_service import NgramIndex, np, numpy_available
+from app.services.rag_service import get_embed_model
+from app.services.tracing_service import traced
+
+PACK_FORMAT_VERSION = 3
+RELOAD_CHECK_SEC = float(os.getenv("OFFLINE_PACK_RELOAD_SEC", "5"))
+# Minimum trigram cosine for a fuzzy (typo/transliteration) offline hit; >= 1 disables it.
+FUZZY_MIN_SCORE = float(os.getenv("OFFLINE_FUZZY_MIN_SCORE", "0.55"))
+# Queries of at most this many words are also matched word by word ("tawaaf" -> "tawaf"):
+# against a whole variant, one misspelt word scores a trigram cosine of only ~0.35.
+SHORT_QUERY_WORDS = 2
+# Shorter words are never respelt, so "do" does not turn into "to".
+MIN_RESPELL_LEN = 4
+# Minimum cosine between the query embedding and a pre-embedded variant.
+EMBED_MIN_SCORE = float(os.getenv("OFFLINE_EMBED_MIN_SCORE", "0.75"))
 
 
 def get_offline_pack_path() -> str:
@@ -56,48 +75,474 @@ def score(query: str, variant: str) -> float:
   return len(intersection) / len(union)
 
 
-@lru_cache(maxsize=1)
+def get_compiled_pack_path() -> str:
+  env_val = os.getenv("OFFLINE_PACK_COMPILED_PATH")
+  if env_val:
+    return env_val
+  return str(Path(get_offline_pack_path()).with_suffix(".compiled.npz"))
+
+
+_PROSE_HEADINGS = {
+  "EN": ("Direct Answer", "Steps", "Common Mistakes"),
+  "AR": (
+    "\u0627\u0644\u0627\u062c\u0627\u0628\u0629 \u0627\u0644\u0645\u0628\u0627\u0634\u0631\u0629",
+    "\u0627\u0644\u062e\u0637\u0648\u0627\u062a",
+    "\u0627\u062e\u0637\u0627\u0621 \u0634\u0627\u0626\u0639\u0629",
+  ),
+  "FR": ("Reponse directe", "Etapes", "Erreurs courantes a eviter"),
+}
+
+
+def offline_to_prose(answer: Dict, lang: str) -> str:
+  direct_h, steps_h, mistakes_h = _PROSE_HEADINGS.get(lang, _PROSE_HEADINGS["EN"])
+  parts: List[str] = []
+  if answer.get("direct"):
+    parts.append(f"## {direct_h}")
+    parts.append(answer["direct"])
+  steps = answer.get("steps", [])
+  if steps:
+    parts.append(f"## {steps_h}")
+    parts.append("\n".join(f"- {s}" for s in steps))
+  mistakes = answer.get("mistakes", [])
+  if mistakes:
+    parts.append(f"## {mistakes_h}")
+    parts.append("\n".join(f"- {m}" for m in mistakes))
+  return "\n\n".join(parts)
+
+
+def parse_offline_entries(raw: bytes) -> List[Dict]:
+  data = json.loads(raw.decode("utf-8"))
+  if isinstance(data, dict) and isinstance(data.get("entries"), list):
+    data = data["entries"]
+  return [e for e in data if isinstance(e, dict)] if isinstance(data, list) else []
+
+
+def compile_offline_pack(
+  entries: List[Dict],
+  source_sha256: str = "",
+  source_mtime_ns: int = 0,
+  source_size: int = 0,
+  embed_fn: Optional[Callable[[List[str]], List[Optional[List[float]]]]] = None,
+  embed_model: str = "",
+) -> Dict[str, Any]:
+  """Precompute everything the request path derives from the pack.
+
+  The result only holds builtins, numpy arrays and n-gram indexes, so
+  `write_compiled` can save it for `scripts/check_offline_integrity.py
+  --compile` and `read_compiled` loads it back in milliseconds.
+  With `embed_fn`, every variant is embedded into a per-language float32
+  matrix of unit rows for cosine matching against the query embedding; a
+  variant it returns None for gets a zero row, which never matches.
+  """
+  vocab: Dict[str, int] = {}
+  langs: Dict[str, List[Tuple[int, str, str, frozenset]]] = {}
+  prose: Dict[str, str] = {}
+  for idx, item in enumerate(entries):
+    lang = item.get("lang") or ""
+    variants = langs.setdefault(lang, [])
+    for v in item.get("question_variants", []):
+      if not isinstance(v, str):
+        continue
+      nv = normalize(v)
+      token_ids = frozenset(vocab.setdefault(t, len(vocab)) for t in nv.split())
+      variants.append((idx, v, nv, token_ids))
+    if item.get("id"):
+      prose[item["id"]] = offline_to_prose(item.get("answer", {}) or {}, lang)
+  words: Dict[str, List[str]] = {}
+  for lang, variants in langs.items():
+    # One spelling per folded word, the shortest ("الطواف" rather than "الطواف؟").
+    by_fold: Dict[str, str] = {}
+    for _, _, nv, _ in variants:
+      for word in nv.split():
+        key = fold(word)
+        if len(key) >= MIN_RESPELL_LEN and (key not in by_fold or len(word) < len(by_fold[key])):
+          by_fold[key] = word
+    words[lang] = sorted(by_fold.values())
+  ngram: Dict[str, NgramIndex] = {}
+  word_ngram: Dict[str, NgramIndex] = {}
+  if numpy_available():
+    for lang, variants in langs.items():
+      ngram[lang] = NgramIndex([fold(v) for _, v, _, _ in variants])
+      word_ngram[lang] = NgramIndex([fold(w) for w in words[lang]])
+  embeddings: Dict[str, Any] = {}
+  if embed_fn is not None and numpy_available():
+    for lang, variants in langs.items():
+      if not variants:
+        continue
+      vectors = embed_fn([v for _, v, _, _ in variants])
+      dim = next((len(vec) for vec in vectors if vec is not None), 0)
+      if not dim:
+        continue
+      matrix = np.asarray([vec if vec is not None else [0.0] * dim for vec in vectors], dtype=np.float32)
+      norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+      embeddings[lang] = matrix / np.where(norms == 0, 1.0, norms)
+  return {
+    "format_version": PACK_FORMAT_VERSION,
+    "version": source_sha256[:12],
+    "source_sha256": source_sha256,
+    "source_mtime_ns": source_mtime_ns,
+    "source_size": source_size,
+    "built_at": time.time(),
+    "entries": entries,
+    "vocab": vocab,
+    "langs": langs,
+    "prose": prose,
+    "tag_sets": [fold_tags(item.get("tags", [])) for item in entries],
+    "ngram": ngram,
+    "words": words,
+    "word_ngram": word_ngram,
+    "embeddings": embeddings,
+    "embed_model": embed_model if embeddings else "",
+  }
+
+
+class OfflinePack:
+  """Immutable, fully derived view of one offline pack version."""
+
+  def __init__(self, compiled: Dict[str, Any], source_stat: Tuple[int, int] = (0, 0), artifact_mtime_ns: int = 0) -> None:
+    self.version: str = compiled.get("version", "")
+    self.entries: List[Dict] = compiled.get("entries", [])
+    self.vocab: Dict[str, int] = compiled.get("vocab", {})
+    self.langs: Dict[str, List[Tuple[int, str, str, frozenset]]] = compiled.get("langs", {})
+    self.prose: Dict[str, str] = compiled.get("prose", {})
+    self.tag_sets: List[frozenset] = compiled.get("tag_sets", [])
+    self.ngram: Dict[str, NgramIndex] = compiled.get("ngram", {})
+    self.words: Dict[str, List[str]] = compiled.get("words", {})
+    self.word_ngram: Dict[str, NgramIndex] = compiled.get("word_ngram", {})
+    self.embeddings: Dict[str, Any] = compiled.get("embeddings", {})
+    self.embed_model: str = compiled.get("embed_model", "")
+    self.source_stat = source_stat
+    self.artifact_mtime_ns = artifact_mtime_ns
+    self.router = build_keyword_router(
+      t for item in self.entries for t in item.get("tags", []) if isinstance(t, str)
+    )
+
+  def query_tokens(self, nq: str) -> Tuple[frozenset, int]:
+    tokens = set(nq.split())
+    return frozenset(self.vocab[t] for t in tokens if t in self.vocab), len(tokens)
+
+
+def score_compiled(nq: str, q_ids: frozenset, q_len: int, variant: str, v_ids: frozenset) -> float:
+  """`score()` over precomputed token ids; identical results, no per-call splitting."""
+  if not nq or not variant:
+    return 0.0
+  if nq == variant:
+    return 1.0
+  if nq in variant or variant in nq:
+    return 0.9
+  if not q_len or not v_ids:
+    return 0.0
+  intersection = len(q_ids & v_ids)
+  return intersection / (q_len + len(v_ids) - intersection)
+
+
+_pack: Optional[OfflinePack] = None
+_pack_lock = threading.Lock()
+_last_reload_check = 0.0
+
+
+def _stat_key(path: Path) -> Tuple[int, int]:
+  try:
+    st = path.stat()
+    return st.st_mtime_ns, st.st_size
+  except OSError:
+    return 0, 0
+
+
+_INDEX_KINDS = ("ngram", "word_ngram")
+
+
+def write_compiled(compiled: Dict[str, Any], path: Path) -> None:
+  """Save a compiled pack as one `.npz`: JSON fields under "meta", numpy arrays beside them.
+
+  Nothing in it is pickled, so reading an artifact someone dropped in place
+  can fail but never runs code.
+  """
+  if np is None:
+    raise RuntimeError("numpy is required to write the offline pack artifact")
+  meta = {k: v for k, v in compiled.items() if k not in ("langs", "tag_sets", "embeddings") + _INDEX_KINDS}
+  meta["langs"] = {
+    lang: [[idx, v, nv, sorted(ids)] for idx, v, nv, ids in variants] for lang, variants in compiled["langs"].items()
+  }
+  meta["tag_sets"] = [sorted(tags) for tags in compiled["tag_sets"]]
+  arrays: Dict[str, Any] = {}
+  for kind in _INDEX_KINDS:
+    meta[kind] = {}
+    for lang, index in compiled[kind].items():
+      meta[kind][lang], index_arrays = index.export()
+      arrays.update({f"{kind}.{lang}.{name}": array for name, array in index_arrays.items()})
+  meta["embeddings"] = sorted(compiled["embeddings"])
+  arrays.update({f"embeddings.{lang}": matrix for lang, matrix in compiled["embeddings"].items()})
+  arrays["meta"] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = path.with_name(path.name + ".tmp")
+  # A file object, so numpy does not append its own ".npz" to the temporary name.
+  with tmp_path.open("wb") as fh:
+    np.savez(fh, **arrays)
+  # Atomic replace so a running backend never reads a half-written artifact.
+  os.replace(tmp_path, path)
+
+
+def read_compiled(path: Path) -> Optional[Dict[str, Any]]:
+  if np is None or not path.exists():
+    return None
+  try:
+    with np.load(path, allow_pickle=False) as npz:
+      arrays = {name: npz[name] for name in npz.files}
+    meta = json.loads(arrays.pop("meta").tobytes().decode("utf-8"))
+    compiled = dict(meta)
+    compiled["langs"] = {
+      lang: [(idx, v, nv, frozenset(ids)) for idx, v, nv, ids in variants] for lang, variants in meta["langs"].items()
+    }
+    compiled["tag_sets"] = [frozenset(tags) for tags in meta["tag_sets"]]
+    for kind in _INDEX_KINDS:
+      compiled[kind] = {}
+      for lang, fields in meta.get(kind, {}).items():
+        prefix = f"{kind}.{lang}."
+        index_arrays = {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+        compiled[kind][lang] = NgramIndex.restore(fields, index_arrays)
+    compiled["embeddings"] = {lang: arrays[f"embeddings.{lang}"] for lang in meta["embeddings"]}
+  except Exception:
+    logging.warning("offline pack artifact unreadable: %s", path)
+    return None
+  return compiled
+
+
+def variant_embeddings(compiled: Dict[str, Any], model: str) -> Dict[str, Any]:
+  """Map variant text -> vector from a compiled pack embedded with `model`."""
+  if not compiled or compiled.get("embed_model") != model:
+    return {}
+  known = {}
+  for lang, matrix in (compiled.get("embeddings") or {}).items():
+    for row, (_, text, _, _) in enumerate(compiled.get("langs", {}).get(lang, [])):
+      if matrix[row].any():
+        known[text] = matrix[row]
+  return known
+
+
+def _recompile(raw: bytes, source_stat: Tuple[int, int], stale: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+  """Compile the JSON at runtime, keeping the vectors of variants that did not change.
+
+  Embedding variants needs the OpenAI API, so the request path never does it;
+  vectors come from the stale artifact and the pack currently served instead.
+  """
+  model = get_embed_model()
+  known: Dict[str, Any] = {}
+  current = _pack
+  if current is not None:
+    known.update(variant_embeddings(
+      {"embed_model": current.embed_model, "embeddings": current.embeddings, "langs": current.langs}, model,
+    ))
+  known.update(variant_embeddings(stale or {}, model))
+  compiled = compile_offline_pack(
+    parse_offline_entries(raw),
+    source_sha256=hashlib.sha256(raw).hexdigest(),
+    source_mtime_ns=source_stat[0],
+    source_size=source_stat[1],
+    embed_fn=(lambda texts: [known.get(t) for t in texts]) if known else None,
+    embed_model=model,
+  )
+  missing = sum(1 for variants in compiled["langs"].values() for _, text, _, _ in variants if text not in known)
+  if missing:
+    logging.warning(
+      "offline pack recompiled without embeddings for %d variant(s); they only match by text until "
+      "`scripts/check_offline_integrity.py --compile --embed` is run",
+      missing,
+    )
+  return compiled
+
+
+def _load_pack() -> OfflinePack:
+  json_path = Path(get_offline_pack_path())
+  artifact_path = Path(get_compiled_pack_path())
+  source_stat = _stat_key(json_path)
+  artifact_mtime_ns = _stat_key(artifact_path)[0]
+  if not json_path.exists():
+    return OfflinePack(compile_offline_pack([]), source_stat, artifact_mtime_ns)
+  raw = None
+  stale = None
+  compiled = read_compiled(artifact_path)
+  if compiled is not None and compiled.get("format_version") != PACK_FORMAT_VERSION:
+    # Built by an older release; its vectors are still good for the recompile.
+    stale, compiled = compiled, None
+  if compiled is not None and (compiled.get("source_mtime_ns"), compiled.get("source_size")) != source_stat:
+    # mtime moved (checkout, copy) but the content may still be identical.
+    raw = json_path.read_bytes()
+    if compiled.get("source_sha256") != hashlib.sha256(raw).hexdigest():
+      stale, compiled = compiled, None
+  if compiled is None:
+    raw = raw if raw is not None else json_path.read_bytes()
+    compiled = _recompile(raw, source_stat, stale)
+  return OfflinePack(compiled, source_stat, artifact_mtime_ns)
+
+
+def _reload_in_background() -> None:
+  global _pack
+  try:
+    pack = _load_pack()
+    _pack = pack
+    logging.info("offline pack reloaded version=%s entries=%d", pack.version, len(pack.entries))
+  except Exception:
+    logging.exception("offline pack reload failed; keeping previous version")
+  finally:
+    _pack_lock.release()
+
+
+def _maybe_schedule_reload(pack: OfflinePack) -> None:
+  global _last_reload_check
+  now = time.monotonic()
+  if now - _last_reload_check < RELOAD_CHECK_SEC:
+    return
+  _last_reload_check = now
+  source_stat = _stat_key(Path(get_offline_pack_path()))
+  artifact_mtime_ns = _stat_key(Path(get_compiled_pack_path()))[0]
+  if source_stat == pack.source_stat and artifact_mtime_ns == pack.artifact_mtime_ns:
+    return
+  # Requests keep serving the current pack while a single thread rebuilds.
+  if _pack_lock.acquire(blocking=False):
+    threading.Thread(target=_reload_in_background, name="offline-pack-reload", daemon=True).start()
+
+
+def get_offline_pack() -> OfflinePack:
+  global _pack
+  pack = _pack
+  if pack is None:
+    with _pack_lock:
+      if _pack is None:
+        _pack = _load_pack()
+      return _pack
+  _maybe_schedule_reload(pack)
+  return pack
+
+
 def load_offline_pack() -> List[Dict]:
-  path = Path(get_offline_pack_path())
-  if not path.exists():
-    return []
-  data = json.loads(path.read_text(encoding="utf-8"))
-  return data if isinstance(data, list) else []
+  return get_offline_pack().entries
 
 
-def match_offline(query: str, lang: str) -> Tuple[Optional[Dict], float]:
-  items = [i for i in load_offline_pack() if i.get("lang") == lang]
-  if not items:
+def get_keyword_router() -> KeywordRouter:
+  return get_offline_pack().router
+
+
+def offline_prose(match: Dict, lang: str) -> str:
+  prose = get_offline_pack().prose.get(match.get("id", ""))
+  return prose if prose is not None else offline_to_prose(match.get("answer", {}) or {}, lang)
+
+
+@traced("offline_match")
+def match_offline(
+  query: str,
+  lang: str,
+  embedding: Optional[List[float]] = None,
+) -> Tuple[Optional[Dict], float]:
+  pack = get_offline_pack()
+  variants = pack.langs.get(lang)
+  if not variants:
     return None, 0.0
   nq = normalize(query)
+  q_ids, q_len = pack.query_tokens(nq)
   best = None
   best_score = 0.0
-  for item in items:
-    variants = item.get("question_variants", [])
-    for v in variants:
-      sv = normalize(v)
-      s = score(nq, sv)
-      if s > best_score:
-        best_score = s
-        best = item
+  for idx, _, nv, v_ids in variants:
+    s = score_compiled(nq, q_ids, q_len, nv, v_ids)
+    if s > best_score:
+      best_score = s
+      best = pack.entries[idx]
+  if best_score < 1.0 and FUZZY_MIN_SCORE < 1.0:
+    hits = match_offline_fuzzy(query, lang, k=1)
+    if hits and hits[0][2] >= FUZZY_MIN_SCORE and hits[0][2] > best_score:
+      best, _, best_score = hits[0]
+    if q_len <= SHORT_QUERY_WORDS:
+      hit = match_offline_respelt(nq, lang)
+      if hit and hit[2] > best_score:
+        best, _, best_score = hit
+  if best_score < 1.0 and embedding is not None:
+    hit = match_offline_embedding(embedding, lang)
+    if hit and hit[2] >= EMBED_MIN_SCORE and hit[2] > best_score:
+      best, _, best_score = hit
   return best, best_score
 
 
+def match_offline_embedding(embedding: List[float], lang: str) -> Optional[Tuple[Dict, str, float]]:
+  """Best (entry, variant, cosine) for a query embedding; one matrix-vector product."""
+  pack = get_offline_pack()
+  matrix = pack.embeddings.get(lang)
+  if matrix is None or pack.embed_model != get_embed_model():
+    return None
+  vec = np.asarray(embedding, dtype=np.float32)
+  if vec.shape[0] != matrix.shape[1]:
+    return None
+  norm = float(np.linalg.norm(vec))
+  if norm == 0.0:
+    return None
+  sims = matrix @ (vec / norm)
+  row = int(np.argmax(sims))
+  idx, variant, _, _ = pack.langs[lang][row]
+  return pack.entries[idx], variant, float(sims[row])
+
+
+def match_offline_fuzzy(query: str, lang: str, k: int = 5) -> List[Tuple[Dict, str, float]]:
+  """Top-k (entry, variant, score) by character-trigram cosine; tolerant of typos."""
+  pack = get_offline_pack()
+  index = pack.ngram.get(lang)
+  if index is None:
+    return []
+  variants = pack.langs[lang]
+  return [
+    (pack.entries[variants[row][0]], variants[row][1], similarity)
+    for row, similarity in index.top_k(fold(query), k)
+  ]
+
+
+def match_offline_respelt(nq: str, lang: str) -> Optional[Tuple[Dict, str, float]]:
+  """Best (entry, variant, score) after replacing unknown words with their nearest pack word.
+
+  The score is the text score of the respelt query times the weakest word
+  similarity, so a far-fetched correction never outranks a plain match.
+  """
+  pack = get_offline_pack()
+  index = pack.word_ngram.get(lang)
+  if index is None:
+    return None
+  tokens = nq.split()
+  respelt = False
+  similarity = 1.0
+  for i, token in enumerate(tokens):
+    if token in pack.vocab or len(fold(token)) < MIN_RESPELL_LEN:
+      continue
+    hits = index.top_k(fold(token), 1)
+    if hits and hits[0][1] >= FUZZY_MIN_SCORE:
+      tokens[i] = pack.words[lang][hits[0][0]]
+      similarity = min(similarity, hits[0][1])
+      respelt = True
+  if not respelt:
+    return None
+  query = " ".join(tokens)
+  q_ids, q_len = pack.query_tokens(query)
+  best = None
+  best_score = 0.0
+  for idx, variant, nv, v_ids in pack.langs[lang]:
+    s = score_compiled(query, q_ids, q_len, nv, v_ids)
+    if s > best_score:
+      best, best_score = (pack.entries[idx], variant), s
+  if best is None:
+    return None
+  return best[0], best[1], best_score * similarity
+
+
 def get_suggestions(query: str, lang: str, limit: int = 3) -> List[str]:
-  items = [i for i in load_offline_pack() if i.get("lang") == lang]
-  if not items:
+  pack = get_offline_pack()
+  variants = pack.langs.get(lang)
+  if not variants:
     return []
   nq = normalize(query)
+  q_ids, q_len = pack.query_tokens(nq)
+  tag_hits = pack.router.classify(query).tags
   candidates: List[Tuple[str, float]] = []
-  for item in items:
-    tags = [normalize(t) for t in item.get("tags", []) if isinstance(t, str)]
-    tag_hit = any(t and t in nq for t in tags)
-    for v in item.get("question_variants", []):
-      sv = normalize(v)
-      s = score(nq, sv)
-      if tag_hit:
-        s += 0.15
-      candidates.append((v, s))
+  for idx, text, nv, v_ids in variants:
+    s = score_compiled(nq, q_ids, q_len, nv, v_ids)
+    if tag_hits and not tag_hits.isdisjoint(pack.tag_sets[idx]):
+      s += 0.15
+    candidates.append((text, s))
   candidates.sort(key=lambda x: x[1], reverse=True)
   seen = set()
   results = []
@@ -0,0 +1,88 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.offline_pack_service import OfflinePack, get_offline_pack
+
+MAX_CACHED_PAYLOADS = 64
+
+
+class SyncPayload(NamedTuple):
+  body: bytes
+  gzip_body: bytes
+  etag: str
+
+
+def parse_cursor(value: Optional[str]) -> Optional[datetime]:
+  if not value:
+    return None
+  try:
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+  except ValueError:
+    return None
+  return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _format_cursor(value: Optional[datetime]) -> Optional[str]:
+  if value is None:
+    return None
+  return value.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def build_sync_payload(pack: OfflinePack, lang: Optional[str], since: Optional[datetime]) -> SyncPayload:
+  """Serialize the pack (or the entries changed after `since`) for one language.
+
+  The cursor is the newest `last_updated` in the language; `ids` lists every
+  current entry so clients can drop ones removed from the pack.
+  """
+  entries = [e for e in pack.entries if lang is None or e.get("lang") == lang]
+  changed: List[Dict] = []
+  cursor: Optional[datetime] = None
+  for entry in entries:
+    updated = parse_cursor(entry.get("last_updated"))
+    if updated is not None and (cursor is None or updated > cursor):
+      cursor = updated
+    # Entries without a timestamp are always sent; clients cannot tell if they changed.
+    if since is None or updated is None or updated > since:
+      changed.append(entry)
+  body = json.dumps(
+    {
+      "version": pack.version,
+      "lang": lang,
+      "full": since is None,
+      "since": _format_cursor(since),
+      "cursor": _format_cursor(cursor),
+      "entries": changed,
+      "ids": [e.get("id") for e in entries if e.get("id")],
+    },
+    ensure_ascii=False,
+    separators=(",", ":"),
+    sort_keys=True,
+  ).encode("utf-8")
+  # mtime=0 keeps the compressed bytes identical for identical content.
+  gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+  return SyncPayload(body, gzip_body, hashlib.sha256(body).hexdigest()[:32])
+
+
+_payloads: "OrderedDict[Tuple[str, Optional[str], Optional[datetime]], SyncPayload]" = OrderedDict()
+_payloads_lock = threading.Lock()
+
+
+def get_sync_payload(lang: Optional[str], since: Optional[str]) -> SyncPayload:
+  pack = get_offline_pack()
+  key = (pack.version, lang, parse_cursor(since))
+  with _payloads_lock:
+    payload = _payloads.get(key)
+    if payload is not None:
+      _payloads.move_to_end(key)
+      return payload
+  payload = build_sync_payload(pack, lang, key[2])
+  with _payloads_lock:
+    _payloads[key] = payload
+    while len(_payloads) > MAX_CACHED_PAYLOADS:
+      _payloads.popitem(last=False)
+  return payload
@@ -0,0 +1,294 @@
+import contextvars
+import functools
+import inspect
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+# Fraction of requests profiled in dev mode; a request can also ask with "X-Profile: 1"
+# ("X-Profile: memory" adds tracemalloc). Changeable at runtime via /api/diag/profiles.
+DEFAULT_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL_SEC = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "32"))
+# Sampled (not header-requested) requests also trace allocations when set.
+SAMPLED_MEMORY = os.getenv("PROFILE_MEMORY", "").lower() in ("1", "true", "yes")
+PROFILE_HEADER = b"x-profile"
+MAX_STACK_DEPTH = 96
+TOP_ALLOCATIONS = 15
+
+_sample_rate = DEFAULT_SAMPLE_RATE
+_current: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar("profile", default=None)
+_ids = itertools.count(1)
+_ring: Deque["Profile"] = deque(maxlen=RING_SIZE)
+_active: Set["Profile"] = set()
+_lock = threading.Lock()
+_wake = threading.Condition(_lock)
+_sampler_started = False
+_memory_users = 0
+_memory_owned = False
+# Code objects of the @profiled wrappers: stacks are cut there.
+_WRAPPER_CODES: Set[Any] = set()
+
+
+class Profile:
+  """One profiled request: sampled stacks of the threads running its profiled code."""
+
+  def __init__(self, method: str, path: str, memory: bool) -> None:
+    self.id = next(_ids)
+    self.method = method
+    self.path = path
+    self.started_ms = int(time.time() * 1000)
+    self._t0 = time.perf_counter()
+    self.duration_ms: Optional[float] = None
+    self.samples = 0
+    self.stacks: Counter = Counter()
+    self.threads: Dict[int, int] = {}
+    self.memory: Optional[Dict[str, Any]] = None
+    self._snapshot = None
+    if memory:
+      self._snapshot = _memory_begin()
+
+  def enter(self) -> None:
+    ident = threading.get_ident()
+    with _lock:
+      self.threads[ident] = self.threads.get(ident, 0) + 1
+
+  def exit(self) -> None:
+    ident = threading.get_ident()
+    with _lock:
+      depth = self.threads.get(ident, 0) - 1
+      if depth > 0:
+        self.threads[ident] = depth
+      else:
+        self.threads.pop(ident, None)
+
+  def finish(self) -> None:
+    if self.duration_ms is not None:
+      return
+    self.duration_ms = round((time.perf_counter() - self._t0) * 1000, 2)
+    if self._snapshot is not None:
+      self.memory = _memory_end(self._snapshot)
+      self._snapshot = None
+    with _lock:
+      _active.discard(self)
+      self.threads.clear()
+      _ring.append(self)
+
+  def summary(self) -> Dict[str, Any]:
+    return {
+      "id": self.id,
+      "method": self.method,
+      "path": self.path,
+      "started_ms": self.started_ms,
+      "duration_ms": self.duration_ms,
+      "samples": self.samples,
+      "interval_ms": INTERVAL_SEC * 1000,
+      "peak_bytes": self.memory["peak_bytes"] if self.memory else None,
+    }
+
+  def collapsed(self) -> str:
+    """Brendan Gregg's folded format, one "root;...;leaf count" line per stack."""
+    return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _frame_label(frame) -> str:
+  code = frame.f_code
+  filename = code.co_filename.replace("\\", "/")
+  marker = filename.rfind("/app/")
+  short = filename[marker + 1:] if marker >= 0 else filename.rsplit("/", 1)[-1]
+  return f"{code.co_name} ({short}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+  labels: List[str] = []
+  while frame is not None and len(labels) < MAX_STACK_DEPTH:
+    # Frames above the profiled entry point (thread pool, event loop) are the same every time.
+    if frame.f_code in _WRAPPER_CODES:
+      break
+    labels.append(_frame_label(frame))
+    frame = frame.f_back
+  return ";".join(reversed(labels))
+
+
+def _sampler() -> None:
+  me = threading.get_ident()
+  while True:
+    with _lock:
+      while not _active:
+        _wake.wait()
+      targets = [(p, list(p.threads)) for p in _active]
+    frames = sys._current_frames()
+    with _lock:
+      for profile, idents in targets:
+        for ident in idents:
+          frame = frames.get(ident)
+          if frame is not None and ident != me:
+            profile.stacks[_collapse(frame)] += 1
+            profile.samples += 1
+    del frames
+    time.sleep(INTERVAL_SEC)
+
+
+def _memory_begin():
+  global _memory_users, _memory_owned
+  with _lock:
+    if not tracemalloc.is_tracing():
+      tracemalloc.start(1)
+      _memory_owned = True
+    _memory_users += 1
+  tracemalloc.reset_peak()
+  return tracemalloc.take_snapshot()
+
+
+def _memory_end(before) -> Dict[str, Any]:
+  global _memory_users, _memory_owned
+  after = tracemalloc.take_snapshot()
+  current, peak = tracemalloc.get_traced_memory()
+  skip = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+  diff = after.filter_traces(skip).compare_to(before.filter_traces(skip), "lineno")
+  with _lock:
+    _memory_users -= 1
+    if _memory_users == 0 and _memory_owned:
+      tracemalloc.stop()
+      _memory_owned = False
+  return {
+    "peak_bytes": peak,
+    "traced_bytes": current,
+    # Process-wide: allocations by concurrent requests show up here too.
+    "top_allocations": [
+      {
+        "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+        "size_diff": stat.size_diff,
+        "count_diff": stat.count_diff,
+      }
+      for stat in diff[:TOP_ALLOCATIONS]
+    ],
+  }
+
+
+def _start(profile: Profile) -> None:
+  global _sampler_started
+  with _lock:
+    _active.add(profile)
+    if not _sampler_started:
+      _sampler_started = True
+      threading.Thread(target=_sampler, name="profiler", daemon=True).start()
+    _wake.notify()
+
+
+def profiled(func: Callable) -> Callable:
+  """Sample `func` while it runs for a profiled request; free otherwise.
+
+  Generators are followed step by step, since a streamed response may be
+  advanced from a different worker thread each time.
+  """
+  if inspect.isgeneratorfunction(func):
+    @functools.wraps(func)
+    def gen_wrapper(*args, **kwargs):
+      profile = _current.get()
+      gen = func(*args, **kwargs)
+      if profile is None:
+        yield from gen
+        return
+      sent = None
+      try:
+        while True:
+          profile.enter()
+          try:
+            item = gen.send(sent)
+          except StopIteration as stop:
+            return stop.value
+          finally:
+            profile.exit()
+          sent = yield item
+      finally:
+        gen.close()
+    _WRAPPER_CODES.add(gen_wrapper.__code__)
+    return gen_wrapper
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    profile = _current.get()
+    if profile is None:
+      return func(*args, **kwargs)
+    profile.enter()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      profile.exit()
+  _WRAPPER_CODES.add(wrapper.__code__)
+  return wrapper
+
+
+class ProfilingMiddleware:
+  """ASGI middleware that starts a profile for sampled or header-flagged requests (dev mode only)."""
+
+  def __init__(self, app) -> None:
+    self.app = app
+
+  async def __call__(self, scope, receive, send) -> None:
+    if scope["type"] != "http" or not getattr(scope["app"].state, "dev_mode", False):
+      await self.app(scope, receive, send)
+      return
+    flag = dict(scope.get("headers") or []).get(PROFILE_HEADER, b"").decode("latin-1").strip().lower()
+    requested = flag not in ("", "0", "false", "no")
+    if not requested and not (_sample_rate > 0 and random.random() < _sample_rate):
+      await self.app(scope, receive, send)
+      return
+    if scope["path"].startswith("/api/diag/profiles"):
+      await self.app(scope, receive, send)
+      return
+    profile = Profile(scope["method"], scope["path"], memory=flag in ("memory", "all") or (not requested and SAMPLED_MEMORY))
+    _start(profile)
+    token = _current.set(profile)
+
+    async def send_with_id(message) -> None:
+      if message["type"] == "http.response.start":
+        message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", str(profile.id).encode())]}
+      await send(message)
+      if message["type"] == "http.response.body" and not message.get("more_body", False):
+        profile.finish()
+
+    try:
+      await self.app(scope, receive, send_with_id)
+    finally:
+      _current.reset(token)
+      profile.finish()
+
+
+def get_sample_rate() -> float:
+  return _sample_rate
+
+
+def set_sample_rate(rate: float) -> float:
+  global _sample_rate
+  _sample_rate = min(1.0, max(0.0, rate))
+  logging.info("profiling sample rate set to %.3f", _sample_rate)
+  return _sample_rate
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+  with _lock:
+    return [p.summary() for p in reversed(_ring)]
+
+
+def get_profile(profile_id: int) -> Optional[Profile]:
+  with _lock:
+    return next((p for p in _ring if p.id == profile_id), None)
+
+
+def merged_collapsed(path: Optional[str] = None) -> str:
+  """Stacks of every stored profile (optionally one path) added together."""
+  total: Counter = Counter()
+  with _lock:
+    for profile in _ring:
+      if path is None or profile.path == path:
+        total.update(profile.stacks)
+  return "".join(f"{stack} {count}\n" for stack, count in total.most_common())
@@ -0,0 +1,138 @@
+import logging
+import math
+import re
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from app.schemas.rag_test import RagEvalAtK, RagEvalConfidence, RagEvalLang, RagEvalResponse
+from app.services.ask_service import RAG_THRESHOLD
+from app.services.offline_pack_service import OfflinePack, get_offline_pack
+from app.services.rag_service import get_collection, get_embed_model, get_index_version, get_query_embeddings, retrieve
+
+HISTOGRAM_BUCKETS = 10
+# PDF pages are ingested as "<source id>-p<page>"; the pack labels whole sources.
+_PAGE_SUFFIX = re.compile(r"-p\d+$")
+
+
+def base_source_id(source_id: str) -> str:
+  return _PAGE_SUFFIX.sub("", source_id or "")
+
+
+def labeled_queries(pack: OfflinePack, lang: str) -> List[Tuple[str, FrozenSet[str]]]:
+  """Every question variant of the language with the source ids its entry cites.
+
+  A variant shared by several entries is kept once, labeled with all their sources.
+  """
+  labels: Dict[str, set] = {}
+  for entry in pack.entries:
+    if entry.get("lang") != lang or not entry.get("source_ids"):
+      continue
+    for variant in entry.get("question_variants", []):
+      if isinstance(variant, str) and variant.strip():
+        labels.setdefault(variant.strip(), set()).update(entry["source_ids"])
+  return [(q, frozenset(ids)) for q, ids in labels.items()]
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+  """Nearest-rank percentile; 0.0 for no values."""
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+  return float(ordered[rank - 1])
+
+
+def _evaluate_lang(lang: str, queries: List[Tuple[str, FrozenSet[str]]], top_ks: List[int], repeats: int, threshold: float) -> RagEvalLang:
+  embeddings = get_query_embeddings([q for q, _ in queries])
+  max_k = top_ks[-1]
+  recall: Dict[int, List[float]] = {k: [] for k in top_ks}
+  hits: Dict[int, int] = {k: 0 for k in top_ks}
+  latency: Dict[int, List[float]] = {k: [] for k in top_ks}
+  reciprocal_ranks: List[float] = []
+  confidences: List[float] = []
+  confident_misses = 0
+  skipped = 0
+
+  for (query, relevant), embedding in zip(queries, embeddings):
+    if embedding is None:
+      skipped += 1
+      continue
+    for k in top_ks:
+      for _ in range(repeats):
+        # The retrieval cache would turn every repeat into a dictionary lookup.
+        t0 = time.perf_counter()
+        sources, confidence = retrieve(query, lang, top_k=k, embedding=embedding, use_cache=False)
+        latency[k].append((time.perf_counter() - t0) * 1000)
+      ranked = [base_source_id(s.get("source_id", "")) for s in sources]
+      found = relevant.intersection(ranked)
+      recall[k].append(len(found) / len(relevant))
+      hits[k] += 1 if found else 0
+      if k == max_k:
+        rank = next((i for i, sid in enumerate(ranked, start=1) if sid in relevant), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        confidences.append(confidence)
+        if confidence >= threshold and not found:
+          confident_misses += 1
+
+  evaluated = len(confidences)
+  histogram = [0] * HISTOGRAM_BUCKETS
+  for c in confidences:
+    histogram[min(HISTOGRAM_BUCKETS - 1, int(c * HISTOGRAM_BUCKETS))] += 1
+  return RagEvalLang(
+    lang=lang,
+    queries=evaluated,
+    skipped=skipped,
+    mrr=round(sum(reciprocal_ranks) / evaluated, 4) if evaluated else 0.0,
+    at_k=[
+      RagEvalAtK(
+        top_k=k,
+        recall=round(sum(recall[k]) / evaluated, 4) if evaluated else 0.0,
+        hit_rate=round(hits[k] / evaluated, 4) if evaluated else 0.0,
+        latency_p50_ms=round(percentile(latency[k], 50), 2),
+        latency_p95_ms=round(percentile(latency[k], 95), 2),
+      )
+      for k in top_ks
+    ],
+    confidence=RagEvalConfidence(
+      mean=round(sum(confidences) / evaluated, 4) if evaluated else 0.0,
+      p50=round(percentile(confidences, 50), 4),
+      above_threshold=round(sum(1 for c in confidences if c >= threshold) / evaluated, 4) if evaluated else 0.0,
+      confident_misses=confident_misses,
+      histogram=histogram,
+    ),
+  )
+
+
+def evaluate_retrieval(
+  langs: Optional[Iterable[str]] = None,
+  top_ks: Iterable[int] = (1, 3, 5, 10),
+  repeats: int = 1,
+  threshold: float = RAG_THRESHOLD,
+) -> RagEvalResponse:
+  """Score `retrieve()` against the offline pack's question variants.
+
+  Each variant is a query whose relevant documents are its entry's
+  `source_ids`. Per language: recall@k and hit rate for every k, MRR and the
+  confidence distribution at the largest k (a confident miss clears
+  `threshold` without retrieving a labeled source), and p50/p95 latency of
+  the vector query alone; embeddings are computed up front in bulk.
+  """
+  pack = get_offline_pack()
+  ks = sorted({k for k in top_ks if k > 0}) or [5]
+  wanted = [l.upper() for l in langs] if langs else list(pack.langs)
+  get_collection()
+  started = time.perf_counter()
+  results = [
+    _evaluate_lang(lang, labeled_queries(pack, lang), ks, repeats, threshold)
+    for lang in wanted
+  ]
+  logging.info(
+    "retrieval eval langs=%s queries=%d took=%dms",
+    ",".join(wanted), sum(r.queries for r in results), int((time.perf_counter() - started) * 1000),
+  )
+  return RagEvalResponse(
+    index_version=get_index_version(),
+    embed_model=get_embed_model(),
+    threshold=threshold,
+    langs=results,
+  )
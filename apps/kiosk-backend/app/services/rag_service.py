@@ -1,8 +1,19 @@
 ﻿import json
+import logging
 import os
+import signal
+import threading
 import time
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from app.services.cache_service import Cache, get_cache, make_key
+from app.services.deadline_service import Deadline
+from app.services.heavy_hitters_service import hot_tag
+from app.services.http_service import get_http_session
+from app.services.stub_embed_service import stub_embed_texts, stub_enabled, stub_model_name
+from app.services.tracing_service import event, span, traced
+from app.services.vector_store_service import CompactCollection, open_compact_index
 
 
 def get_chroma_path() -> str:
@@ -24,11 +35,23 @@ def get_chroma_path() -> str:
   return str(candidates[0])
 
 
-_cache = {}
 _cache_ttl = 60
+_embed_cache_ttl = 600
+# Inputs per embeddings request when embedding in bulk (the API allows up to 2048).
+EMBED_BATCH_SIZE = 256
 _client = None
 _collection = None
+_index_version = ""
+_index_path = ""
+_index_lock = threading.Lock()
+_watcher_started = False
 
+CURRENT_POINTER = "CURRENT"
+VERSIONS_DIR = "versions"
+INDEX_WATCH_SEC = float(os.getenv("INDEX_WATCH_SEC", "10"))
+# "compact" serves the quantized copy `ingest_sources.py --compact` writes next to
+# the Chroma files (falls back to Chroma when the index has none).
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma").strip().lower()
 
 
 telemetry_disabled = os.getenv("CHROMA_TELEMETRY", "false").lower() in ("false", "0", "no")
@@ -39,46 +62,197 @@ def _use_cloud() -> bool:
   return all(os.getenv(k) for k in ("CHROMA_API_KEY", "CHROMA_TENANT", "CHROMA_DATABASE"))
 
 
+def resolve_index_dir(base: str | None = None) -> Tuple[str, str]:
+  """Return (path, version) of the index to serve.
+
+  `scripts/ingest_sources.py --versioned` writes each build to
+  `<CHROMA_PATH>/versions/<version>/` and then atomically replaces the
+  `CURRENT` file; a plain (unversioned) index directory is served as "legacy".
+  """
+  base_path = Path(base or get_chroma_path())
+  pointer = base_path / CURRENT_POINTER
+  try:
+    version = pointer.read_text(encoding="utf-8").strip()
+  except OSError:
+    version = ""
+  if version:
+    return str(base_path / VERSIONS_DIR / version), version
+  return str(base_path), "legacy"
+
+
+def _open_collection(chroma_path: str):
+  if VECTOR_STORE == "compact" and not _use_cloud():
+    compact = open_compact_index(chroma_path)
+    if compact is not None:
+      return None, compact
+    logging.warning("VECTOR_STORE=compact but %s has no compact index; using Chroma", chroma_path)
+  import chromadb
+
+  if telemetry_disabled:
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "false")
+    os.environ.setdefault("CHROMA_TELEMETRY", "false")
+  if _use_cloud():
+    client = chromadb.CloudClient(
+      api_key=os.environ["CHROMA_API_KEY"],
+      tenant=os.environ["CHROMA_TENANT"],
+      database=os.environ["CHROMA_DATABASE"],
+    )
+  else:
+    if not Path(chroma_path).exists():
+      return None, None
+    client = chromadb.PersistentClient(path=chroma_path)
+  return client, client.get_or_create_collection(name="umrah_sources")
+
+
+def _warm_collection(collection) -> None:
+  """Touch the segment files and HNSW index so the first real query is not cold."""
+  collection.count()
+  peek = collection.peek(limit=1)
+  embeddings = peek.get("embeddings") if isinstance(peek, dict) else None
+  if embeddings is not None and len(embeddings):
+    collection.query(query_embeddings=[list(embeddings[0])], n_results=1)
+
+
 def get_collection():
-  global _client, _collection
+  global _client, _collection, _index_version, _index_path
   if _collection is not None:
     return _collection
-  try:
-    import chromadb
-  except Exception:
-    return None
-  try:
-    if telemetry_disabled:
-      os.environ.setdefault("ANONYMIZED_TELEMETRY", "false")
-      os.environ.setdefault("CHROMA_TELEMETRY", "false")
-    if _use_cloud():
-      _client = chromadb.CloudClient(
-        api_key=os.environ["CHROMA_API_KEY"],
-        tenant=os.environ["CHROMA_TENANT"],
-        database=os.environ["CHROMA_DATABASE"],
-      )
-    else:
-      chroma_path = get_chroma_path()
-      if not Path(chroma_path).exists():
+  if VECTOR_STORE != "compact":
+    try:
+      import chromadb  # noqa: F401
+    except Exception:
+      return None
+  with _index_lock:
+    if _collection is not None:
+      return _collection
+    try:
+      chroma_path, version = ("(cloud)", "cloud") if _use_cloud() else resolve_index_dir()
+      client, collection = _open_collection(chroma_path)
+      if collection is None:
         return None
-      _client = chromadb.PersistentClient(path=chroma_path)
-    _collection = _client.get_or_create_collection(name="umrah_sources")
-    return _collection
-  except Exception:
-    return None
+      _client, _collection, _index_version, _index_path = client, collection, version, chroma_path
+      return _collection
+    except Exception:
+      return None
 
 
-def embed_query(text: str) -> List[float]:
+def get_index_version() -> str:
+  return _index_version
+
+
+def get_vector_store_info() -> Dict[str, Any]:
+  collection = _collection
+  if isinstance(collection, CompactCollection):
+    return {
+      "store": "compact",
+      "configured": VECTOR_STORE,
+      "dims": collection.dims,
+      "precision": collection.precision,
+      "chunks": collection.count(),
+      "resident_bytes": collection.resident_bytes(),
+    }
+  if collection is None:
+    return {"store": None, "configured": VECTOR_STORE}
+  return {"store": "cloud" if _use_cloud() else "chroma", "configured": VECTOR_STORE}
+
+
+def reload_index(force: bool = False) -> Dict[str, Any]:
+  """Open the index CURRENT points at, warm it, and swap it in.
+
+  In-flight requests keep the collection reference they already hold, so they
+  finish on the old index; the retrieval cache is cleared after the swap.
+  """
+  global _client, _collection, _index_version, _index_path
+  if _use_cloud():
+    chroma_path, version = "(cloud)", "cloud"
+  else:
+    chroma_path, version = resolve_index_dir()
+  previous = _index_version
+  if not force and _collection is not None and version == previous and chroma_path == _index_path:
+    return {"swapped": False, "version": version, "previous": previous}
+  client, collection = _open_collection(chroma_path)
+  if collection is None:
+    raise RuntimeError(f"index not found at {chroma_path}")
+  _warm_collection(collection)
+  with _index_lock:
+    _client, _collection, _index_version, _index_path = client, collection, version, chroma_path
+  # Retrieval keys carry the index version; this just drops stale local entries early.
+  _retrieval_cache().local.clear()
+  logging.info("vector index swapped %s -> %s", previous or "-", version)
+  return {"swapped": True, "version": version, "previous": previous}
+
+
+def _watch_index() -> None:
+  base = Path(get_chroma_path())
+  last_seen = None
+  while True:
+    time.sleep(INDEX_WATCH_SEC)
+    try:
+      pointer = base / CURRENT_POINTER
+      stamp = pointer.stat().st_mtime_ns if pointer.exists() else None
+      if stamp != last_seen:
+        if last_seen is not None or _collection is not None:
+          reload_index()
+        last_seen = stamp
+    except Exception:
+      logging.exception("vector index reload failed; keeping current index")
+
+
+def _on_sighup(signum, frame) -> None:
+  threading.Thread(target=lambda: reload_index(force=True), name="index-reload", daemon=True).start()
+
+
+def start_index_watcher() -> None:
+  """Reload the index when CURRENT changes (polling) or on SIGHUP."""
+  global _watcher_started
+  if _watcher_started or _use_cloud():
+    return
+  _watcher_started = True
+  if INDEX_WATCH_SEC > 0:
+    threading.Thread(target=_watch_index, name="index-watcher", daemon=True).start()
+  if hasattr(signal, "SIGHUP"):
+    try:
+      signal.signal(signal.SIGHUP, _on_sighup)
+    except ValueError:
+      # signal handlers can only be installed from the main thread
+      pass
+
+
+def _retrieval_cache() -> Cache:
+  return get_cache("retrieval", _cache_ttl)
+
+
+def _embedding_cache() -> Cache:
+  return get_cache("embedding", _embed_cache_ttl)
+
+
+def get_embed_dims() -> int | None:
+  """Shortened output size requested from the embeddings API (text-embedding-3 models)."""
+  value = os.getenv("OPENAI_EMBED_DIMS", "").strip()
+  return int(value) if value else None
+
+
+def get_embed_model() -> str:
+  """Identity of the vectors: the model, plus the shortened size when one is set."""
+  if stub_enabled():
+    return stub_model_name()
+  model = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-large")
+  dims = get_embed_dims()
+  return f"{model}@{dims}" if dims else model
+
+
+def embed_texts(
+  texts: List[str],
+  deadline: Deadline | None = None,
+  timeout: Tuple[float, float] = (5, 12),
+) -> List[List[float]]:
+  if stub_enabled():
+    return stub_embed_texts(texts)
   api_key = os.getenv("OPENAI_API_KEY")
   if not api_key:
     raise RuntimeError("OPENAI_API_KEY is required for embeddings.")
   model = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-large")
 
-  try:
-    import requests
-  except Exception:
-    raise RuntimeError("requests is required for embeddings.")
-
   url = "https://api.openai.com/v1/embeddings"
   headers = {
     "Authorization": f"Bearer {api_key}",
@@ -86,54 +260,83 @@ def embed_query(text: str) -> List[float]:
   }
   payload = {
     "model": model,
-    "input": [text]
+    "input": texts
   }
+  dims = get_embed_dims()
+  if dims:
+    payload["dimensions"] = dims
   # Keep retrieval latency kiosk-friendly; fail fast on network issues.
-  resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=(5, 12))
+  if deadline:
+    timeout = deadline.timeout(timeout[0], timeout[1], "embedding")
+  resp = get_http_session().post(url, headers=headers, data=json.dumps(payload), timeout=timeout)
   resp.raise_for_status()
   data = resp.json()
-  return data["data"][0]["embedding"]
+  return [item["embedding"] for item in sorted(data["data"], key=lambda d: d.get("index", 0))]
 
 
-def relevance_label(distance: float) -> str:
-  if distance <= 0.2:
-    return "High"
-  if distance <= 0.4:
-    return "Med"
-  return "Low"
+def embed_query(text: str, deadline: Deadline | None = None) -> List[float]:
+  return embed_texts([text], deadline=deadline)[0]
 
 
-def retrieve(query: str, lang: str, top_k: int = 5) -> Tuple[List[Dict[str, Any]], float]:
-  print("retrieve called")
-  key = f"{lang}:{query}"
-  now = time.time()
-  cached = _cache.get(key)
-  if cached and now - cached["ts"] < _cache_ttl:
-    return cached["sources"], cached["confidence"]
-
-  collection = get_collection()
-  if collection is None:
-    return [], 0.0
+@traced("embedding")
+def get_query_embedding(query: str, deadline: Deadline | None = None) -> List[float] | None:
+  """Embed once per request (and per distinct query for a while); None on failure.
 
+  The same vector feeds Chroma retrieval and the offline-pack intent match.
+  """
+  cache = _embedding_cache()
+  key = make_key(get_embed_model(), query.strip())
+  pin = hot_tag(query)
+  cached = cache.get(key, pin=pin)
+  if cached is not None:
+    return cached
   try:
-    embedding = embed_query(query)
+    embedding = embed_query(query, deadline=deadline)
   except Exception:
-    return [], 0.0
+    return None
+  cache.set(key, embedding, pin=pin)
+  return embedding
 
-  try:
-    results = collection.query(
-      query_embeddings=[embedding],
-      n_results=top_k,
-      where={"lang": lang},
-      include=["documents", "metadatas", "distances"]
-    )
-  except Exception:
-    return [], 0.0
 
-  docs = results.get("documents", [[]])[0]
-  metas = results.get("metadatas", [[]])[0]
-  distances = results.get("distances", [[]])[0]
+def get_query_embeddings(queries: List[str], batch_size: int = EMBED_BATCH_SIZE) -> List[List[float] | None]:
+  """Embeddings for many queries: cache hits first, then one request per batch of misses.
 
+  Results land in the same cache `get_query_embedding` reads, so a later
+  per-query call for any of these queries is free.
+  """
+  cache = _embedding_cache()
+  model = get_embed_model()
+  keys = [make_key(model, q.strip()) for q in queries]
+  out: List[List[float] | None] = [cache.get(k) for k in keys]
+  missing: Dict[str, List[int]] = {}
+  for i, vec in enumerate(out):
+    if vec is None and queries[i].strip():
+      missing.setdefault(queries[i], []).append(i)
+  texts = list(missing)
+  for start in range(0, len(texts), batch_size):
+    chunk = texts[start:start + batch_size]
+    try:
+      vectors = embed_texts(chunk, timeout=(10, 60))
+    except Exception:
+      logging.exception("batch embedding failed for %d queries", len(chunk))
+      continue
+    for text, vec in zip(chunk, vectors):
+      for i in missing[text]:
+        out[i] = vec
+      cache.set(keys[missing[text][0]], vec, pin=hot_tag(text))
+  return out
+
+
+def relevance_label(distance: float) -> str:
+  if distance <= 0.2:
+    return "High"
+  if distance <= 0.4:
+    return "Med"
+  return "Low"
+
+
+def _to_sources(docs: List[Any], metas: List[Any], distances: List[Any], lang: str) -> Tuple[List[Dict[str, Any]], float]:
+  """Chroma hits for one query -> (source dicts, confidence from the nearest hit)."""
   if not docs:
     return [], 0.0
 
@@ -168,7 +371,123 @@ def retrieve(query: str, lang: str, top_k: int = 5) -> Tuple[List[Dict[str, Any]
   confidence = 0.0
   if min_dist is not None:
     confidence = max(0.0, min(1.0, 1.0 - (min_dist ** 2) / 2.0))
+  return sources, confidence
+
+
+class Prefetched(NamedTuple):
+  """One query's embedding and retrieval results, computed in bulk by a batch run."""
+  embedding: List[float] | None
+  results: Dict[int, Tuple[List[Dict[str, Any]], float]]
+
+
+def retrieve(
+  query: str,
+  lang: str,
+  top_k: int = 5,
+  deadline: Deadline | None = None,
+  embedding: List[float] | None = None,
+  use_cache: bool = True,
+  embed_if_missing: bool = True,
+  prefetched: Dict[int, Tuple[List[Dict[str, Any]], float]] | None = None,
+) -> Tuple[List[Dict[str, Any]], float]:
+  """Top-k sources for `query` and a confidence.
+
+  `embed_if_missing=False` is for callers that already tried to embed the
+  query: a failed embedding then means no results, not another attempt.
+  `prefetched` (top_k -> result, from prime_retrieval) is used before the cache.
+  """
+  if prefetched is not None and top_k in prefetched:
+    return prefetched[top_k]
+  cache = _retrieval_cache()
+  key = make_key(_index_version, lang, top_k, query.strip())
+  # Heavy-hitter queries keep their entries in-process past the TTL.
+  pin = hot_tag(query) if use_cache else None
+  cached = cache.get(key, pin=pin) if use_cache else None
+  if cached is not None:
+    event("retrieve_cached", top_k=top_k)
+    return cached
+
+  collection = get_collection()
+  if collection is None:
+    return [], 0.0
+
+  if embedding is None and embed_if_missing:
+    embedding = get_query_embedding(query, deadline=deadline)
+  if embedding is None:
+    return [], 0.0
+
+  try:
+    if deadline:
+      deadline.check("vector_query")
+    with span("vector_query", top_k=top_k):
+      results = collection.query(
+        query_embeddings=[embedding],
+        n_results=top_k,
+        where={"lang": lang},
+        include=["documents", "metadatas", "distances"]
+      )
+  except Exception:
+    return [], 0.0
+
+  sources, confidence = _to_sources(
+    results.get("documents", [[]])[0],
+    results.get("metadatas", [[]])[0],
+    results.get("distances", [[]])[0],
+    lang,
+  )
+  if not sources:
+    return [], 0.0
+
+  if use_cache:
+    cache.set(key, (sources, confidence), pin=pin)
 
-  _cache[key] = {"ts": now, "sources": sources, "confidence": confidence}
-  
   return sources, confidence
+
+
+def prime_retrieval(
+  queries: List[str],
+  lang: str,
+  embeddings: List[List[float] | None],
+  top_ks: Tuple[int, ...] = (5, 3),
+) -> List[Dict[int, Tuple[List[Dict[str, Any]], float]]]:
+  """Retrieve for many same-language queries with one multi-query Chroma call.
+
+  The nearest max(top_ks) hits are fetched once; every smaller top_k is its
+  prefix. Returns {top_k: (sources, confidence)} per query, for callers to
+  pass to `retrieve(prefetched=...)`. Only heavy-hitter queries are also
+  stored (pinned) in the retrieval cache; a cold batch would just churn it.
+  """
+  results_out: List[Dict[int, Tuple[List[Dict[str, Any]], float]]] = [
+    {top_k: ([], 0.0) for top_k in top_ks} for _ in queries
+  ]
+  collection = get_collection()
+  todo = [i for i, vec in enumerate(embeddings) if vec is not None]
+  if collection is None or not todo:
+    return results_out
+  n_results = max(top_ks)
+  try:
+    results = collection.query(
+      query_embeddings=[embeddings[i] for i in todo],
+      n_results=n_results,
+      where={"lang": lang},
+      include=["documents", "metadatas", "distances"]
+    )
+  except Exception:
+    logging.exception("batch retrieval failed (%s, %d queries)", lang, len(todo))
+    return results_out
+  docs = results.get("documents") or []
+  metas = results.get("metadatas") or []
+  distances = results.get("distances") or []
+  cache = _retrieval_cache()
+  for row, i in enumerate(todo):
+    if row >= len(docs):
+      break
+    pin = hot_tag(queries[i])
+    for top_k in top_ks:
+      sources, confidence = _to_sources(docs[row][:top_k], metas[row][:top_k], distances[row][:top_k], lang)
+      if not sources:
+        confidence = 0.0
+      elif pin is not None:
+        cache.set(make_key(_index_version, lang, top_k, queries[i].strip()), (sources, confidence), pin=pin)
+      results_out[i][top_k] = (sources, confidence)
+  return results_out
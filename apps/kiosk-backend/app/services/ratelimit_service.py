@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Upstream OpenAI quota for OPENAI_MODEL (requests and tokens per minute; 0 = unlimited).
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "30000"))
+# The quota is split evenly between worker processes (serve.py sets this from --workers).
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# How much of the per-minute quota may be spent at once after a quiet spell.
+BURST_SEC = 10.0
+# Per kiosk session: sustained LLM calls per minute, and how many may come back to back.
+SESSION_PER_MIN = float(os.getenv("SESSION_LLM_PER_MIN", "6"))
+SESSION_BURST = float(os.getenv("SESSION_LLM_BURST", "3"))
+# Least recently seen sessions are forgotten past this many.
+MAX_SESSIONS = 10000
+# Rough token cost of a call before its usage is known: prompt chars / 4, plus the answer.
+CHARS_PER_TOKEN = 4
+OUTPUT_TOKENS_ESTIMATE = 600
+
+
+class RateLimited(RuntimeError):
+  pass
+
+
+class TokenBucket:
+  """Classic token bucket, refilled lazily on each check, so every operation is O(1)."""
+
+  def __init__(self, rate_per_sec: float, capacity: float) -> None:
+    self.rate = rate_per_sec
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+
+  def _refill(self, now: float) -> None:
+    # `now` is read before the lock is taken, so another thread may already have moved past it.
+    if now > self.updated:
+      self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+
+  def take(self, n: float, now: float) -> bool:
+    self._refill(now)
+    # A single call larger than the whole bucket may still go once the bucket is full.
+    n = min(n, self.capacity)
+    if self.tokens < n:
+      return False
+    self.tokens -= n
+    return True
+
+  def give(self, n: float) -> None:
+    self.tokens = min(self.capacity, self.tokens + n)
+
+  def charge(self, n: float) -> None:
+    # Usage above the estimate is taken after the fact; the bucket may go into debt.
+    self.tokens -= n
+
+
+def _per_minute(limit: float, share: int) -> Optional[TokenBucket]:
+  if limit <= 0:
+    return None
+  rate = limit / share / 60.0
+  return TokenBucket(rate, max(1.0, rate * BURST_SEC))
+
+
+_lock = threading.Lock()
+_requests = _per_minute(OPENAI_RPM, WORKERS)
+_tokens = _per_minute(OPENAI_TPM, WORKERS)
+_sessions: "OrderedDict[str, TokenBucket]" = OrderedDict()
+_counts = {"allowed": 0, "session": 0, "rpm": 0, "tpm": 0}
+
+
+def estimate_tokens(text: str) -> int:
+  return len(text) // CHARS_PER_TOKEN + OUTPUT_TOKENS_ESTIMATE
+
+
+class LlmGrant:
+  """Permission for one upstream call; `settle` corrects the token estimate once usage is known."""
+
+  def __init__(self, estimated: int) -> None:
+    self.estimated = estimated
+
+  def settle(self, actual_tokens: int) -> None:
+    if _tokens is None or actual_tokens <= 0:
+      return
+    with _lock:
+      if actual_tokens > self.estimated:
+        _tokens.charge(actual_tokens - self.estimated)
+      else:
+        _tokens.give(self.estimated - actual_tokens)
+
+
+def _session_bucket(key: str) -> Optional[TokenBucket]:
+  if SESSION_PER_MIN <= 0:
+    return None
+  bucket = _sessions.get(key)
+  if bucket is None:
+    bucket = TokenBucket(SESSION_PER_MIN / 60.0, max(1.0, SESSION_BURST))
+    _sessions[key] = bucket
+    if len(_sessions) > MAX_SESSIONS:
+      _sessions.popitem(last=False)
+  else:
+    _sessions.move_to_end(key)
+  return bucket
+
+
+def acquire_llm(session_key: Optional[str], estimated_tokens: int) -> LlmGrant:
+  """Take one call (and its estimated tokens) from the session and global buckets.
+
+  Raises RateLimited, taking nothing, when any of them is empty; callers fall
+  back to an offline answer or a clarifier instead of calling OpenAI.
+  """
+  now = time.monotonic()
+  with _lock:
+    session = _session_bucket(session_key.strip()) if session_key and session_key.strip() else None
+    if session is not None and not session.take(1, now):
+      _counts["session"] += 1
+      raise RateLimited("rate_limited_session")
+    if _requests is not None and not _requests.take(1, now):
+      if session is not None:
+        session.give(1)
+      _counts["rpm"] += 1
+      raise RateLimited("rate_limited_rpm")
+    if _tokens is not None and not _tokens.take(estimated_tokens, now):
+      if session is not None:
+        session.give(1)
+      if _requests is not None:
+        _requests.give(1)
+      _counts["tpm"] += 1
+      raise RateLimited("rate_limited_tpm")
+    _counts["allowed"] += 1
+  return LlmGrant(estimated_tokens)
+
+
+def ratelimit_stats() -> Dict[str, Any]:
+  now = time.monotonic()
+  with _lock:
+    levels = {}
+    for name, bucket in (("rpm", _requests), ("tpm", _tokens)):
+      if bucket is not None:
+        bucket._refill(now)
+        levels[name] = {"available": round(bucket.tokens, 1), "capacity": round(bucket.capacity, 1), "per_min": round(bucket.rate * 60, 1)}
+    return {
+      "workers": WORKERS,
+      "buckets": levels,
+      "session_per_min": SESSION_PER_MIN,
+      "session_burst": SESSION_BURST,
+      "sessions_tracked": len(_sessions),
+      "allowed": _counts["allowed"],
+      "throttled": {k: v for k, v in _counts.items() if k != "allowed"},
+    }
@@ -0,0 +1,53 @@
+import hashlib
+import math
+import os
+import re
+import unicodedata
+from typing import List
+
+# Offline stand-in for the embeddings API: deterministic feature-hashed
+# vectors (words + character trigrams), so an index built with it can be
+# queried and evaluated without network access or an API key. Only useful
+# for comparing chunking/index settings against each other, never for serving.
+STUB_EMBED_DIMS = int(os.getenv("STUB_EMBED_DIMS", "256"))
+TRIGRAM_WEIGHT = 0.5
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def stub_enabled() -> bool:
+  return os.getenv("EMBED_PROVIDER", "openai").strip().lower() == "stub"
+
+
+def stub_model_name() -> str:
+  return f"stub-hash-{STUB_EMBED_DIMS}"
+
+
+def _fold(text: str) -> str:
+  decomposed = unicodedata.normalize("NFKD", text or "")
+  return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def _bucket(feature: str, dims: int) -> tuple:
+  # blake2b rather than hash(): vectors must match across processes and runs.
+  digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+  return digest % dims, (1.0 if digest >> 63 else -1.0)
+
+
+def stub_embed(text: str, dims: int = STUB_EMBED_DIMS) -> List[float]:
+  vec = [0.0] * dims
+  for word in _TOKEN.findall(_fold(text)):
+    idx, sign = _bucket("w:" + word, dims)
+    vec[idx] += sign
+    padded = f"#{word}#"
+    for i in range(len(padded) - 2):
+      idx, sign = _bucket("c:" + padded[i:i + 3], dims)
+      vec[idx] += sign * TRIGRAM_WEIGHT
+  norm = math.sqrt(sum(v * v for v in vec))
+  if norm == 0.0:
+    return vec
+  return [v / norm for v in vec]
+
+
+def stub_embed_texts(texts: List[str]) -> List[List[float]]:
+  return [stub_embed(t) for t in texts]
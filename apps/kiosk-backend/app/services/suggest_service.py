@@ -0,0 +1,197 @@
+import heapq
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.db.sqlite import get_sqlite_path
+from app.services.hash_service import hash_query
+from app.services.keyword_service import arabic_stems, fold
+from app.services.offline_pack_service import OfflinePack, get_offline_pack
+
+MAX_LIMIT = 10
+# Prefixes this short match most of the index; their top lists are precomputed.
+PRECOMPUTED_PREFIX_LEN = 2
+POPULARITY_REFRESH_SEC = float(os.getenv("SUGGEST_POPULARITY_REFRESH_SEC", "300"))
+CANONICAL_BONUS = 0.5
+TEXT_MATCH_BONUS = 1.0
+
+
+class SuggestIndex:
+  """Per-language sorted prefix index over folded question variants and tags.
+
+  Every word start of a variant (and its Arabic form without attached
+  prefixes) becomes a key, so "tawaf" completes "How many rounds of tawaf?".
+  A prefix lookup is one bisect plus a scan of the matching key range; the
+  best suggestion per entry is then picked with a bounded heap.
+  """
+
+  def __init__(self, pack: OfflinePack, lang: str, popularity: Dict[str, int]) -> None:
+    self.texts: List[str] = []
+    self.entry_of: List[int] = []
+    self.tokens: List[Set[str]] = []
+    self.weights: List[float] = []
+    keys: List[Tuple[str, int, bool]] = []
+    entry_hits: Dict[int, int] = {}
+    first_item: Dict[int, int] = {}
+    for idx, variant, _, _ in pack.langs.get(lang, []):
+      entry_hits[idx] = entry_hits.get(idx, 0) + popularity.get(hash_query(variant), 0)
+    for idx, variant, _, _ in pack.langs.get(lang, []):
+      folded = fold(variant)
+      if not folded:
+        continue
+      item = len(self.texts)
+      canonical = idx not in first_item
+      first_item.setdefault(idx, item)
+      self.texts.append(variant)
+      self.entry_of.append(idx)
+      self.tokens.append(set(folded.split()))
+      self.weights.append(
+        1.0
+        + math.log1p(entry_hits.get(idx, 0))
+        + 0.5 * math.log1p(popularity.get(hash_query(variant), 0))
+        + (CANONICAL_BONUS if canonical else 0.0)
+      )
+      keys.extend((key, item, False) for key in _word_start_keys(folded))
+    # Tags complete to the entry's canonical question, ranked below text matches.
+    for idx, item in first_item.items():
+      for tag in pack.entries[idx].get("tags", []):
+        folded = fold(tag) if isinstance(tag, str) else ""
+        if folded:
+          keys.append((folded, item, True))
+    keys.sort()
+    self.keys = [k for k, _, _ in keys]
+    self.items = [i for _, i, _ in keys]
+    self.via_tag = [t for _, _, t in keys]
+    self.top: Dict[str, List[int]] = {"": self._rank(range(len(self.texts)), set(), MAX_LIMIT)}
+    for key in set(k[:n] for k in self.keys for n in range(1, PRECOMPUTED_PREFIX_LEN + 1)):
+      matched, text_hits = self._scan(key)
+      self.top[key] = self._rank(matched, text_hits, MAX_LIMIT)
+
+  def _scan(self, prefix: str) -> Tuple[Set[int], Set[int]]:
+    """Items under `prefix`, and the subset matched through their own text."""
+    matched: Set[int] = set()
+    text_hits: Set[int] = set()
+    pos = bisect_left(self.keys, prefix)
+    while pos < len(self.keys) and self.keys[pos].startswith(prefix):
+      matched.add(self.items[pos])
+      if not self.via_tag[pos]:
+        text_hits.add(self.items[pos])
+      pos += 1
+    return matched, text_hits
+
+  def _rank(self, items: Iterable[int], boosted: Set[int], limit: int) -> List[int]:
+    # Ties go to the earlier variant, i.e. pack order.
+    best: Dict[int, Tuple[float, int]] = {}
+    for item in items:
+      w = self.weights[item] + (TEXT_MATCH_BONUS if item in boosted else 0.0)
+      entry = self.entry_of[item]
+      if entry not in best or (w, -item) > best[entry]:
+        best[entry] = (w, -item)
+    return [-neg_item for _, neg_item in heapq.nlargest(limit, best.values())]
+
+  def suggest(self, query: str, limit: int) -> List[str]:
+    folded = fold(query)
+    if folded in self.top:
+      return [self.texts[i] for i in self.top[folded][:limit]]
+    candidates, text_hits = self._scan(folded)
+    tokens = folded.split()
+    if len(tokens) > 1:
+      # Also complete the last word anywhere, as long as the earlier words appear.
+      head = tokens[:-1]
+      candidates |= {
+        i for i in self._scan(tokens[-1])[0] if all(t in self.tokens[i] for t in head)
+      }
+    return [self.texts[i] for i in self._rank(candidates, text_hits, limit)]
+
+
+def _word_start_keys(folded: str) -> Set[str]:
+  keys: Set[str] = set()
+  tokens = folded.split()
+  for i, token in enumerate(tokens):
+    rest = " ".join(tokens[i + 1:])
+    for stem in arabic_stems(token):
+      keys.add(f"{stem} {rest}" if rest else stem)
+  return keys
+
+
+def _load_popularity(hashes: Set[str]) -> Dict[str, int]:
+  if not hashes:
+    return {}
+  try:
+    conn = sqlite3.connect(get_sqlite_path())
+  except Exception:
+    return {}
+  try:
+    counts: Dict[str, int] = {}
+    batch = list(hashes)
+    for i in range(0, len(batch), 500):
+      chunk = batch[i:i + 500]
+      rows = conn.execute(
+        f"SELECT hashed_query, COUNT(1) FROM analytics WHERE hashed_query IN ({','.join('?' * len(chunk))}) GROUP BY hashed_query",
+        chunk,
+      ).fetchall()
+      counts.update({h: int(n) for h, n in rows})
+    return counts
+  except Exception:
+    logging.warning("suggest popularity unavailable; using pack order only")
+    return {}
+  finally:
+    conn.close()
+
+
+_indexes: Dict[str, SuggestIndex] = {}
+_indexes_version: Optional[str] = None
+_built_at = 0.0
+_attempted_version: Optional[str] = None
+_build_lock = threading.Lock()
+
+
+def _build(pack: OfflinePack) -> None:
+  global _indexes, _indexes_version, _built_at
+  started = time.perf_counter()
+  popularity = _load_popularity({hash_query(v) for variants in pack.langs.values() for _, v, _, _ in variants})
+  indexes = {lang: SuggestIndex(pack, lang, popularity) for lang in pack.langs}
+  _indexes, _indexes_version, _built_at = indexes, pack.version, time.monotonic()
+  logging.info(
+    "suggest index built version=%s langs=%d in %.1f ms",
+    pack.version, len(indexes), (time.perf_counter() - started) * 1000,
+  )
+
+
+def _rebuild_in_background(pack: OfflinePack) -> None:
+  global _built_at
+  try:
+    _build(pack)
+  except Exception:
+    _built_at = time.monotonic()
+    logging.exception("suggest index rebuild failed; keeping previous index")
+  finally:
+    _build_lock.release()
+
+
+def get_suggest_index(lang: str) -> Optional[SuggestIndex]:
+  global _attempted_version
+  pack = get_offline_pack()
+  if _indexes_version is None:
+    with _build_lock:
+      if _indexes_version is None:
+        _build(pack)
+  elif (pack.version not in (_indexes_version, _attempted_version)
+        or time.monotonic() - _built_at > POPULARITY_REFRESH_SEC):
+    # Keystrokes keep using the current index while one thread rebuilds it.
+    if _build_lock.acquire(blocking=False):
+      _attempted_version = pack.version
+      threading.Thread(target=_rebuild_in_background, args=(pack,), name="suggest-rebuild", daemon=True).start()
+  return _indexes.get(lang)
+
+
+def suggest(query: str, lang: str, limit: int = 5) -> List[str]:
+  index = get_suggest_index(lang)
+  if index is None:
+    return []
+  return index.suggest(query, max(1, min(limit, MAX_LIMIT)))
@@ -0,0 +1,216 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+# Requests slower than this are appended to the slow-request log (0 logs every request).
+SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "3000"))
+RING_SIZE = int(os.getenv("TRACE_RING_SIZE", "200"))
+# The slow log is rotated to "<name>.1" past this size.
+SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024
+MAX_SPANS = 200
+TRACE_HEADER = b"x-trace-id"
+_TRACE_ID = re.compile(r"^[0-9a-f]{16,32}$")
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_recent: Deque[Dict[str, Any]] = deque(maxlen=RING_SIZE)
+_recent_lock = threading.Lock()
+_slow_queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+_writer_started = False
+_writer_lock = threading.Lock()
+
+
+def get_slow_log_path() -> Path:
+  value = os.getenv("TRACE_SLOW_LOG")
+  if value:
+    return Path(value)
+  from app.db.sqlite import get_sqlite_path
+
+  return Path(get_sqlite_path()).parent / "slow_traces.jsonl"
+
+
+class Trace:
+  """Spans of one request. Flat (each span has its start offset), so a stage
+  can open in one worker thread and close in another, as streamed answers do."""
+
+  def __init__(self, trace_id: str, method: str, path: str) -> None:
+    self.trace_id = trace_id
+    self.method = method
+    self.path = path
+    self.started_ms = int(time.time() * 1000)
+    self._t0 = time.perf_counter()
+    self.spans: List[Dict[str, Any]] = []
+    self.attrs: Dict[str, Any] = {}
+    self.status: Optional[int] = None
+    self.duration_ms: Optional[float] = None
+
+  def offset_ms(self) -> float:
+    return round((time.perf_counter() - self._t0) * 1000, 2)
+
+  def add(self, span: Dict[str, Any]) -> None:
+    if len(self.spans) < MAX_SPANS:
+      self.spans.append(span)
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      "trace_id": self.trace_id,
+      "method": self.method,
+      "path": self.path,
+      "status": self.status,
+      "started_ms": self.started_ms,
+      "duration_ms": self.duration_ms,
+      "attrs": self.attrs,
+      "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+    }
+
+
+def current_trace_id() -> Optional[str]:
+  trace = _current.get()
+  return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+  """Time a stage of the current request; yields its attrs dict for the caller to fill in."""
+  trace = _current.get()
+  if trace is None:
+    yield attrs
+    return
+  start = trace.offset_ms()
+  try:
+    yield attrs
+  except BaseException as e:
+    attrs["error"] = type(e).__name__
+    raise
+  finally:
+    trace.add({"name": name, "start_ms": start, "duration_ms": round(trace.offset_ms() - start, 2), **attrs})
+
+
+def event(name: str, **attrs: Any) -> None:
+  """A zero-length span: something that happened, not a stage."""
+  trace = _current.get()
+  if trace is not None:
+    trace.add({"name": name, "start_ms": trace.offset_ms(), "duration_ms": 0.0, **attrs})
+
+
+def annotate(**attrs: Any) -> None:
+  """Attach request-level facts (route taken, error code...) to the current trace."""
+  trace = _current.get()
+  if trace is not None:
+    trace.attrs.update(attrs)
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+  """Decorator form of `span`; a generator is timed from its first step to its last."""
+  def decorate(func: Callable) -> Callable:
+    if inspect.isgeneratorfunction(func):
+      @functools.wraps(func)
+      def gen_wrapper(*args, **kwargs):
+        with span(name):
+          return (yield from func(*args, **kwargs))
+      return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if _current.get() is None:
+        return func(*args, **kwargs)
+      with span(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorate
+
+
+def _write_slow(record: Dict[str, Any]) -> None:
+  path = get_slow_log_path()
+  path.parent.mkdir(parents=True, exist_ok=True)
+  if path.exists() and path.stat().st_size > SLOW_LOG_MAX_BYTES:
+    os.replace(path, path.with_name(path.name + ".1"))
+  with path.open("a", encoding="utf-8") as fh:
+    fh.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def _slow_writer() -> None:
+  while True:
+    record = _slow_queue.get()
+    try:
+      _write_slow(record)
+    except Exception:
+      logging.exception("slow trace write failed")
+
+
+def _finish(trace: Trace) -> None:
+  if trace.duration_ms is not None:
+    return
+  trace.duration_ms = trace.offset_ms()
+  record = trace.to_dict()
+  with _recent_lock:
+    _recent.append(record)
+  if trace.duration_ms >= SLOW_MS:
+    global _writer_started
+    # The file is written by a background thread, never on the event loop.
+    with _writer_lock:
+      if not _writer_started:
+        _writer_started = True
+        threading.Thread(target=_slow_writer, name="slow-trace-writer", daemon=True).start()
+    _slow_queue.put(record)
+
+
+class TracingMiddleware:
+  """ASGI middleware: one Trace per HTTP request, id returned as X-Trace-Id.
+
+  A well-formed incoming X-Trace-Id (16-32 lowercase hex) is kept, so a kiosk
+  can correlate its own logs; otherwise a new id is generated. The trace ends
+  when the last body chunk is sent, so streamed answers are timed in full.
+  """
+
+  def __init__(self, app) -> None:
+    self.app = app
+
+  async def __call__(self, scope, receive, send) -> None:
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    incoming = dict(scope.get("headers") or []).get(TRACE_HEADER, b"").decode("latin-1").strip().lower()
+    trace = Trace(incoming if _TRACE_ID.match(incoming) else uuid.uuid4().hex, scope["method"], scope["path"])
+    token = _current.set(trace)
+
+    async def send_with_trace(message) -> None:
+      if message["type"] == "http.response.start":
+        trace.status = message["status"]
+        message = {**message, "headers": list(message.get("headers", [])) + [(TRACE_HEADER, trace.trace_id.encode())]}
+      await send(message)
+      if message["type"] == "http.response.body" and not message.get("more_body", False):
+        _finish(trace)
+
+    try:
+      await self.app(scope, receive, send_with_trace)
+    except BaseException:
+      trace.status = trace.status or 500
+      raise
+    finally:
+      _current.reset(token)
+      _finish(trace)
+
+
+def recent_traces(slow_only: bool = False, limit: int = 50) -> List[Dict[str, Any]]:
+  with _recent_lock:
+    traces = list(_recent)
+  if slow_only:
+    traces = [t for t in traces if t["duration_ms"] >= SLOW_MS]
+  return traces[::-1][:limit]
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+  with _recent_lock:
+    return next((t for t in reversed(_recent) if t["trace_id"] == trace_id), None)
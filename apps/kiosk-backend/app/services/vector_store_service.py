@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.ngram_service import np
+
+COMPACT_DIR = "compact"
+COMPACT_FORMAT = 1
+PRECISIONS = ("int8", "f16")
+# int8 search shortlists this many candidates per requested result for the float16 re-rank.
+SHORTLIST_FACTOR = int(os.getenv("COMPACT_SHORTLIST_FACTOR", "4"))
+MIN_SHORTLIST = 20
+# Rows scored per matrix product, so the int8 -> float32 upcast never copies the whole matrix.
+SCORE_BLOCK_ROWS = 4096
+
+
+def _distance(vecs: "np.ndarray", query: "np.ndarray", space: str) -> "np.ndarray":
+  """Distances in the Chroma collection's space, so scores and thresholds carry over."""
+  dots = vecs @ query
+  if space == "ip":
+    return 1.0 - dots
+  if space == "cosine":
+    norms = np.linalg.norm(vecs, axis=1) * float(np.linalg.norm(query))
+    return 1.0 - dots / np.where(norms == 0, 1.0, norms)
+  # "l2" (Chroma's default) is the squared euclidean distance.
+  return np.einsum("ij,ij->i", vecs, vecs) - 2.0 * dots + float(query @ query)
+
+
+class CompactCollection:
+  """Read-only stand-in for a Chroma collection, over memory-mapped numpy files.
+
+  Vectors may be shortened (text-embedding-3 vectors keep their meaning when
+  truncated and re-normalized) and are stored as float16, plus int8 codes
+  with a per-row scale when precision is "int8". An int8 search shortlists
+  candidates on the codes and re-ranks them exactly on the float16 rows, so
+  only the codes have to stay hot in memory. Rows are grouped by language,
+  which turns the usual `{"lang": ...}` filter into a slice.
+
+  Implements the part of the collection API retrieval uses: query, count, peek.
+  """
+
+  def __init__(self, path: Path) -> None:
+    meta = json.loads((path / "chunks.json").read_text(encoding="utf-8"))
+    if meta.get("format") != COMPACT_FORMAT:
+      raise ValueError(f"unsupported compact index format {meta.get('format')}")
+    self.path = path
+    self.dims: int = meta["dims"]
+    self.precision: str = meta["precision"]
+    self.space: str = meta.get("space", "l2")
+    self.truncated: bool = meta["dims"] < meta.get("source_dims", meta["dims"])
+    self.ids: List[str] = meta["ids"]
+    self.documents: List[str] = meta["documents"]
+    self.metadatas: List[Dict[str, Any]] = meta["metadatas"]
+    self.lang_ranges: Dict[str, Tuple[int, int]] = {k: tuple(v) for k, v in meta["lang_ranges"].items()}
+    # mmap: pages are loaded on demand and shared between pre-forked workers.
+    self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+    self.codes = np.load(path / "codes.npy", mmap_mode="r") if self.precision == "int8" else None
+    self.scales = np.load(path / "scales.npy") if self.precision == "int8" else None
+
+  def count(self) -> int:
+    return len(self.ids)
+
+  def peek(self, limit: int = 10) -> Dict[str, Any]:
+    return {
+      "ids": self.ids[:limit],
+      "embeddings": np.asarray(self.vectors[:limit], dtype=np.float32),
+      "documents": self.documents[:limit],
+      "metadatas": self.metadatas[:limit],
+    }
+
+  def resident_bytes(self) -> int:
+    """Bytes every query touches: the int8 codes, or all float16 rows."""
+    if self.codes is not None:
+      return int(self.codes.nbytes + self.scales.nbytes)
+    return int(self.vectors.nbytes)
+
+  def _rows(self, where: Optional[Dict[str, Any]]) -> "np.ndarray":
+    if not where:
+      return np.arange(len(self.ids))
+    if set(where) == {"lang"} and isinstance(where["lang"], str):
+      start, end = self.lang_ranges.get(where["lang"], (0, 0))
+      return np.arange(start, end)
+    return np.asarray(
+      [i for i, m in enumerate(self.metadatas) if all(m.get(k) == v for k, v in where.items())],
+      dtype=np.int64,
+    )
+
+  def _prepare(self, embedding: List[float]) -> "np.ndarray":
+    query = np.asarray(embedding, dtype=np.float32)
+    if query.shape[0] < self.dims:
+      raise ValueError(f"query has {query.shape[0]} dims, index has {self.dims}")
+    if query.shape[0] > self.dims or self.truncated:
+      query = query[:self.dims]
+      norm = float(np.linalg.norm(query))
+      query = query / norm if norm else query
+    return query
+
+  def _search(self, query: "np.ndarray", rows: "np.ndarray", n_results: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    if not len(rows):
+      return rows, np.zeros(0, dtype=np.float32)
+    if self.codes is not None and len(rows) > n_results:
+      scores = np.empty(len(rows), dtype=np.float32)
+      for start, block in self._blocks(rows):
+        scores[start:start + len(block)] = (self._take(self.codes, block).astype(np.float32) @ query) * self._take(self.scales, block)
+      shortlist = min(len(rows), max(n_results * SHORTLIST_FACTOR, MIN_SHORTLIST))
+      if shortlist < len(rows):
+        rows = np.sort(rows[np.argpartition(-scores, shortlist - 1)[:shortlist]])
+    distances = np.empty(len(rows), dtype=np.float32)
+    for start, block in self._blocks(rows):
+      distances[start:start + len(block)] = _distance(self._take(self.vectors, block).astype(np.float32), query, self.space)
+    order = np.argsort(distances, kind="stable")[:n_results]
+    return rows[order], distances[order]
+
+  @staticmethod
+  def _blocks(rows: "np.ndarray"):
+    for start in range(0, len(rows), SCORE_BLOCK_ROWS):
+      yield start, rows[start:start + SCORE_BLOCK_ROWS]
+
+  @staticmethod
+  def _take(array: "np.ndarray", block: "np.ndarray") -> "np.ndarray":
+    # Contiguous rows (the usual per-language slice) are a view, not a copy.
+    lo, hi = int(block[0]), int(block[-1]) + 1
+    return array[lo:hi] if hi - lo == len(block) else array[block]
+
+  def query(
+    self,
+    query_embeddings: List[List[float]],
+    n_results: int = 10,
+    where: Optional[Dict[str, Any]] = None,
+    include: Optional[List[str]] = None,
+  ) -> Dict[str, Any]:
+    include = include or ["documents", "metadatas", "distances"]
+    rows = self._rows(where)
+    out: Dict[str, Any] = {"ids": []}
+    for key in include:
+      out[key] = []
+    for embedding in query_embeddings:
+      hits, distances = self._search(self._prepare(embedding), rows, n_results)
+      out["ids"].append([self.ids[i] for i in hits])
+      if "documents" in include:
+        out["documents"].append([self.documents[i] for i in hits])
+      if "metadatas" in include:
+        out["metadatas"].append([self.metadatas[i] for i in hits])
+      if "distances" in include:
+        out["distances"].append([float(d) for d in distances])
+    return out
+
+
+def open_compact_index(index_dir: str) -> Optional[CompactCollection]:
+  path = Path(index_dir) / COMPACT_DIR
+  if np is None or not (path / "chunks.json").exists():
+    return None
+  return CompactCollection(path)
+
+
+def _quantize_int8(vectors: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+  """Symmetric per-row int8 codes: row ~= codes * scale."""
+  peak = np.abs(vectors).max(axis=1)
+  scales = np.where(peak == 0, 1.0, peak / 127.0).astype(np.float32)
+  codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+  return codes, scales
+
+
+def build_compact_index(collection, out_dir: Path, dims: Optional[int] = None, precision: str = "int8", page_size: int = 1000) -> Dict[str, Any]:
+  """Export a Chroma collection into a compact index at out_dir (replaced if present).
+
+  `dims` shortens every vector (and later every query) to its first `dims`
+  components, re-normalized. Returns sizes for reporting.
+  """
+  if np is None:
+    raise RuntimeError("numpy is required for compact indexes")
+  if precision not in PRECISIONS:
+    raise ValueError(f"precision must be one of {PRECISIONS}")
+  started = time.perf_counter()
+  ids: List[str] = []
+  documents: List[str] = []
+  metadatas: List[Dict[str, Any]] = []
+  rows: List[Any] = []
+  offset = 0
+  while True:
+    page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+    batch = page.get("ids") or []
+    if not batch:
+      break
+    ids.extend(batch)
+    documents.extend(page.get("documents") or [""] * len(batch))
+    metadatas.extend(m or {} for m in (page.get("metadatas") or [{}] * len(batch)))
+    rows.extend(page["embeddings"])
+    offset += len(batch)
+  if not ids:
+    raise RuntimeError("collection is empty")
+
+  vectors = np.asarray(rows, dtype=np.float32)
+  source_dims = int(vectors.shape[1])
+  dims = min(dims or source_dims, source_dims)
+  if dims < source_dims:
+    vectors = vectors[:, :dims]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+
+  order = sorted(range(len(ids)), key=lambda i: (str(metadatas[i].get("lang", "")), i))
+  vectors = vectors[order]
+  ids = [ids[i] for i in order]
+  documents = [documents[i] for i in order]
+  metadatas = [metadatas[i] for i in order]
+  lang_ranges: Dict[str, List[int]] = {}
+  for i, meta in enumerate(metadatas):
+    lang = str(meta.get("lang", ""))
+    lang_ranges.setdefault(lang, [i, i])[1] = i + 1
+
+  space = ((getattr(collection, "metadata", None) or {}).get("hnsw:space") or "l2")
+  tmp = Path(str(out_dir) + ".tmp")
+  shutil.rmtree(tmp, ignore_errors=True)
+  tmp.mkdir(parents=True)
+  np.save(tmp / "vectors.npy", vectors.astype(np.float16))
+  if precision == "int8":
+    codes, scales = _quantize_int8(vectors)
+    np.save(tmp / "codes.npy", codes)
+    np.save(tmp / "scales.npy", scales)
+  (tmp / "chunks.json").write_text(json.dumps({
+    "format": COMPACT_FORMAT,
+    "dims": dims,
+    "source_dims": source_dims,
+    "precision": precision,
+    "space": space,
+    "ids": ids,
+    "documents": documents,
+    "metadatas": metadatas,
+    "lang_ranges": lang_ranges,
+  }, ensure_ascii=False), encoding="utf-8")
+  shutil.rmtree(out_dir, ignore_errors=True)
+  os.replace(tmp, out_dir)
+
+  compact = CompactCollection(Path(out_dir))
+  info = {
+    "chunks": len(ids),
+    "dims": dims,
+    "source_dims": source_dims,
+    "precision": precision,
+    "resident_bytes": compact.resident_bytes(),
+    "disk_bytes": sum(p.stat().st_size for p in Path(out_dir).iterdir()),
+    "full_precision_bytes": len(ids) * source_dims * 4,
+  }
+  logging.info("compact index built %s in %dms", info, int((time.perf_counter() - started) * 1000))
+  return info
@@ -0,0 +1,100 @@
+import { fetchJSON } from "./client";
+
+export type ClientEventInput = {
+  type: "feedback" | "timing";
+  session_id: string;
+  lang?: string | null;
+  rating_1_5?: number | null;
+  time_on_screen_ms?: number | null;
+  route_used?: string | null;
+  confidence?: number | null;
+  latency_ms?: number | null;
+};
+
+type BufferedEvent = ClientEventInput & { event_id: string; client_ts: string };
+
+type BatchResponse = {
+  ok: boolean;
+  accepted: number;
+  duplicates: number;
+  rejected: { index: number; event_id?: string | null; reason: string }[];
+};
+
+const STORAGE_KEY = "kiosk_event_buffer";
+const MAX_BUFFERED = 500;
+const FLUSH_DELAY_MS = 3000;
+const MAX_RETRY_DELAY_MS = 60000;
+
+let flushTimer: number | null = null;
+let flushing = false;
+let retryDelay = FLUSH_DELAY_MS;
+
+function newEventId(): string {
+  if (typeof crypto !== "undefined" && "randomUUID" in crypto) {
+    return crypto.randomUUID();
+  }
+  // randomUUID needs a secure context; kiosks on plain http fall back to this.
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+function loadBuffer(): BufferedEvent[] {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_KEY) || "[]") as BufferedEvent[];
+  } catch {
+    return [];
+  }
+}
+
+function saveBuffer(events: BufferedEvent[]) {
+  try {
+    localStorage.setItem(STORAGE_KEY, JSON.stringify(events.slice(-MAX_BUFFERED)));
+  } catch {
+    // storage full or unavailable - events are best effort
+  }
+}
+
+function scheduleFlush(delay: number) {
+  if (flushTimer !== null) return;
+  flushTimer = window.setTimeout(() => {
+    flushTimer = null;
+    void flushEvents();
+  }, delay);
+}
+
+/** Buffer an analytics event; buffered events are sent together in one batch. */
+export function queueEvent(event: ClientEventInput) {
+  const buffer = loadBuffer();
+  buffer.push({ ...event, event_id: newEventId(), client_ts: new Date().toISOString() });
+  saveBuffer(buffer);
+  scheduleFlush(FLUSH_DELAY_MS);
+}
+
+export async function flushEvents(): Promise<void> {
+  if (flushing) return;
+  const batch = loadBuffer().slice(0, MAX_BUFFERED);
+  if (!batch.length) return;
+  flushing = true;
+  try {
+    await fetchJSON<BatchResponse>("/api/feedback/batch", {
+      method: "POST",
+      body: JSON.stringify({ events: batch }),
+    });
+    // Accepted, duplicate and rejected events are all settled; retrying cannot change them.
+    const sent = new Set(batch.map((e) => e.event_id));
+    const remaining = loadBuffer().filter((e) => !sent.has(e.event_id));
+    saveBuffer(remaining);
+    retryDelay = FLUSH_DELAY_MS;
+    if (remaining.length) scheduleFlush(FLUSH_DELAY_MS);
+  } catch {
+    // Offline or busy: keep the buffer and retry later. Event ids make resends safe.
+    retryDelay = Math.min(retryDelay * 2, MAX_RETRY_DELAY_MS);
+    scheduleFlush(retryDelay);
+  } finally {
+    flushing = false;
+  }
+}
+
+if (typeof window !== "undefined") {
+  window.addEventListener("online", () => void flushEvents());
+  if (loadBuffer().length) scheduleFlush(FLUSH_DELAY_MS);
+}
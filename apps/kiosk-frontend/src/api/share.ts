@@ -0,0 +1,63 @@
+export type SharedChecklist = {
+  lang: string;
+  sections: { key: string; title: string; items: string[] }[];
+  truncated: boolean;
+};
+
+// Keep in sync with SECTION_TITLES in the backend guide_service.
+const SECTION_TITLES: Record<string, Record<string, string>> = {
+  EN: {
+    preparation: "Preparation",
+    permits: "Permits (Nusuk)",
+    umrah: "Umrah steps",
+    rawdah: "Visiting the Rawdah",
+    mistakes: "Common mistakes to avoid",
+  },
+  AR: {
+    preparation: "التحضير",
+    permits: "التصاريح (نسك)",
+    umrah: "خطوات العمرة",
+    rawdah: "زيارة الروضة",
+    mistakes: "اخطاء شائعة",
+  },
+  FR: {
+    preparation: "Preparation",
+    permits: "Permis (Nusuk)",
+    umrah: "Etapes de la Omra",
+    rawdah: "Visite de la Rawdah",
+    mistakes: "Erreurs courantes a eviter",
+  },
+};
+
+type SharePayloadV1 = {
+  v: number;
+  l: string;
+  s: [string, string[]][];
+  t?: number;
+};
+
+function base64UrlToBytes(value: string): Uint8Array<ArrayBuffer> {
+  const base64 = value.replace(/-/g, "+").replace(/_/g, "/");
+  const padded = base64 + "=".repeat((4 - (base64.length % 4)) % 4);
+  const binary = atob(padded);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+  return bytes;
+}
+
+/** Decode the `#d=` payload written by the backend (raw deflate + base64url JSON). */
+export async function decodeSharePayload(encoded: string): Promise<SharedChecklist | null> {
+  try {
+    const stream = new Blob([base64UrlToBytes(encoded)]).stream().pipeThrough(new DecompressionStream("deflate-raw"));
+    const payload = JSON.parse(await new Response(stream).text()) as SharePayloadV1;
+    if (payload.v !== 1 || !Array.isArray(payload.s)) return null;
+    const titles = SECTION_TITLES[payload.l] || SECTION_TITLES.EN;
+    return {
+      lang: payload.l,
+      sections: payload.s.map(([key, items]) => ({ key, title: titles[key] || key, items })),
+      truncated: payload.t === 1,
+    };
+  } catch {
+    return null;
+  }
+}
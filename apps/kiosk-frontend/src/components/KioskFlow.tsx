@@ -1,5 +1,6 @@
 ﻿import { useEffect, useRef, useState } from "react";
-import { fetchJSON, fetchSSE, API_BASE_URL } from "../api/client";
+import { fetchSSE, API_BASE_URL } from "../api/client";
+import { queueEvent } from "../api/events";
 import { TayyibPanel } from "./TayyibPanel";
 import { IntroWave } from "./IntroWave";
 import AnimatedContent from "./ui/AnimatedContentReactBits";
@@ -259,20 +260,18 @@ export function KioskFlow() {
       )
     );
 
-    // Submit to backend (thumbs up = 5, thumbs down = 2)
+    // Buffered and sent in batches (thumbs up = 5, thumbs down = 2)
     try {
       const session_id = ensureSession();
       const start = Number(sessionStorage.getItem(SESSION_START_KEY) || Date.now());
-      const time_on_screen_ms = Date.now() - start;
-      await fetchJSON("/api/feedback", {
-        method: "POST",
-        body: JSON.stringify({
-          session_id,
-          rating_1_5: isPositive ? 5 : 2,
-          time_on_screen_ms,
-          last_route_used: lastRoute,
-          last_confidence: lastConfidence,
-        }),
+      queueEvent({
+        type: "feedback",
+        session_id,
+        lang,
+        rating_1_5: isPositive ? 5 : 2,
+        time_on_screen_ms: Date.now() - start,
+        route_used: lastRoute,
+        confidence: lastConfidence,
       });
     } catch {
       // silent - don't disrupt chat
@@ -679,7 +678,7 @@ export function KioskFlow() {
             </div>
             <div className="flex-1 overflow-y-auto p-6 space-y-3 sources-scroll">
               {activeSources.map((s, idx) => {
-                const pageLabel = s.page_start && s.page_end ? `pp. ${s.page_start}-${s.page_end}` : s.page ? `p. ${s.page}` : "";
+                const pageLabel = s.page_start && s.page_end && s.page_end !== s.page_start ? `pp. ${s.page_start}-${s.page_end}` : s.page ? `p. ${s.page}` : "";
                 const url = s.url_or_path || s.url || "";
                 const isLink = typeof url === "string" && url.startsWith("http");
                 return (
@@ -1,24 +1,48 @@
 ﻿import { useEffect, useState } from "react";
 import { KioskLayout } from "../layouts/KioskLayout";
 import { useLang } from "../hooks/useLang";
+import { decodeSharePayload, type SharedChecklist } from "../api/share";
 
 export function SharePage() {
   const { t } = useLang();
-  const [hasPayload, setHasPayload] = useState(false);
+  const [checklist, setChecklist] = useState<SharedChecklist | null>(null);
+  const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     const hash = window.location.hash || "";
-    setHasPayload(hash.includes("#d="));
+    const idx = hash.indexOf("d=");
+    if (idx < 0) {
+      setLoading(false);
+      return;
+    }
+    decodeSharePayload(hash.slice(idx + 2)).then((decoded) => {
+      setChecklist(decoded);
+      setLoading(false);
+    });
   }, []);
 
   return (
     <KioskLayout>
       <div className="h-full p-6">
-        <div className="rounded-xl border border-amber-200 bg-white/70 p-6 h-full">
+        <div className="rounded-xl border border-amber-200 bg-white/70 p-6 h-full overflow-auto">
           <div className="text-xl font-semibold mb-4">{t.shareTitle}</div>
-          <div className="text-sm text-gray-600">
-            {hasPayload ? t.checklistLoaded : t.checklistMissing}
-          </div>
+          {!loading && !checklist && (
+            <div className="text-sm text-gray-600">{t.checklistMissing}</div>
+          )}
+          {checklist && (
+            <div className="space-y-4" dir={checklist.lang === "AR" ? "rtl" : "ltr"}>
+              {checklist.sections.map((section) => (
+                <div key={section.key} className="rounded border border-amber-200 p-3 bg-white">
+                  <div className="text-sm font-semibold mb-2">{section.title}</div>
+                  <ul className="list-disc ps-5 text-sm space-y-1">
+                    {section.items.map((item, i) => (
+                      <li key={i}>{item}</li>
+                    ))}
+                  </ul>
+                </div>
+              ))}
+            </div>
+          )}
         </div>
       </div>
     </KioskLayout>
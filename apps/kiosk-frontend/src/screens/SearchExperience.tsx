@@ -591,7 +591,7 @@ export function SearchExperience({ startAt }: { startAt?: "ATTRACT" | "SEARCH_RE
                 <div className="text-xs text-gray-500">—</div>
               )}
               {sources.map((s, idx) => {
-                const pageLabel = s.page_start && s.page_end ? `pp. ${s.page_start}-${s.page_end}` : s.page ? `p. ${s.page}` : "";
+                const pageLabel = s.page_start && s.page_end && s.page_end !== s.page_start ? `pp. ${s.page_start}-${s.page_end}` : s.page ? `p. ${s.page}` : "";
                 const url = s.url_or_path || s.url || "";
                 const isLink = typeof url === "string" && url.startsWith("http");
                 return (
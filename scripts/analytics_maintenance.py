@@ -0,0 +1,53 @@
+import argparse
+import json
+import sqlite3
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND = ROOT / "apps" / "kiosk-backend"
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Roll, archive and compact the analytics DB (the backend also does this hourly).")
+  parser.add_argument("--retention-days", type=int, default=None, help="Archive day partitions older than this (default ANALYTICS_RETENTION_DAYS)")
+  parser.add_argument("--vacuum", action="store_true", help="VACUUM even if not due")
+  parser.add_argument("--list", action="store_true", help="Only list partitions")
+  args = parser.parse_args()
+
+  sys.path.insert(0, str(BACKEND))
+  try:
+    from dotenv import load_dotenv
+    load_dotenv(ROOT / ".env", override=False)
+    load_dotenv(BACKEND / ".env", override=False)
+  except ImportError:
+    pass
+  from app.db.sqlite import get_sqlite_path, init_db
+  from app.services.analytics_maintenance_service import RETENTION_DAYS, run_maintenance
+
+  init_db()
+  if not args.list:
+    report = run_maintenance(
+      retention_days=args.retention_days if args.retention_days is not None else RETENTION_DAYS,
+      vacuum=True if args.vacuum else None,
+    )
+    print(json.dumps(report, indent=2))
+
+  conn = sqlite3.connect(get_sqlite_path())
+  try:
+    print(f"{'day':<10} {'first_id':>10} {'rows':>8}  state")
+    for day, first_id, archived_ts, archive_path, row_count in conn.execute(
+      "SELECT day, first_id, archived_ts, archive_path, row_count FROM analytics_partitions ORDER BY day"
+    ):
+      if archived_ts is None:
+        live_rows = conn.execute(f"SELECT COUNT(1) FROM analytics_{day}").fetchone()[0]
+        print(f"{day:<10} {first_id:>10} {live_rows:>8}  live")
+      else:
+        print(f"{day:<10} {first_id:>10} {row_count:>8}  archived -> {archive_path}")
+  finally:
+    conn.close()
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
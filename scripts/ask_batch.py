@@ -0,0 +1,103 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND = ROOT / "apps" / "kiosk-backend"
+
+
+def load_questions(path: Path, default_lang: str) -> List[Dict]:
+  """One question per line (.txt) or JSON objects with query/lang (.jsonl)."""
+  items = []
+  for n, line in enumerate(path.read_text(encoding="utf-8-sig").splitlines(), start=1):
+    line = line.strip()
+    if not line or line.startswith("#"):
+      continue
+    if path.suffix.lower() == ".jsonl":
+      obj = json.loads(line)
+      query, lang = obj.get("query", ""), obj.get("lang", default_lang)
+    else:
+      query, lang = line, default_lang
+    items.append({"lang": lang.upper(), "query": query, "session_id": f"batch-{n}"})
+  return items
+
+
+def run_local(items: List[Dict], concurrency: int, record_analytics: bool) -> Dict:
+  sys.path.insert(0, str(BACKEND))
+  try:
+    from dotenv import load_dotenv
+    load_dotenv(ROOT / ".env", override=False)
+    load_dotenv(BACKEND / ".env", override=True)
+  except ImportError:
+    pass
+  from app.db.sqlite import init_db
+  from app.schemas.ask import AskRequest
+  from app.services.ask_batch_service import answer_batch
+
+  if record_analytics:
+    init_db()
+  response = answer_batch([AskRequest(**i) for i in items], concurrency=concurrency, record_analytics=record_analytics)
+  return response.model_dump()
+
+
+def run_remote(url: str, items: List[Dict], concurrency: int, record_analytics: bool) -> Dict:
+  import requests
+
+  resp = requests.post(
+    f"{url.rstrip('/')}/api/ask/batch",
+    json={"items": items, "concurrency": concurrency, "record_analytics": record_analytics},
+    timeout=3600,
+  )
+  resp.raise_for_status()
+  return resp.json()
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Run a question set through the ask pipeline in bulk.")
+  parser.add_argument("questions", help=".txt (one question per line) or .jsonl with query/lang")
+  parser.add_argument("--lang", default="EN", help="Language for .txt input (default EN)")
+  parser.add_argument("--concurrency", type=int, default=4, help="Parallel LLM calls")
+  parser.add_argument("--out", default=None, help="Write one JSON result per line here")
+  parser.add_argument("--url", default=None, help="Call a running backend (dev mode) instead of running in-process")
+  parser.add_argument("--chunk", type=int, default=500, help="Questions per batch request")
+  parser.add_argument("--record-analytics", action="store_true", help="Also write analytics rows")
+  args = parser.parse_args()
+
+  items = load_questions(Path(args.questions), args.lang)
+  if not items:
+    print("No questions found")
+    return 1
+
+  results: List[Dict] = []
+  timings: Dict[str, int] = {}
+  routes: Dict[str, int] = {}
+  for start in range(0, len(items), args.chunk):
+    chunk = items[start:start + args.chunk]
+    if args.url:
+      batch = run_remote(args.url, chunk, args.concurrency, args.record_analytics)
+    else:
+      batch = run_local(chunk, args.concurrency, args.record_analytics)
+    results.extend(batch["results"])
+    for k, v in batch["timings_ms"].items():
+      timings[k] = timings.get(k, 0) + v
+    for k, v in batch["routes"].items():
+      routes[k] = routes.get(k, 0) + v
+
+  if args.out:
+    with open(args.out, "w", encoding="utf-8") as fh:
+      for item, result in zip(items, results):
+        fh.write(json.dumps({"lang": item["lang"], "query": item["query"], **result}, ensure_ascii=False) + "\n")
+
+  print(f"Questions: {len(items)}")
+  print("Routes: " + ", ".join(f"{k}={v}" for k, v in sorted(routes.items())))
+  print(
+    f"Timings: embed={timings.get('embed', 0)}ms retrieve={timings.get('retrieve', 0)}ms "
+    f"generate={timings.get('generate', 0)}ms total={timings.get('total', 0)}ms"
+  )
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
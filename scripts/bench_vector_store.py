@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND = ROOT / "apps" / "kiosk-backend"
+
+
+def load_env() -> None:
+  sys.path.insert(0, str(BACKEND))
+  try:
+    from dotenv import load_dotenv
+    load_dotenv(ROOT / ".env", override=False)
+    load_dotenv(BACKEND / ".env", override=False)
+  except ImportError:
+    pass
+
+
+def dir_bytes(path: Path) -> int:
+  return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def run_queries(collection, queries: List[Tuple[str, str, List[float]]], n_results: int) -> Tuple[List[List[Dict]], List[float]]:
+  """Per query: the hit metadatas (ids included) and the query latency in ms."""
+  hits: List[List[Dict]] = []
+  latencies: List[float] = []
+  for lang, _, embedding in queries:
+    t0 = time.perf_counter()
+    result = collection.query(query_embeddings=[embedding], n_results=n_results, where={"lang": lang}, include=["metadatas", "distances"])
+    latencies.append((time.perf_counter() - t0) * 1000)
+    hits.append([{"id": i, **(m or {})} for i, m in zip(result["ids"][0], result["metadatas"][0])])
+  return hits, latencies
+
+
+def score(hits: List[List[Dict]], baseline: List[List[Dict]], labels: List[frozenset], top_ks: List[int]) -> Dict[str, Dict[int, float]]:
+  from app.services.rag_eval_service import base_source_id
+
+  overlap: Dict[int, float] = {}
+  hit_rate: Dict[int, float] = {}
+  for k in top_ks:
+    shared = [
+      len({h["id"] for h in got[:k]} & {h["id"] for h in ref[:k]}) / max(1, len(ref[:k]))
+      for got, ref in zip(hits, baseline)
+    ]
+    found = [
+      any(base_source_id(h.get("source_id", "")) in relevant for h in got[:k])
+      for got, relevant in zip(hits, labels)
+    ]
+    overlap[k] = sum(shared) / len(shared) if shared else 0.0
+    hit_rate[k] = sum(found) / len(found) if found else 0.0
+  return {"overlap": overlap, "hit_rate": hit_rate}
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Compare compact (shortened/quantized) vector storage against the Chroma index.")
+  parser.add_argument("--dims", default="3072,1024,512,256", help="Comma-separated vector sizes to try (clamped to the index size)")
+  parser.add_argument("--precision", default="int8,f16", help="Comma-separated storage precisions: int8, f16")
+  parser.add_argument("--top-k", default="3,5", help="Comma-separated k for overlap/hit rate")
+  parser.add_argument("--stub", action="store_true", help="Embed queries with the offline stub embedder")
+  parser.add_argument("--chroma-path", default=None, help="Benchmark this local index instead of CHROMA_PATH")
+  parser.add_argument("--out", default=None, help="Write the JSON report here")
+  args = parser.parse_args()
+
+  if args.stub:
+    os.environ["EMBED_PROVIDER"] = "stub"
+  if args.chroma_path:
+    os.environ["CHROMA_PATH"] = str(Path(args.chroma_path).resolve())
+  os.environ["VECTOR_STORE"] = "chroma"
+  load_env()
+  from app.services.offline_pack_service import get_offline_pack
+  from app.services.rag_eval_service import labeled_queries, percentile
+  from app.services.rag_service import _open_collection, get_query_embeddings, resolve_index_dir
+  from app.services.vector_store_service import CompactCollection, build_compact_index
+
+  index_dir, version = resolve_index_dir()
+  _, collection = _open_collection(index_dir)
+  if collection is None or not collection.count():
+    print(f"No Chroma index at {index_dir}")
+    return 1
+
+  pack = get_offline_pack()
+  labeled = [(lang, q, ids) for lang in pack.langs for q, ids in labeled_queries(pack, lang)]
+  embeddings = get_query_embeddings([q for _, q, _ in labeled])
+  queries = [(lang, q, vec) for (lang, q, _), vec in zip(labeled, embeddings) if vec is not None]
+  labels = [ids for (_, _, ids), vec in zip(labeled, embeddings) if vec is not None]
+  if not queries:
+    print("No query embeddings (is the embedder reachable?)")
+    return 1
+
+  top_ks = sorted({int(k) for k in args.top_k.split(",") if k.strip()})
+  n_results = top_ks[-1]
+  source_dims = len(queries[0][2])
+  chunks = collection.count()
+  # Warm both sides once so the first timed query is not a cold start.
+  run_queries(collection, queries[:1], n_results)
+  baseline, latencies = run_queries(collection, queries, n_results)
+  rows = [{
+    "store": "chroma",
+    "dims": source_dims,
+    "precision": "f32",
+    "resident_bytes": chunks * source_dims * 4,
+    "disk_bytes": dir_bytes(Path(index_dir)),
+    "p50_ms": percentile(latencies, 50),
+    "p95_ms": percentile(latencies, 95),
+    **score(baseline, baseline, labels, top_ks),
+  }]
+
+  wanted_dims = sorted({min(int(d), source_dims) for d in args.dims.split(",") if d.strip()}, reverse=True)
+  with tempfile.TemporaryDirectory() as tmp:
+    for dims in wanted_dims:
+      for precision in [p.strip() for p in args.precision.split(",") if p.strip()]:
+        out_dir = Path(tmp) / f"{dims}-{precision}"
+        info = build_compact_index(collection, out_dir, dims=dims, precision=precision)
+        compact = CompactCollection(out_dir)
+        run_queries(compact, queries[:1], n_results)
+        hits, latencies = run_queries(compact, queries, n_results)
+        rows.append({
+          "store": "compact",
+          "dims": dims,
+          "precision": precision,
+          "resident_bytes": info["resident_bytes"],
+          "disk_bytes": info["disk_bytes"],
+          "p50_ms": percentile(latencies, 50),
+          "p95_ms": percentile(latencies, 95),
+          **score(hits, baseline, labels, top_ks),
+        })
+
+  print(f"Index {version}: {chunks} chunks, {source_dims} dims, {len(queries)} labeled queries")
+  print("overlap@k = share of Chroma's full-precision top-k also returned; hit@k = a labeled source in the top k\n")
+  header = f"{'store':<8} {'dims':>5} {'prec':>4} {'resident':>9} {'disk':>9} {'p50 ms':>7} {'p95 ms':>7}"
+  for k in top_ks:
+    header += f" {'overlap@' + str(k):>10} {'hit@' + str(k):>6}"
+  print(header)
+  for row in rows:
+    line = (
+      f"{row['store']:<8} {row['dims']:>5} {row['precision']:>4} {row['resident_bytes'] / 1e6:>7.2f}MB "
+      f"{row['disk_bytes'] / 1e6:>7.2f}MB {row['p50_ms']:>7.2f} {row['p95_ms']:>7.2f}"
+    )
+    for k in top_ks:
+      line += f" {row['overlap'][k]:>10.3f} {row['hit_rate'][k]:>6.3f}"
+    print(line)
+  print("\nChroma's resident figure counts only its float32 vectors, not the HNSW graph or the chromadb import.")
+
+  if args.out:
+    Path(args.out).write_text(json.dumps({"index_version": version, "chunks": chunks, "queries": len(queries), "rows": rows}, indent=2), encoding="utf-8")
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -0,0 +1,127 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND = ROOT / "apps" / "kiosk-backend"
+
+WARMUP_PATHS = [
+  "/api/health",
+  "/api/suggest?lang=EN&q=ta",
+  "/api/suggest?lang=AR&q=%D8%B9%D9%85%D8%B1",
+  "/api/suggest?lang=FR&q=om",
+]
+
+
+def children(pid: int) -> List[int]:
+  found = []
+  for entry in Path("/proc").iterdir():
+    if not entry.name.isdigit():
+      continue
+    try:
+      stat = (entry / "stat").read_text()
+    except OSError:
+      continue
+    # ppid is the 2nd field after the parenthesised command name.
+    ppid = int(stat.rsplit(")", 1)[1].split()[1])
+    if ppid == pid:
+      found.append(int(entry.name))
+  return found
+
+
+def is_worker(pid: int) -> bool:
+  try:
+    cmdline = (Path("/proc") / str(pid) / "cmdline").read_bytes()
+  except OSError:
+    return False
+  return b"resource_tracker" not in cmdline
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+  values: Dict[str, int] = {}
+  for line in (Path("/proc") / str(pid) / "smaps_rollup").read_text().splitlines():
+    parts = line.split()
+    if len(parts) == 3 and parts[2] == "kB":
+      values[parts[0].rstrip(":")] = int(parts[1])
+  return {
+    "rss": values.get("Rss", 0),
+    "pss": values.get("Pss", 0),
+    "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+    "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+  }
+
+
+def wait_ready(port: int, timeout: float) -> None:
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    try:
+      urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1).read()
+      return
+    except Exception:
+      time.sleep(0.3)
+  raise RuntimeError(f"server on port {port} did not become ready")
+
+
+def run_mode(mode: str, workers: int, port: int, requests_per_path: int) -> Dict[str, float]:
+  if mode == "uvicorn":
+    cmd = [sys.executable, "-m", "uvicorn", "app.app:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+  else:
+    cmd = [sys.executable, "-m", "app.serve", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+  proc = subprocess.Popen(cmd, cwd=str(BACKEND), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  try:
+    wait_ready(port, timeout=60)
+    # Several requests per path so every worker serves some of them.
+    for path in WARMUP_PATHS:
+      for _ in range(requests_per_path):
+        urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5).read()
+    time.sleep(1.0)
+    worker_pids = [p for p in children(proc.pid) if is_worker(p)]
+    samples = [memory_kb(p) for p in worker_pids]
+    master = memory_kb(proc.pid)
+  finally:
+    proc.send_signal(signal.SIGTERM)
+    try:
+      proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+      proc.kill()
+  n = max(1, len(samples))
+  return {
+    "workers": len(samples),
+    "worker_rss_mb": sum(s["rss"] for s in samples) / n / 1024,
+    "worker_pss_mb": sum(s["pss"] for s in samples) / n / 1024,
+    "worker_private_mb": sum(s["private"] for s in samples) / n / 1024,
+    "total_pss_mb": (master["pss"] + sum(s["pss"] for s in samples)) / 1024,
+  }
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Compare per-worker memory: plain uvicorn workers vs the pre-fork launcher.")
+  parser.add_argument("--workers", type=int, default=4)
+  parser.add_argument("--port", type=int, default=8091)
+  parser.add_argument("--requests", type=int, default=20, help="Warm-up requests per path")
+  parser.add_argument("--modes", default="uvicorn,prefork")
+  args = parser.parse_args()
+
+  if not Path("/proc/self/smaps_rollup").exists():
+    print("This benchmark reads /proc/<pid>/smaps_rollup and needs Linux.", file=sys.stderr)
+    return 2
+
+  print(f"{'mode':<10}{'workers':>8}{'RSS/worker':>13}{'PSS/worker':>13}{'private/worker':>16}{'total PSS':>12}")
+  for offset, mode in enumerate(m.strip() for m in args.modes.split(",") if m.strip()):
+    r = run_mode(mode, args.workers, args.port + offset, args.requests)
+    print(
+      f"{mode:<10}{r['workers']:>8}{r['worker_rss_mb']:>10.1f} MB{r['worker_pss_mb']:>10.1f} MB"
+      f"{r['worker_private_mb']:>13.1f} MB{r['total_pss_mb']:>9.1f} MB"
+    )
+  print("PSS splits shared pages between the processes mapping them; it is the per-worker cost to compare.")
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
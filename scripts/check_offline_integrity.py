@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
 import json
 import sys
+import time
 from pathlib import Path
 
 import yaml
@@ -9,6 +12,7 @@ import yaml
 ROOT = Path(__file__).resolve().parents[1]
 OFFLINE_PACK = ROOT / "data" / "offline_pack" / "offline_pack.json"
 SOURCES = ROOT / "data" / "rag_corpus" / "sources.yml"
+BACKEND = ROOT / "apps" / "kiosk-backend"
 
 
 def load_offline_entries(path: Path):
@@ -20,7 +24,72 @@ def load_offline_entries(path: Path):
   return []
 
 
+def make_embed_fn(out_path: Path, batch_size: int = 64):
+  from app.services.offline_pack_service import read_compiled, variant_embeddings
+  from app.services.rag_service import embed_texts, get_embed_model
+
+  model = get_embed_model()
+  # Vectors from the existing artifact, so unchanged variants are not re-embedded.
+  known = variant_embeddings(read_compiled(out_path) or {}, model)
+  stats = {"reused": 0, "embedded": 0}
+
+  def embed_fn(texts):
+    missing = [t for t in dict.fromkeys(texts) if t not in known]
+    for i in range(0, len(missing), batch_size):
+      batch = missing[i:i + batch_size]
+      for text, vec in zip(batch, embed_texts(batch, timeout=(10, 60))):
+        known[text] = vec
+    stats["embedded"] += len(missing)
+    stats["reused"] += len(texts) - len(missing)
+    return [known[t] for t in texts]
+
+  return embed_fn, model, stats
+
+
+def compile_pack(out_path: Path, embed: bool = False) -> int:
+  """Write the precompiled pack artifact the backend loads (and hot-reloads) at runtime."""
+  sys.path.insert(0, str(BACKEND))
+  from app.services.offline_pack_service import compile_offline_pack, parse_offline_entries, write_compiled
+
+  started = time.perf_counter()
+  raw = OFFLINE_PACK.read_bytes()
+  st = OFFLINE_PACK.stat()
+  embed_fn, embed_model, embed_stats = make_embed_fn(out_path) if embed else (None, "", None)
+  compiled = compile_offline_pack(
+    parse_offline_entries(raw),
+    source_sha256=hashlib.sha256(raw).hexdigest(),
+    source_mtime_ns=st.st_mtime_ns,
+    source_size=st.st_size,
+    embed_fn=embed_fn,
+    embed_model=embed_model,
+  )
+  write_compiled(compiled, out_path)
+  elapsed_ms = (time.perf_counter() - started) * 1000
+  variants = sum(len(v) for v in compiled["langs"].values())
+  print(
+    f"Compiled offline pack version={compiled['version']} entries={len(compiled['entries'])} "
+    f"variants={variants} -> {out_path} ({elapsed_ms:.1f} ms)"
+  )
+  if embed_stats is not None:
+    print(f"Embedded variants with {embed_model}: new={embed_stats['embedded']} reused={embed_stats['reused']}")
+  return 0
+
+
+def load_env() -> None:
+  try:
+    from dotenv import load_dotenv
+  except ImportError:
+    return
+  load_dotenv(ROOT / ".env", override=False)
+
+
 def main() -> int:
+  parser = argparse.ArgumentParser(description="Validate (and optionally compile) the offline pack.")
+  parser.add_argument("--compile", action="store_true", help="Write the precompiled runtime artifact after checks pass")
+  parser.add_argument("--out", type=str, default=None, help="Artifact path (default: offline_pack.compiled.npz next to the pack)")
+  parser.add_argument("--embed", action="store_true", help="With --compile: pre-embed question variants (needs OPENAI_API_KEY)")
+  args = parser.parse_args()
+
   if not OFFLINE_PACK.exists():
     print(f"ERROR: Missing offline pack at {OFFLINE_PACK}")
     return 2
@@ -50,6 +119,11 @@ def main() -> int:
     return 1
 
   print(f"Offline integrity check passed ({len(entries)} entries)")
+  if args.compile:
+    out_path = Path(args.out) if args.out else OFFLINE_PACK.with_suffix(".compiled.npz")
+    if args.embed:
+      load_env()
+    return compile_pack(out_path, embed=args.embed)
   return 0
 
 
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND = ROOT / "apps" / "kiosk-backend"
+
+
+def run_local(langs: Optional[List[str]], top_ks: List[int], repeats: int) -> Dict:
+  sys.path.insert(0, str(BACKEND))
+  try:
+    from dotenv import load_dotenv
+    load_dotenv(ROOT / ".env", override=False)
+    load_dotenv(BACKEND / ".env", override=False)
+  except ImportError:
+    pass
+  from app.services.rag_eval_service import evaluate_retrieval
+
+  return evaluate_retrieval(langs, top_ks, repeats=repeats).model_dump()
+
+
+def run_remote(url: str, langs: Optional[List[str]], top_ks: List[int], repeats: int) -> Dict:
+  import requests
+
+  resp = requests.post(
+    f"{url.rstrip('/')}/api/rag_test/eval",
+    json={"langs": langs, "top_ks": top_ks, "repeats": repeats},
+    timeout=3600,
+  )
+  resp.raise_for_status()
+  return resp.json()
+
+
+def _by_lang_k(report: Dict) -> Dict:
+  return {(l["lang"], a["top_k"]): a for l in report.get("langs", []) for a in l["at_k"]}
+
+
+def print_report(report: Dict, baseline: Optional[Dict]) -> None:
+  print(f"Index: {report['index_version'] or '(unversioned)'}  embed model: {report['embed_model']}  threshold: {report['threshold']}")
+  base = _by_lang_k(baseline) if baseline else {}
+  base_langs = {l["lang"]: l for l in baseline.get("langs", [])} if baseline else {}
+  for lang in report["langs"]:
+    line = f"\n{lang['lang']}: {lang['queries']} queries"
+    if lang["skipped"]:
+      line += f" ({lang['skipped']} skipped, no embedding)"
+    line += f"  MRR={lang['mrr']:.3f}"
+    if lang["lang"] in base_langs:
+      line += f" ({lang['mrr'] - base_langs[lang['lang']]['mrr']:+.3f})"
+    print(line)
+    print("  top_k  recall  hit_rate  p50_ms  p95_ms")
+    for at in lang["at_k"]:
+      row = f"  {at['top_k']:>5}  {at['recall']:.3f}   {at['hit_rate']:.3f}   {at['latency_p50_ms']:>6.1f}  {at['latency_p95_ms']:>6.1f}"
+      prev = base.get((lang["lang"], at["top_k"]))
+      if prev:
+        row += f"   recall {at['recall'] - prev['recall']:+.3f}"
+      print(row)
+    conf = lang["confidence"]
+    print(
+      f"  confidence mean={conf['mean']:.3f} p50={conf['p50']:.3f} "
+      f">=threshold={conf['above_threshold']:.1%} confident_misses={conf['confident_misses']}"
+    )
+    print("  histogram (0.0-1.0 by 0.1): " + " ".join(str(n) for n in conf["histogram"]))
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(description="Score retrieval against the offline pack's labeled question variants.")
+  parser.add_argument("--lang", action="append", default=None, help="Language to evaluate (repeatable; default all)")
+  parser.add_argument("--top-k", default="1,3,5,10", help="Comma-separated top_k values (default 1,3,5,10)")
+  parser.add_argument("--repeats", type=int, default=1, help="Timed retrieve() calls per query and top_k")
+  parser.add_argument("--stub", action="store_true", help="Use the offline stub embedder (index must be built with EMBED_PROVIDER=stub)")
+  parser.add_argument("--chroma-path", default=None, help="Evaluate this local index instead of CHROMA_PATH")
+  parser.add_argument("--url", default=None, help="Call a running backend (dev mode) instead of running in-process")
+  parser.add_argument("--out", default=None, help="Write the JSON report here")
+  parser.add_argument("--compare", default=None, help="Earlier JSON report to show recall/MRR deltas against")
+  args = parser.parse_args()
+
+  top_ks = sorted({int(k) for k in args.top_k.split(",") if k.strip()})
+  if args.stub:
+    os.environ["EMBED_PROVIDER"] = "stub"
+  if args.chroma_path:
+    os.environ["CHROMA_PATH"] = str(Path(args.chroma_path).resolve())
+
+  if args.url:
+    report = run_remote(args.url, args.lang, top_ks, args.repeats)
+  else:
+    report = run_local(args.lang, top_ks, args.repeats)
+
+  baseline = None
+  if args.compare:
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+  print_report(report, baseline)
+
+  if args.out:
+    Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+  if not any(l["queries"] for l in report["langs"]):
+    print("\nNo queries were evaluated (is the index built and the embedder reachable?)")
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -3,9 +3,12 @@ import io
 import json
 import os
 import re
+import shutil
 import sys
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from bisect import bisect_right
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 
 def repo_root() -> Path:
@@ -106,6 +109,176 @@ def chunk_text_chars(text: str, chunk_chars: int = 2000, overlap_chars: int = 20
   return chunks
 
 
+class Chunk(NamedTuple):
+  text: str
+  tokens: int
+  page_start: Optional[int] = None
+  page_end: Optional[int] = None
+
+
+_encoder = None
+_encoder_checked = False
+
+
+def count_tokens(text: str) -> int:
+  """Tokens in the embedding models' encoding (cl100k_base); about chars/4 without tiktoken."""
+  global _encoder, _encoder_checked
+  if not _encoder_checked:
+    _encoder_checked = True
+    try:
+      import tiktoken
+      _encoder = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+      print("tiktoken not installed; estimating tokens as characters / 4 (pip install tiktoken)")
+  if _encoder is not None:
+    return len(_encoder.encode(text, disallowed_special=()))
+  return max(1, (len(text) + 3) // 4)
+
+
+# Sentence ends: Latin . ! ?, Arabic question mark and full stop, ellipsis; optionally
+# followed by closing quotes/brackets, then whitespace and not a lowercase letter
+# (so "1.5", "e.g. the" or "approx. two" never split).
+_SENTENCE_END = re.compile(r"[.!?\u061f\u06d4\u2026]+[\"'\u201d\u2019\u00bb)\]]*(?=\s+(?![a-z\u00e0-\u00ff])|\s*$)")
+# Clause ends used to break sentences longer than the token budget (incl. Arabic comma/semicolon).
+_CLAUSE_END = re.compile(r"[,;:\u060c\u061b]+(?=\s)")
+_WORD = re.compile(r"\S+")
+
+Span = Tuple[int, int, int]  # (start, end, tokens) into the document text
+
+
+def _spans(text: str, start: int, end: int, pattern: "re.Pattern[str]") -> List[Tuple[int, int]]:
+  """[start, end) cut after every match of `pattern`, leading whitespace trimmed."""
+  out = []
+  pos = start
+  for m in pattern.finditer(text, start, end):
+    out.append((pos, m.end()))
+    pos = m.end()
+  out.append((pos, end))
+  trimmed = []
+  for a, b in out:
+    while a < b and text[a].isspace():
+      a += 1
+    if a < b:
+      trimmed.append((a, b))
+  return trimmed
+
+
+def _budget_spans(text: str, start: int, end: int, max_tokens: int) -> List[Span]:
+  """A sentence as spans of at most max_tokens: whole, else by clause, else by words."""
+  tokens = count_tokens(text[start:end])
+  if tokens <= max_tokens:
+    return [(start, end, tokens)]
+  out: List[Span] = []
+  clauses = _spans(text, start, end, _CLAUSE_END)
+  if len(clauses) > 1:
+    for a, b in clauses:
+      out.extend(_budget_spans(text, a, b, max_tokens))
+    return out
+  piece_start, piece_tokens, last_end = start, 0, start
+  for m in _WORD.finditer(text, start, end):
+    n = count_tokens(m.group(0)) + (1 if piece_tokens else 0)
+    if piece_tokens and piece_tokens + n > max_tokens:
+      out.append((piece_start, last_end, piece_tokens))
+      piece_start, piece_tokens = m.start(), count_tokens(m.group(0))
+    else:
+      piece_tokens += n
+    last_end = m.end()
+  out.append((piece_start, last_end, piece_tokens))
+  return out
+
+
+def chunk_text_sentences(
+  text: str,
+  max_tokens: int = 400,
+  overlap_tokens: int = 40,
+  min_tokens: int = 80,
+  page_offsets: Optional[List[int]] = None,
+  page_numbers: Optional[List[int]] = None,
+) -> List[Chunk]:
+  """Pack whole sentences into chunks of at most max_tokens.
+
+  Consecutive chunks share trailing sentences worth up to overlap_tokens
+  (none when the last sentence alone is longer). A final chunk under
+  min_tokens is folded into the one before it instead of becoming a stub.
+  `text` may span several pages: page_offsets[i] is where page_numbers[i]
+  starts, and each chunk records the pages it covers.
+  """
+  units: List[Span] = []
+  for a, b in _spans(text, 0, len(text), _SENTENCE_END):
+    units.extend(_budget_spans(text, a, b, max_tokens))
+  if not units:
+    return []
+
+  groups: List[List[Span]] = []
+  current: List[Span] = []
+  size = 0
+  carried = 0
+  for unit in units:
+    if current and size + unit[2] > max_tokens:
+      groups.append(current)
+      carry: List[Span] = []
+      carry_size = 0
+      for prev in reversed(current):
+        if carry_size + prev[2] > overlap_tokens:
+          break
+        carry.insert(0, prev)
+        carry_size += prev[2]
+      if carry_size + unit[2] > max_tokens:
+        carry, carry_size = [], 0
+      current, size, carried = carry, carry_size, len(carry)
+    current.append(unit)
+    size += unit[2]
+  if groups and size < min_tokens:
+    groups[-1] = groups[-1] + current[carried:]
+  else:
+    groups.append(current)
+
+  def page_at(offset: int) -> Optional[int]:
+    if not page_offsets or not page_numbers:
+      return None
+    return page_numbers[max(0, bisect_right(page_offsets, offset) - 1)]
+
+  return [
+    Chunk(
+      text=text[group[0][0]:group[-1][1]],
+      tokens=sum(u[2] for u in group),
+      page_start=page_at(group[0][0]),
+      page_end=page_at(group[-1][1] - 1),
+    )
+    for group in groups
+  ]
+
+
+def join_pages(pages: List[Tuple[int, str]]) -> Tuple[str, List[int], List[int]]:
+  """One document text from (page number, text) pairs plus each page's start offset."""
+  parts: List[str] = []
+  offsets: List[int] = []
+  numbers: List[int] = []
+  pos = 0
+  for number, page_text in pages:
+    page_text = normalize_text(page_text)
+    if not page_text:
+      continue
+    offsets.append(pos)
+    numbers.append(number)
+    parts.append(page_text)
+    pos += len(page_text) + 1
+  return " ".join(parts), offsets, numbers
+
+
+def chunk_stats(chunks: List[Chunk]) -> Dict[str, int]:
+  sizes = sorted(c.tokens for c in chunks)
+  if not sizes:
+    return {"chunks": 0, "tokens": 0, "min": 0, "median": 0, "max": 0}
+  return {
+    "chunks": len(sizes),
+    "tokens": sum(sizes),
+    "min": sizes[0],
+    "median": sizes[len(sizes) // 2],
+    "max": sizes[-1],
+  }
+
+
 def get_cache_dir(path_arg: Optional[str]) -> Path:
   if path_arg:
     base = Path(path_arg)
@@ -159,7 +332,18 @@ def get_pdf_reader(path: Path):
   return PdfReader(str(path))
 
 
+def use_backend_modules() -> None:
+  backend = str(repo_root() / "apps" / "kiosk-backend")
+  if backend not in sys.path:
+    sys.path.insert(0, backend)
+
+
 def embed_texts(texts: List[str]) -> List[List[float]]:
+  if os.getenv("EMBED_PROVIDER", "openai").strip().lower() == "stub":
+    # Same hashed vectors the backend uses for queries with EMBED_PROVIDER=stub.
+    use_backend_modules()
+    from app.services.stub_embed_service import stub_embed_texts
+    return stub_embed_texts(texts)
   api_key = os.getenv("OPENAI_API_KEY")
   if not api_key:
     raise RuntimeError("OPENAI_API_KEY is required for embeddings.")
@@ -180,6 +364,10 @@ def embed_texts(texts: List[str]) -> List[List[float]]:
     "model": model,
     "input": texts
   }
+  # Must match the backend's OPENAI_EMBED_DIMS: queries are embedded the same way.
+  dims = os.getenv("OPENAI_EMBED_DIMS", "").strip()
+  if dims:
+    payload["dimensions"] = int(dims)
   resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
   resp.raise_for_status()
   data = resp.json()
@@ -196,11 +384,33 @@ def _use_cloud() -> bool:
   return all(os.getenv(k) for k in ("CHROMA_API_KEY", "CHROMA_TENANT", "CHROMA_DATABASE"))
 
 
-def ingest_chunks(collection, src_id: str, title: str, url_or_path: str, lang: str, approved_by: str, approved_date: str, chunks: List[str], batch_size: int, page: Optional[int] = None, page_label: Optional[str] = None, page_start: Optional[int] = None, page_end: Optional[int] = None) -> int:
+def new_index_version_dir(base: Path) -> Tuple[str, Path]:
+  version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+  path = base / "versions" / version
+  path.mkdir(parents=True, exist_ok=False)
+  return version, path
+
+
+def publish_index_version(base: Path, version: str, keep: int) -> None:
+  """Point CURRENT at `version` atomically, then prune old versions.
+
+  Running backends pick up the new CURRENT via their index watcher (or SIGHUP).
+  The previous version is always kept so in-flight requests can finish on it.
+  """
+  pointer = base / "CURRENT"
+  tmp = base / "CURRENT.tmp"
+  tmp.write_text(version, encoding="utf-8")
+  os.replace(tmp, pointer)
+  versions = sorted(p.name for p in (base / "versions").iterdir() if p.is_dir())
+  for old in versions[:-max(2, keep)]:
+    shutil.rmtree(base / "versions" / old, ignore_errors=True)
+
+
+def ingest_chunks(collection, src_id: str, title: str, url_or_path: str, lang: str, approved_by: str, approved_date: str, chunks: List[Chunk], batch_size: int) -> int:
   total = 0
   for i in range(0, len(chunks), batch_size):
     batch = chunks[i:i+batch_size]
-    embeddings = embed_texts(batch)
+    embeddings = embed_texts([c.text for c in batch])
     ids = [f"{src_id}-{i+j}" for j in range(len(batch))]
     metadatas = [
       sanitize_metadata({
@@ -210,18 +420,38 @@ def ingest_chunks(collection, src_id: str, title: str, url_or_path: str, lang: s
         "lang": lang,
         "approved_by": approved_by,
         "approved_date": approved_date,
-        "page": page,
-        "page_label": page_label,
-        "page_start": page_start,
-        "page_end": page_end
+        "page": c.page_start,
+        "page_start": c.page_start,
+        "page_end": c.page_end,
+        "tokens": c.tokens
       })
-      for _ in batch
+      for c in batch
     ]
-    collection.add(ids=ids, documents=batch, embeddings=embeddings, metadatas=metadatas)
+    collection.add(ids=ids, documents=[c.text for c in batch], embeddings=embeddings, metadatas=metadatas)
     total += len(batch)
   return total
 
 
+def chunk_document(pages: List[Tuple[Optional[int], str]], args: argparse.Namespace) -> List[Chunk]:
+  """Chunks for a whole source; pages are (page number or None, text)."""
+  if args.chunker == "chars":
+    chunks = []
+    for number, page_text in pages:
+      for piece in chunk_text_chars(page_text, chunk_chars=args.chunk_chars, overlap_chars=args.overlap_chars):
+        chunks.append(Chunk(piece, count_tokens(piece), number, number))
+    return chunks
+  text, offsets, numbers = join_pages(pages)
+  paged = any(n is not None for n in numbers)
+  return chunk_text_sentences(
+    text,
+    max_tokens=args.chunk_tokens,
+    overlap_tokens=args.overlap_tokens,
+    min_tokens=args.min_chunk_tokens,
+    page_offsets=offsets if paged else None,
+    page_numbers=numbers if paged else None,
+  )
+
+
 def main() -> int:
   parser = argparse.ArgumentParser()
   parser.add_argument("--reset", action="store_true", help="Reset the collection")
@@ -229,10 +459,18 @@ def main() -> int:
   parser.add_argument("--refresh", action="store_true", help="Re-download sources even if cached")
   parser.add_argument("--max-sources", type=int, default=None)
   parser.add_argument("--max-pages", type=int, default=None)
-  parser.add_argument("--chunk-chars", type=int, default=2000)
-  parser.add_argument("--overlap-chars", type=int, default=200)
+  parser.add_argument("--chunker", choices=("sentences", "chars"), default="sentences", help="sentences: token-budgeted, sentence-aligned, across pages; chars: fixed windows per page")
+  parser.add_argument("--chunk-tokens", type=int, default=400, help="Token budget per chunk (sentences chunker)")
+  parser.add_argument("--overlap-tokens", type=int, default=40, help="Trailing sentences repeated in the next chunk, up to this many tokens")
+  parser.add_argument("--min-chunk-tokens", type=int, default=80, help="A final chunk smaller than this joins the previous one")
+  parser.add_argument("--chunk-chars", type=int, default=2000, help="Window size (chars chunker)")
+  parser.add_argument("--overlap-chars", type=int, default=200, help="Window overlap (chars chunker)")
   parser.add_argument("--batch-size", type=int, default=32)
+  parser.add_argument("--compact", choices=("none", "int8", "f16"), default="none", help="Also write a quantized copy for VECTOR_STORE=compact")
+  parser.add_argument("--compact-dims", type=int, default=None, help="Shorten vectors in the compact copy to this many dims")
   parser.add_argument("--cache-dir", type=str, default=None)
+  parser.add_argument("--versioned", action="store_true", help="Build into a new versions/<ts> dir and switch CURRENT to it when done")
+  parser.add_argument("--keep-versions", type=int, default=3, help="Index versions to keep with --versioned (min 2)")
   args = parser.parse_args()
 
   sources = load_sources()
@@ -265,8 +503,13 @@ def main() -> int:
   else:
     chroma_path = get_chroma_path()
     Path(chroma_path).mkdir(parents=True, exist_ok=True)
-    client = chromadb.PersistentClient(path=chroma_path)
-    print(f"Using local Chroma  path={chroma_path}")
+    if args.versioned:
+      index_version, version_path = new_index_version_dir(Path(chroma_path))
+      client = chromadb.PersistentClient(path=str(version_path))
+      print(f"Using local Chroma  path={version_path}  (new version {index_version})")
+    else:
+      client = chromadb.PersistentClient(path=chroma_path)
+      print(f"Using local Chroma  path={chroma_path}")
   collection = client.get_or_create_collection(name="umrah_sources")
   if args.reset:
     try:
@@ -275,6 +518,7 @@ def main() -> int:
       pass
 
   total_chunks = 0
+  all_chunks: List[Chunk] = []
   max_sources = args.max_sources if args.max_sources and args.max_sources > 0 else None
 
   for idx, src in enumerate(sources):
@@ -309,6 +553,7 @@ def main() -> int:
       print(f"Failed to fetch {src_id}: {e}")
       continue
 
+    pages: List[Tuple[Optional[int], str]] = []
     if src_type == "pdf":
       try:
         reader = get_pdf_reader(path)
@@ -316,30 +561,15 @@ def main() -> int:
         print(f"Failed to open PDF {src_id}: {e}")
         continue
 
-      pages = reader.pages
       max_pages = args.max_pages if args.max_pages and args.max_pages > 0 else None
-      for page_idx, page in enumerate(pages):
+      for page_idx, page in enumerate(reader.pages):
         if max_pages and page_idx >= max_pages:
           break
         try:
           text = page.extract_text() or ""
         except Exception:
           text = ""
-        chunks = chunk_text_chars(text, chunk_chars=args.chunk_chars, overlap_chars=args.overlap_chars)
-        if not chunks:
-          continue
-        total_chunks += ingest_chunks(
-          collection,
-          src_id=f"{src_id}-p{page_idx+1}",
-          title=title,
-          url_or_path=source_url,
-          lang=lang,
-          approved_by=approved_by,
-          approved_date=approved_date,
-          chunks=chunks,
-          batch_size=args.batch_size,
-          page=page_idx+1
-        )
+        pages.append((page_idx + 1, text))
     else:
       try:
         if path.exists():
@@ -352,21 +582,55 @@ def main() -> int:
       except Exception as e:
         print(f"Failed to read HTML {src_id}: {e}")
         continue
-      chunks = chunk_text_chars(text, chunk_chars=args.chunk_chars, overlap_chars=args.overlap_chars)
-      if not chunks:
-        continue
-      total_chunks += ingest_chunks(
-        collection,
-        src_id=src_id,
-        title=title,
-        url_or_path=source_url,
-        lang=lang,
-        approved_by=approved_by,
-        approved_date=approved_date,
-        chunks=chunks,
-        batch_size=args.batch_size
-      )
+      pages.append((None, text))
 
+    chunks = chunk_document(pages, args)
+    if not chunks:
+      continue
+    stats = chunk_stats(chunks)
+    print(f"  {stats['chunks']} chunks, {stats['tokens']} tokens (min {stats['min']} / median {stats['median']} / max {stats['max']})")
+    all_chunks.extend(chunks)
+    total_chunks += ingest_chunks(
+      collection,
+      src_id=src_id,
+      title=title,
+      url_or_path=source_url,
+      lang=lang,
+      approved_by=approved_by,
+      approved_date=approved_date,
+      chunks=chunks,
+      batch_size=args.batch_size
+    )
+
+  if not _use_cloud():
+    use_backend_modules()
+    from app.services.vector_store_service import COMPACT_DIR, build_compact_index
+    index_dir = version_path if args.versioned else Path(chroma_path)
+    if args.compact != "none" and total_chunks:
+      info = build_compact_index(collection, index_dir / COMPACT_DIR, dims=args.compact_dims, precision=args.compact)
+      print(
+        f"Compact index: {info['precision']} {info['dims']} dims, {info['resident_bytes'] / 1e6:.1f} MB resident "
+        f"({info['full_precision_bytes'] / 1e6:.1f} MB at float32 {info['source_dims']} dims)"
+      )
+    elif (index_dir / COMPACT_DIR).exists():
+      # The collection changed under it; VECTOR_STORE=compact would keep serving the old vectors.
+      shutil.rmtree(index_dir / COMPACT_DIR)
+      print(f"Removed stale compact index at {index_dir / COMPACT_DIR}; VECTOR_STORE=compact falls back to Chroma")
+
+  if args.versioned and not _use_cloud():
+    if total_chunks == 0:
+      print(f"No chunks ingested; CURRENT left unchanged (empty version {index_version}).")
+      return 1
+    publish_index_version(Path(chroma_path), index_version, args.keep_versions)
+    print(f"Published index version {index_version}")
+
+  stats = chunk_stats(all_chunks)
+  if stats["chunks"]:
+    small = sum(1 for c in all_chunks if c.tokens < args.min_chunk_tokens)
+    print(
+      f"Chunks: {stats['chunks']}  tokens: {stats['tokens']} (mean {stats['tokens'] // stats['chunks']}, "
+      f"min {stats['min']} / median {stats['median']} / max {stats['max']})  under {args.min_chunk_tokens} tokens: {small}"
+    )
   print(f"Done. Total chunks: {total_chunks}. Chroma path: {chroma_path}")
   return 0
 